@@ -2,7 +2,15 @@
 // Рендер Боевого пропуска + кнопки 1–10/…/91–100 (две полосы на 1 картинке: 1–5 и 6–10)
 const { ActionRowBuilder, ButtonBuilder, ButtonStyle, EmbedBuilder } = require('discord.js');
 const config = require('../config');
-const { calculateXPProgress, calculateLevel, getUser } = require('../database/userManager');
+const { calculateXPProgress, calculateLevel, getUser, listUsers } = require('../database/userManager');
+const bpRenderer = require('../utils/bpRenderer');
+const bpMetrics = require('../utils/bpMetrics');
+
+// Ответ без отрисованной картинки (embed покажет статичный URL) — в метрики
+function fallback(reason) {
+  bpMetrics.inc('bp_render_fallbacks_total', 'Battle-pass replies sent without a rendered image', { reason });
+  return null;
+}
 
 function clampPage(p) { return Math.max(1, Math.min(10, Number.isFinite(p) ? p : 1)); }
 function pageLabel(p) { const s=(p-1)*10+1, e=p*10; return `${s}–${e}`; }
@@ -195,9 +203,7 @@ module.exports.defaultLevelToPage = function(level) {
  * @returns {Promise<null|{attachment: Buffer, name: string}>}
  */
 module.exports.generateImageAttachment = async function(user, page, level, totalXP) {
-  const { execFile } = require('child_process');
   const fs = require('fs');
-  const os = require('os');
   const path = require('path');
 
   const bp = config.battlePass || {};
@@ -205,9 +211,9 @@ module.exports.generateImageAttachment = async function(user, page, level, total
 
   // 1) Находим локальную картинку страницы
   let imagePath = bp.imagePaths?.[rangeKey] || bp.imagePaths?.['1-10'];
-  if (!imagePath) return null;
+  if (!imagePath) return fallback('no_page');
   imagePath = path.resolve(path.join(__dirname, '..'), imagePath);
-  if (!fs.existsSync(imagePath)) return null;
+  if (!fs.existsSync(imagePath)) return fallback('no_page');
 
   // 2) Считаем долю внутри уровня (для текущего уровня)
   const prog = calculateXPProgress(totalXP || 0);
@@ -236,39 +242,38 @@ module.exports.generateImageAttachment = async function(user, page, level, total
   const rafflePoints = Number(fullUser.rafflePoints || 0);
   const cardPacksCount = Number(fullUser.cardPacks || 0);
 
-  // 3) Геометрия полос из конфигурации (в процентах от картинки)
-  const bars = bp.progressBars || {
-    // Запасной план на случай, если конфигурация не определена. Значения
-    // подобраны под новую цветную разметку 1–10 (левая колонка FREE/PREM,
-    // правая белая область для инфо‑блоков).
-    xPct: 15,
-    widthPct: 67.5,
-    top: { yPct: 16, heightPct: 3.2 },
-    bottom: { yPct: 61, heightPct: 3.2 }
+  // 3) Геометрия полос (в процентах от картинки) из профиля рендера
+  // (config.bp_render.json) — только из версии, которую принял и Python.
+  // Чего в профиле нет (или профиль отвергнут) — из battlePass.progressBars
+  const fb = bp.progressBars || {};
+  const bars = {
+    xPct: fb.xPct ?? 7.65,
+    widthPct: fb.widthPct ?? 58.68,
+    topY: fb.top?.yPct ?? fb.top?.y ?? 6.5,
+    topH: fb.top?.heightPct ?? fb.top?.h ?? 42.7,
+    botY: fb.bottom?.yPct ?? fb.bottom?.y ?? 54.1,
+    botH: fb.bottom?.heightPct ?? fb.bottom?.h ?? 42.7,
+    ...bpRenderer.profileGeometry()
   };
 
   // 4) Путь к скрипту-оверлею
-  const scriptPath = path.join(__dirname, '..', 'scripts', 'overlay_bp_progress.py');
-  if (!fs.existsSync(scriptPath)) return null;
-
-  // 5) Запускаем скрипт
-  const tmpDir = fs.mkdtempSync(path.join(os.tmpdir(), 'bp-'));
-  const outPath = path.join(tmpDir, `bp_${rangeKey}_${user.id || 'u'}.png`);
+  if (!fs.existsSync(bpRenderer.SCRIPT_PATH)) return fallback('no_script');
 
+  // 5) Запускаем скрипт. Выход '-' — картинка приходит байтами, без временных файлов
   const pageStart = (page - 1) * 10 + 1;
 
   const args = [
     imagePath,
-    outPath,
+    '-',
     String(pageStart),             // от какого уровня начинается страница
     String(level),                 // текущий уровень пользователя
     String(levelFrac),             // доля внутри текущего уровня (0..1)
     String(bars.xPct),
     String(bars.widthPct),
-    String(bars.top?.yPct ?? 11),
-    String(bars.top?.heightPct ?? 3),
-    String(bars.bottom?.yPct ?? 92),
-    String(bars.bottom?.heightPct ?? 3)
+    String(bars.topY),
+    String(bars.topH),
+    String(bars.botY),
+    String(bars.botH)
   ];
 
   // 5.1) Добавляем дополнительные параметры для скрипта, если все данные присутствуют
@@ -286,34 +291,87 @@ module.exports.generateImageAttachment = async function(user, page, level, total
     String(cardPacksCount)
   );
 
-  // 5.2) Подготавливаем окружение для скрипта. В дополнение к стандартным 
-  // переменным окружения передаём цвета для каждой половинки полосы, если они определены
+  // 5.2) Окружение скрипта. Цвета полос и сдвиги панели скрипт берёт из
+  // профиля рендера сам, здесь только профиль кодирования и трассировка
   const env = { ...process.env };
-  try {
-    const colors = bp.progressBarColors || {};
-    function setColor(prefix, obj) {
-      if (!obj) return;
-      const { r, g, b, a } = obj;
-      if (typeof r === 'number') env[`${prefix}_R`] = String(r);
-      if (typeof g === 'number') env[`${prefix}_G`] = String(g);
-      if (typeof b === 'number') env[`${prefix}_B`] = String(b);
-      if (typeof a === 'number') env[`${prefix}_A`] = String(a);
-    }
-    setColor('BP_BAR_TOP_FREE', colors.top?.free);
-    setColor('BP_BAR_TOP_PREM', colors.top?.premium);
-    setColor('BP_BAR_BOT_FREE', colors.bottom?.free);
-    setColor('BP_BAR_BOT_PREM', colors.bottom?.premium);
-  } catch {}
+  // Профиль кодирования картинки (fast | balanced | small | webp), см. scripts/bp_encode.py
+  if (bp.encoder) env.BP_ENCODER = String(bp.encoder);
 
-  await new Promise((resolve, reject) => {
-    execFile('python', [scriptPath, ...args], { timeout: 15000, env }, (err, _so, se) => {
-      if (err) reject(new Error(se || err.message));
-      else resolve();
-    });
-  });
+  // Трассировка стадий рендера (BP_TRACE=1|mem или battlePass.trace в конфиге)
+  if (bp.trace && !env.BP_TRACE) env.BP_TRACE = bp.trace === 'mem' ? 'mem' : '1';
+
+  // Рендер идёт через долгоживущий процесс (utils/bpRenderer.js). Бюджет
+  // времени (battlePass.renderBudgetMs) — чтобы ответ успел до истечения
+  // взаимодействия; при нехватке картинка упрощается, а не падает
+  const t0 = Date.now();
+  let res;
+  try {
+    res = await bpRenderer.render(args, env, bp.renderBudgetMs);
+  } catch (e) {
+    fallback(e?.code === 'EBPBUSY' ? 'busy' : 'error');
+    throw e;
+  }
+  if (res?.degraded) console.warn('[BP degraded]', JSON.stringify({ page, nodeMs: Date.now() - t0, degraded: res.degraded }));
+  if (res?.trace) {
+    // nodeMs — от отправки задания до получения байтов (запуск процесса/IPC + рендер)
+    console.log('[BP trace]', JSON.stringify({ page, nodeMs: Date.now() - t0, pyMs: res.ms, ...res.trace }));
+  }
 
   // 6) Возвращаем готовое изображение
-  const buf = await fs.promises.readFile(outPath);
-  const name = `bp_${rangeKey}.png`;
+  if (!res?.data) return fallback('no_data');
+  const buf = res.data;
+  const name = `bp_${rangeKey}.${res?.format || 'png'}`;
   return { attachment: buf, name };
 };
+
+/**
+ * Таблица лидеров БП одной картинкой: топ игроков по XP, по строке на игрока.
+ * Пользователи читаются из базы одним запросом (listUsers), рендер — одно
+ * задание пулу вместо отдельной картинки на каждого.
+ *
+ * @param {number} limit сколько мест показать (25..100)
+ * @param {(ids: string[]) => Promise<Object<string, string>>} [resolveNames] id -> отображаемое имя
+ * @returns {Promise<null|{attachment: Buffer, name: string, count: number}>}
+ */
+module.exports.generateLeaderboardAttachment = async function(limit = 25, resolveNames) {
+  const bp = config.battlePass || {};
+  const count = Math.max(25, Math.min(100, Number(limit) || 25));
+  const users = (await listUsers())
+    .filter((u) => typeof u.xp === 'number')
+    .sort((a, b) => b.xp - a.xp)
+    .slice(0, count);
+  if (!users.length) return null;
+
+  let names = {};
+  if (resolveNames) {
+    try {
+      names = (await resolveNames(users.map((u) => u.id))) || {};
+    } catch (e) {
+      console.error('[BP leaderboard names]', e?.message || e);
+    }
+  }
+  const rows = users.map((u) => {
+    const prog = calculateXPProgress(u.xp || 0);
+    return {
+      name: names[u.id] || String(u.id),
+      level: calculateLevel(u.xp || 0),
+      xpCur: prog.currentXP,
+      xpNeed: prog.neededXP,
+      premium: u.premium ? 1 : 0
+    };
+  });
+
+  const env = { ...process.env };
+  if (bp.encoder) env.BP_ENCODER = String(bp.encoder);
+  const t0 = Date.now();
+  let res;
+  try {
+    res = await bpRenderer.renderLeaderboard(rows, { title: `Топ-${rows.length} боевого пропуска` }, env, bp.renderBudgetMs);
+  } catch (e) {
+    fallback(e?.code === 'EBPBUSY' ? 'busy' : 'error');
+    throw e;
+  }
+  if (res?.degraded) console.warn('[BP degraded]', JSON.stringify({ leaderboard: rows.length, nodeMs: Date.now() - t0, degraded: res.degraded }));
+  if (!res?.data) return fallback('no_data');
+  return { attachment: res.data, name: `bp_top${rows.length}.${res.format || 'png'}`, count: rows.length };
+};
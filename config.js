@@ -33,6 +33,10 @@ module.exports = {
         '81-90': 'assets/bp/81-90.png',
        '91-100': 'assets/bp/91-100.png'
     },
+    // Запасная геометрия полос: рабочие геометрия и цвета полос — в профиле
+    // рендера config.bp_render.json (правка подхватывается без перезапуска).
+    // Эти значения берутся, только если профиля нет, он не прошёл проверку
+    // или в нём нет нужного ключа.
     progressBars: {
       // Параметры геометрии полос прогресса под новую разметку 1‑10.
       // Новая картинка имеет широкую белую область справа под инфо‑блоки,
@@ -46,24 +50,6 @@ module.exports = {
       bottom: { yPct: 54.1, heightPct: 42.7 }
     },
 
-    // Цвета для каждой из четырёх половинок полосы прогресса. 
-    // Начиная с версии, в которой полосы разделены на бесплатную (free) и премиальную (premium) части,
-    // можно задать собственные цвета для каждой половинки. Цвет задаётся как объект { r, g, b, a }.
-    // Пара «top» описывает верхнюю строку уровней (1–5), «bottom» — нижнюю (6–10). 
-    // Внутри каждой пары можно указать цвета для free и premium половинок. Если цвет не указан, 
-    // будет использован общий цвет из переменных BP_BAR_R/G/B/ALPHA либо дефолт.
-    progressBarColors: {
-      top: {
-        free:  { r: 14, g: 121, b: 169, a: 150 },
-        premium: { r: 64, g: 128, b: 255, a: 150 }
-      },
-      bottom: {
-        free: { r: 14, g: 121, b: 169, a: 150 }  ,
-        premium: { r: 64, g: 128, b: 255, a: 150 }
-      }
-    },
-
-
     rewardsCompact: {
       free: {
         cardPacks:    { "1\\6\\11\\16\\21\\26\\31\\36\\41\\46\\51\\56\\61\\66\\71\\76\\81\\86\\91\\96": 1, 
@@ -38,6 +38,13 @@ async function setUser(userId, data){
   return merged;
 }
 
+// Все пользователи одним чтением базы (list по префиксу), без N вызовов getUser
+async function listUsers(){
+  const db = getDB();
+  const all = (await db.list('user_')) || {};
+  return Object.entries(all).map(([k, u]) => ({ ...DEFAULT_USER, id: k.slice(5), ...u }));
+}
+
 function xpForLevel(level){
   const th = config?.battlePass?.xpThresholds;
   if (Array.isArray(th) && th[level-1]!=null) return th[level-1];
@@ -275,4 +282,4 @@ async function reapplyRewardsForUser(userId, includeXP = false) {
   return { level: lvl, deltas };
 }
 
-module.exports = { getUser, setUser, addXP, calculateLevel, calculateXPProgress, reapplyRewardsForUser };
+module.exports = { getUser, setUser, listUsers, addXP, calculateLevel, calculateXPProgress, reapplyRewardsForUser };
@@ -107,6 +107,13 @@ client.once(Events.ClientReady, async () => {
    * а реальная проверка доступа выполняется в isWhitelisted().
    */
 
+  // Метрики рендера БП (BP_METRICS_PORT / BP_METRICS_FILE, см. utils/bpMetrics.js)
+  try {
+    require('./utils/bpMetrics').startMetrics();
+  } catch (e) {
+    console.error('[index] Failed to start BP metrics:', e);
+  }
+
   // Запускаем ежедневное создание бэкапов через scheduleDailyBackup.
   try {
     scheduleDailyBackup();
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк рендеров БП (overlay_bp_progress.py и render_bp_image.py).
+
+Прогоняет все assets/bp/*.png по сетке уровней, долей уровня, длин счётчиков
+и premium/не-premium и меряет по стадиям:
+
+  bars       draw_split_pair_progress (обе пары полос)
+  layout     layout_info — подбор размеров шрифтов и раскладка панели
+  paint      paint_glyphs — отрисовка панели
+  composite  сборка картинки без полос и панели (копия подложки,
+             alpha_composite, конвертация в RGB)
+  render     вся сборка целиком (render)
+  encode     bp_encode.encode выбранным профилем
+  grid       render_bp_image.render_page (запасной рендер), grid_half — в 0.5x
+  grid_encode  кодирование картинки запасного рендера
+
+Для каждой стадии — p50/p90/p99/среднее/максимум в мс, плюс пик памяти
+(tracemalloc для Python-объектов на коротком отдельном прогоне и ru_maxrss
+процесса там, где он есть).
+
+  python scripts/bench_bp.py                       # прогон и отчёт
+  python scripts/bench_bp.py --save bench.json     # сохранить как базу
+  python scripts/bench_bp.py --compare bench.json  # сравнить с базой
+
+Опции:
+  --step N         брать каждое N-е сочетание сетки (по умолчанию 1)
+  --encoder=NAME   профиль кодирования (по умолчанию BP_ENCODER / balanced)
+  --no-encode      не кодировать (только рисование)
+  --threshold X    допустимый рост p50 при сравнении, доля (0.15 = +15 %)
+  --min-ms X       рост меньше X мс не считается регрессией (0.3)
+
+При --compare код выхода 1, если хоть одна стадия медленнее базы сверх
+порога, — удобно для проверки перед коммитом.
+"""
+import json, math, os, platform, sys, time, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+# Кэш готовых картинок мерил бы сам себя; остальные кэши — часть рендера
+os.environ.setdefault('BP_RESULT_CACHE', 'off')
+
+import bp_encode
+import overlay_bp_progress as bp
+
+# Геометрия полос из профиля рендера (config.bp_render.json, geometry)
+GEOMETRY = {'xPct': 7.65, 'widthPct': 58.68, 'topY': 6.5, 'topH': 42.7, 'botY': 54.1, 'botH': 42.7}
+LEVEL_OFFSETS = (-1, 0, 2, 4, 5, 7, 9, 10)    # относительно начала страницы
+FRACS = (0.0, 0.37, 0.99)
+COUNTERS = (7, 42, 512, 9999)                # 1..4 цифры
+
+def page_files():
+    d = os.path.join(ROOT, 'assets', 'bp')
+    pages = []
+    for name in os.listdir(d):
+        stem = name[:-4] if name.lower().endswith('.png') else None
+        if stem and '-' in stem and stem.split('-')[0].isdigit():
+            pages.append((int(stem.split('-')[0]), os.path.join(d, name)))
+    return sorted(pages)
+
+def sweep(step=1):
+    """Задания сетки.  Длина счётчиков и premium перебираются по кругу, чтобы
+    сетка оставалась обозримой, но каждая страница видела все варианты."""
+    jobs = []
+    i = 0
+    for page_start, path in page_files():
+        for off in LEVEL_OFFSETS:
+            lvl = page_start + off
+            if not 1 <= lvl <= 100:
+                continue
+            for frac in FRACS:
+                n = COUNTERS[i % len(COUNTERS)]
+                job = dict(GEOMETRY, **{
+                    'in': path, 'out': '-', 'pageStart': page_start, 'curLvl': lvl, 'lvlFrac': frac,
+                    'level': lvl, 'xpCur': n, 'xpNeed': max(n, 100) * 2, 'premium': (i // len(COUNTERS)) % 2,
+                    'invites': n % 6, 'ddTokens': n, 'raffle': n, 'packs': n,
+                })
+                if i % step == 0:
+                    jobs.append(job)
+                i += 1
+    return jobs
+
+class Timings:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, ms):
+        self.samples.setdefault(stage, []).append(ms)
+
+    def wrap(self, module, name, stage):
+        """Подменяет module.name обёрткой, которая копит время вызова в stage."""
+        fn = getattr(module, name)
+        def timed(*a, **kw):
+            t0 = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                self._pending[stage] = self._pending.get(stage, 0.0) + (time.perf_counter() - t0) * 1000.0
+        setattr(module, name, timed)
+
+    def begin(self):
+        self._pending = {}
+
+    def commit(self):
+        for stage, ms in self._pending.items():
+            self.add(stage, ms)
+        return self._pending
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q
+    lo = math.floor(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def summarize(samples):
+    out = {}
+    for stage, vals in samples.items():
+        s = sorted(vals)
+        out[stage] = {
+            'n': len(s),
+            'p50': round(percentile(s, 0.50), 3),
+            'p90': round(percentile(s, 0.90), 3),
+            'p99': round(percentile(s, 0.99), 3),
+            'mean': round(sum(s) / len(s), 3),
+            'max': round(s[-1], 3),
+        }
+    return out
+
+def _maxrss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return round(rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0, 1)
+
+def bench_overlay(jobs, encoder, do_encode, t):
+    t.wrap(bp, 'draw_split_pair_progress', 'bars')
+    t.wrap(bp, 'layout_info', 'layout')
+    t.wrap(bp, 'paint_glyphs', 'paint')
+    for job in jobs:
+        t.begin()
+        t0 = time.perf_counter()
+        img = bp.render(job)
+        total = (time.perf_counter() - t0) * 1000.0
+        stages = t.commit()
+        t.add('render', total)
+        t.add('composite', total - sum(stages.values()))
+        if do_encode:
+            _, info = bp_encode.encode(img, encoder)
+            t.add('encode', info['encode_ms'])
+
+def bench_grid(encoder, do_encode, t):
+    """Запасной рендер: все десять страниц на нескольких уровнях и масштабах."""
+    import render_bp_image as rbi
+    for scale in (1.0, 0.5):
+        for page in range(1, 11):
+            ps = (page - 1) * 10 + 1
+            for lvl, prog, prem in ((ps, 0.0, False), (ps + 4, 0.5, True), (ps + 9, 0.99, True)):
+                t0 = time.perf_counter()
+                try:
+                    img = rbi.render_page(page, lvl, prog, prem, scale)
+                except Exception as e:
+                    return f"{type(e).__name__}: {e}"
+                t.add('grid' if scale == 1.0 else 'grid_half', (time.perf_counter() - t0) * 1000.0)
+                if do_encode and scale == 1.0:
+                    _, info = bp_encode.encode(img, encoder)
+                    t.add('grid_encode', info['encode_ms'])
+    return None
+
+def run(step=1, encoder=None, do_encode=True):
+    encoder, _ = bp_encode.get_profile(encoder)
+    jobs = sweep(step)
+    t = Timings()
+    # Прогрев: декодирование подложек и первая растеризация шрифтов — это
+    # холодный старт, а не стоимость рендера
+    bp.warm_bases()
+    for job in jobs[:3]:
+        bp.render(job)
+    t_start = time.perf_counter()
+    bench_overlay(jobs, encoder, do_encode, t)
+    grid_error = bench_grid(encoder, do_encode, t)
+    wall = time.perf_counter() - t_start
+    # Пик памяти — отдельным коротким прогоном: tracemalloc заметно
+    # замедляет Python-код и исказил бы тайминги
+    tracemalloc.start()
+    for job in jobs[:8]:
+        img = bp.render(job)
+        if do_encode:
+            bp_encode.encode(img, encoder)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    from PIL import __version__ as pil_version
+    return {
+        'meta': {
+            'python': platform.python_version(), 'pillow': pil_version, 'platform': platform.platform(),
+            'encoder': encoder if do_encode else None, 'jobs': len(jobs), 'step': step,
+            'wall_s': round(wall, 2), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'memory': {'tracemalloc_peak_mb': round(peak / (1024.0 * 1024.0), 2), 'maxrss_mb': _maxrss_mb()},
+        'stages': summarize(t.samples),
+        'errors': {'grid': grid_error} if grid_error else {},
+    }
+
+def compare(result, baseline, threshold, min_ms):
+    """-> список регрессий [(stage, было, стало)] по p50."""
+    regressions = []
+    for stage, cur in result['stages'].items():
+        base = baseline.get('stages', {}).get(stage)
+        if not base:
+            continue
+        delta = cur['p50'] - base['p50']
+        if delta > min_ms and delta > base['p50'] * threshold:
+            regressions.append((stage, base['p50'], cur['p50']))
+    return regressions
+
+def print_report(result, baseline=None):
+    m = result['meta']
+    print(f"{m['jobs']} jobs, encoder={m['encoder']}, python {m['python']}, Pillow {m['pillow']}, {m['wall_s']} s")
+    print(f"{'stage':<12}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'mean':>10}{'max':>10}" +
+          (f"{'base p50':>12}{'diff':>9}" if baseline else ''))
+    for stage, st in result['stages'].items():
+        line = f"{stage:<12}{st['n']:>6}{st['p50']:>10.3f}{st['p90']:>10.3f}{st['p99']:>10.3f}{st['mean']:>10.3f}{st['max']:>10.3f}"
+        base = (baseline or {}).get('stages', {}).get(stage)
+        if base:
+            diff = (st['p50'] - base['p50']) / base['p50'] * 100.0 if base['p50'] else 0.0
+            line += f"{base['p50']:>12.3f}{diff:>+8.1f}%"
+        print(line)
+    mem = result['memory']
+    print(f"peak memory: tracemalloc {mem['tracemalloc_peak_mb']} MB, maxrss {mem['maxrss_mb']} MB")
+    for name, err in result['errors'].items():
+        print(f"{name}: skipped ({err})")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    opts = {'step': 1, 'encoder': None, 'encode': True, 'save': None, 'compare': None,
+            'threshold': 0.15, 'min_ms': 0.3}
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a.startswith('--encoder='):
+            opts['encoder'] = a.split('=', 1)[1]
+        elif a == '--no-encode':
+            opts['encode'] = False
+        elif a in ('--step', '--save', '--compare', '--threshold', '--min-ms') and i + 1 < len(argv):
+            i += 1
+            key = a[2:].replace('-', '_')
+            opts[key] = argv[i] if key in ('save', 'compare') else (int if key == 'step' else float)(argv[i])
+        else:
+            print(__doc__)
+            return 2
+        i += 1
+
+    result = run(max(1, opts['step']), opts['encoder'], opts['encode'])
+    baseline = None
+    if opts['compare']:
+        with open(opts['compare'], 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if opts['save']:
+        with open(opts['save'], 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved to {opts['save']}")
+    if baseline is not None:
+        regressions = compare(result, baseline, opts['threshold'], opts['min_ms'])
+        for stage, was, now in regressions:
+            print(f"REGRESSION {stage}: p50 {was:.3f} -> {now:.3f} ms")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Профили кодирования картинок БП (общие для overlay_bp_progress.py и
+render_bp_image.py).
+
+Арт страниц — плоские заливки, поэтому палитровый PNG выходит в разы меньше
+обычного, а низкий compress_level экономит CPU, когда задержка важнее байтов.
+Профиль выбирается через BP_ENCODER (или явно из кода):
+
+  fast      PNG, compress_level=1   — быстрее всего, файл крупнее
+  balanced  PNG, compress_level=6   — как было раньше (по умолчанию)
+  small     PNG с палитрой 256 цветов без дизеринга — меньше всего, слегка
+            теряет цвета на градиентах
+  webp      WebP lossless, method=0 — быстрый и без потерь
+
+Замеры на странице 1735x986: balanced ~240 КБ / ~155 мс, fast ~355 КБ / ~80 мс,
+small ~50 КБ / ~95 мс, webp ~225 КБ / ~65 мс.  Каждый вызов encode()
+возвращает размер и время кодирования, чтобы выбирать профиль по цифрам.
+"""
+import io, os, time
+
+from PIL import Image
+
+ENCODER_PROFILES = {
+    'fast':     {'format': 'PNG', 'compress_level': 1},
+    'balanced': {'format': 'PNG', 'compress_level': 6},
+    'small':    {'format': 'PNG', 'palette': 256, 'optimize': True},
+    'webp':     {'format': 'WEBP', 'lossless': True, 'method': 0},
+}
+EXTENSIONS = {'PNG': '.png', 'WEBP': '.webp'}
+
+DEFAULT_ENCODER = os.environ.get('BP_ENCODER', 'balanced')
+
+def get_profile(name=None):
+    name = name or DEFAULT_ENCODER
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"unknown encoder profile: {name} (known: {', '.join(ENCODER_PROFILES)})")
+    return name, ENCODER_PROFILES[name]
+
+def extension(name=None):
+    _, prof = get_profile(name)
+    return EXTENSIONS.get(prof['format'], '.png')
+
+def _quantize(img, colors):
+    # Константы переехали в Image.Quantize/Image.Dither в Pillow 9.1
+    method = getattr(getattr(Image, 'Quantize', Image), 'FASTOCTREE', 2)
+    dither = getattr(getattr(Image, 'Dither', Image), 'NONE', 0)
+    return img.convert('RGB').quantize(colors, method=method, dither=dither)
+
+def encode(img, name=None):
+    """Кодирует картинку профилем name. -> (bytes, {'encoder', 'format', 'bytes', 'encode_ms'})"""
+    name, prof = get_profile(name)
+    t0 = time.perf_counter()
+    params = {k: v for k, v in prof.items() if k not in ('format', 'palette')}
+    if prof.get('palette'):
+        img = _quantize(img, prof['palette'])
+    buf = io.BytesIO()
+    img.save(buf, format=prof['format'], **params)
+    data = buf.getvalue()
+    info = {
+        'encoder': name,
+        'format': prof['format'].lower(),
+        'bytes': len(data),
+        'encode_ms': round((time.perf_counter() - t0) * 1000.0, 2),
+    }
+    return data, info
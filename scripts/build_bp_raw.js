@@ -0,0 +1,30 @@
+// scripts/build_bp_raw.js
+// Собирает предекодированные raw-файлы страниц БП (см. «Предекодированные
+// страницы» в overlay_bp_progress.py) для всех картинок из
+// config.battlePass.imagePaths. Актуальные файлы не трогает, устаревшие
+// (PNG поменялся) пересобирает. Запуск: node scripts/build_bp_raw.js
+const { execFileSync } = require('child_process');
+const path = require('path');
+const config = require('../config');
+const bpRenderer = require('../utils/bpRenderer');
+
+const ROOT = path.join(__dirname, '..');
+const PYTHON = process.env.BP_PYTHON || 'python';
+
+const imagePaths = Object.values(config.battlePass?.imagePaths || {});
+const pages = [...new Set(imagePaths.map((p) => path.resolve(ROOT, p)))];
+if (!pages.length) {
+  console.error('config.battlePass.imagePaths is empty');
+  process.exit(1);
+}
+
+try {
+  const out = execFileSync(PYTHON, [bpRenderer.SCRIPT_PATH, '--build-raw', ...pages], { encoding: 'utf8' });
+  for (const line of out.split('\n').filter(Boolean)) {
+    const row = JSON.parse(line);
+    console.log(`${row.built ? 'built ' : 'fresh '} ${path.relative(ROOT, row.in)} -> ${path.relative(ROOT, row.raw)}`);
+  }
+} catch (e) {
+  console.error('[build_bp_raw]', e.stderr || e.message);
+  process.exit(1);
+}
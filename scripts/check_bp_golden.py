@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверка быстрых путей рендера БП на эталонных картинках.
+
+Рендерит матрицу заданий (все assets/bp/*.png x уровни вокруг страницы x
+доли уровня x длины счётчиков x premium/не-premium, плюс задания без панели)
+и попиксельно сравнивает то, что отдаёт оптимизированный рендер, с эталоном:
+
+  render   render() на холодном кэше слоёв (сборка по грязным областям)
+  cached   повторный render() — фрагменты из кэша слоёв
+  bytes    render_bytes() дважды (промах и попадание кэша готовых картинок),
+           PNG декодируется обратно
+  full     render_full() — сборка на всю страницу (BP_DIRTY_RECTS=0)
+  anim     последний кадр APNG render_levelup() с уровня на два ниже
+           (доля 0.8) — кадры собираются из дельт, итог обязан совпасть
+           с неподвижной картинкой
+
+Эталон по умолчанию — сборка «как было» в этом же процессе: оверлей на всю
+страницу, полосы через bar_band и paste с маской, раскладка панели честным
+перебором без кэша, каждый символ — отдельный draw.text.  Можно сравнивать и с
+другой ревизией скрипта или с сохранёнными картинками:
+
+  python scripts/check_bp_golden.py                       # с эталоном в процессе
+  python scripts/check_bp_golden.py --ref-rev d533fcc     # со старой версией из git
+  python scripts/check_bp_golden.py --save golden/        # сохранить эталон
+  python scripts/check_bp_golden.py --golden golden/      # сравнить с сохранённым
+
+Опции:
+  --step N            брать каждое N-е задание матрицы (по умолчанию 1)
+  --paths a,b         какие пути проверять (render,cached,bytes,full,anim)
+  --tolerance N       допустимая разница канала, 0..255 (по умолчанию 0)
+  --max-pixels N      сколько пикселей может превысить tolerance (0)
+  --diff-dir DIR      куда писать картинки расхождений (по умолчанию
+                      <tmp>/bp_golden_diff): эталон | результат | разница x8
+
+Старая ревизия запускается отдельным процессом со своими позиционными
+аргументами, цвета и сдвиги ей передаются через env из текущего профиля
+рендера.  Код выхода 1, если хоть одно сравнение не прошло.
+"""
+import json, os, shutil, subprocess, sys, tempfile, time
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from PIL import Image, ImageChops, ImageDraw
+
+import overlay_bp_progress as bp
+
+GEOMETRY = {'xPct': 7.65, 'widthPct': 58.68, 'topY': 6.5, 'topH': 42.7, 'botY': 54.1, 'botH': 42.7}
+LEVEL_OFFSETS = (-1, 0, 1, 4, 5, 6, 9, 10)    # относительно начала страницы
+FRACS = (0.0, 0.001, 0.2, 0.5, 0.999, 1.0)   # 0.2: анимация проходит узкую полосу с ужатым радиусом
+COUNTERS = (0, 7, 42, 512, 9999, 123456)     # последний заставляет панель ужиматься
+PATHS = ('render', 'cached', 'bytes', 'full', 'anim')
+ANIM_FROM = (-2, 0.8)     # откуда начинается анимация: сдвиг уровня и доля
+ANIM_FRAMES = 4
+
+def page_files():
+    d = os.path.join(ROOT, 'assets', 'bp')
+    pages = []
+    for name in os.listdir(d):
+        stem = name[:-4] if name.lower().endswith('.png') else None
+        if stem and '-' in stem and stem.split('-')[0].isdigit():
+            pages.append((int(stem.split('-')[0]), os.path.join(d, name)))
+    return sorted(pages)
+
+def matrix(step=1):
+    """Задания матрицы.  Счётчики и premium перебираются по кругу, как в bench_bp."""
+    geometry = dict(GEOMETRY, **bp.profile_geometry())
+    cases = []
+    i = 0
+    for page_start, path in page_files():
+        for off in LEVEL_OFFSETS:
+            lvl = page_start + off
+            if not 1 <= lvl <= 100:
+                continue
+            for frac in FRACS:
+                n = COUNTERS[i % len(COUNTERS)]
+                job = dict(geometry, **{'in': path, 'out': '-', 'pageStart': page_start,
+                                        'curLvl': lvl, 'lvlFrac': frac, 'encoder': 'fast'})
+                # Каждое седьмое задание — без панели (только полосы)
+                if i % 7:
+                    job.update({'level': lvl, 'xpCur': n, 'xpNeed': max(n, 100) * 2,
+                                'premium': (i // len(COUNTERS)) % 2, 'invites': i % 6,
+                                'ddTokens': n, 'raffle': (n * 7) % 100000, 'packs': i % 13})
+                if i % step == 0:
+                    cases.append(job)
+                i += 1
+    return cases
+
+def case_name(job):
+    info = f"_{job['level']}-{job['xpCur']}-{job['premium']}" if job.get('level') is not None else ''
+    return f"p{job['pageStart']}_l{job['curLvl']}_f{job['lvlFrac']}{info}"
+
+# -----------------------------------------------------------------------------
+# Эталоны
+
+@contextmanager
+def uncached_layout():
+    """Раскладка панели честным перебором, в обход кэша раскладок."""
+    saved = bp.panel_layout
+    bp.panel_layout = lambda hh, pad_y, *lines: bp.solve_panel_layout(hh, pad_y, *lines)
+    try:
+        yield
+    finally:
+        bp.panel_layout = saved
+
+def bar_band(W, H, radius, color_free, color_prem):
+    """Картинка пары (верх — free, низ — premium) и маска со скруглёнными углами."""
+    band = Image.new('RGBA', (W, H), (0, 0, 0, 0))
+    bd = ImageDraw.Draw(band, 'RGBA')
+    Hh = H // 2
+    bd.rectangle([0, 0, W, Hh], fill=color_free)
+    bd.rectangle([0, Hh, W, H], fill=color_prem)
+    mask = Image.new('L', (W, H), 0)
+    md = ImageDraw.Draw(mask)
+    try:
+        md.rounded_rectangle([0, 0, W, H], radius=radius, fill=255)
+    except Exception:
+        md.rectangle([0, 0, W, H], fill=255)
+    return band, mask
+
+def reference_render(job):
+    """Сборка «как было»: полный оверлей, bar_band + paste с маской, draw.text на символ."""
+    base = Image.open(job['in']).convert('RGBA')
+    w, h = base.size
+    overlay = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+    bar_x, bar_w, top_y, top_h, bot_y, bot_h = bp._page_geometry(job, w, h)
+    ps = job['pageStart']
+    if job['curLvl'] >= ps:
+        for y, hp, start, cf, cp in ((top_y, top_h, ps, bp.TOP_FREE_RGBA, bp.TOP_PREM_RGBA),
+                                     (bot_y, bot_h, ps + 5, bp.BOT_FREE_RGBA, bp.BOT_PREM_RGBA)):
+            geo = bp.bar_geometry(bar_x, bar_w, y, hp, start, job['curLvl'], job['lvlFrac'])
+            if geo is None:
+                continue
+            X, Y, W, H, radius = geo
+            band, mask = bar_band(W, H, radius, cf, cp)
+            overlay.paste(band, (X, Y), mask)
+    if job.get('level') is not None:
+        with uncached_layout():
+            glyphs = bp.layout_info(w, h, job['level'], job['xpCur'], job['xpNeed'], job['premium'],
+                                    job['invites'], job['ddTokens'], job['raffle'], job['packs'])
+        draw = ImageDraw.Draw(overlay, 'RGBA')
+        for x, y, ch, font in glyphs:
+            draw.text((x, y), ch, font=font, fill=bp.TEXTCOL)
+    return Image.alpha_composite(base, overlay).convert('RGB')
+
+def rev_env():
+    """Цвета и сдвиги текущего профиля в env старых версий скрипта."""
+    env = dict(os.environ)
+    for prefix, rgba in (('BP_BAR_TOP_FREE', bp.TOP_FREE_RGBA), ('BP_BAR_TOP_PREM', bp.TOP_PREM_RGBA),
+                         ('BP_BAR_BOT_FREE', bp.BOT_FREE_RGBA), ('BP_BAR_BOT_PREM', bp.BOT_PREM_RGBA)):
+        for c, v in zip('RGBA', rgba):
+            env[f'{prefix}_{c}'] = str(v)
+    env['BP_BAR_RADIUS_PCT'] = repr(bp.BAR_RADIUS_PCT)
+    for name in ('TOP_DX', 'TOP_DY', 'TOP_PAD_X', 'INV_PAD_X', 'MID_DX', 'MID_DY', 'INV_DX', 'INV_DY'):
+        env['BP_' + name] = str(getattr(bp, name))
+    env['BP_PROFILE'] = bp.PROFILE_FILE or ''
+    return env
+
+class RevReference:
+    """Эталон из другой ревизии: scripts/ из git во временный каталог, рендер CLI."""
+
+    def __init__(self, rev):
+        self.dir = tempfile.mkdtemp(prefix='bp_golden_rev_')
+        scripts = os.path.join(self.dir, 'scripts')
+        os.makedirs(scripts)
+        listing = subprocess.run(['git', 'ls-tree', '--name-only', rev, 'scripts/'], cwd=ROOT,
+                                 check=True, capture_output=True, text=True).stdout.split()
+        for path in listing:
+            if path.endswith('.py'):
+                data = subprocess.run(['git', 'show', f'{rev}:{path}'], cwd=ROOT, check=True,
+                                      capture_output=True).stdout
+                with open(os.path.join(self.dir, path), 'wb') as f:
+                    f.write(data)
+        self.script = os.path.join(scripts, 'overlay_bp_progress.py')
+        self.env = rev_env()
+        # Служебные файлы новой версии (raw-страницы, кэши) старой не нужны
+        self.env['BP_RAW_DIR'] = os.path.join(self.dir, 'raw')
+        self.env['BP_RESULT_CACHE'] = 'off'
+
+    def __call__(self, job):
+        out = os.path.join(self.dir, 'out.png')
+        argv = [str(job[name]) for name, _ in bp.JOB_FIELDS]
+        argv[1] = out
+        if job.get('level') is not None:
+            argv += [str(job[name]) for name, _ in bp.INFO_FIELDS]
+        proc = subprocess.run([sys.executable, self.script] + argv, cwd=ROOT, env=self.env,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip() or proc.stdout.strip())
+        with Image.open(out) as img:
+            return img.convert('RGB')
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+class GoldenReference:
+    """Эталон из каталога, сохранённого --save."""
+
+    def __init__(self, directory):
+        self.dir = directory
+
+    def __call__(self, job):
+        with Image.open(os.path.join(self.dir, case_name(job) + '.png')) as img:
+            return img.convert('RGB')
+
+# -----------------------------------------------------------------------------
+# Проверяемые пути
+
+def _decode(data, frame=None):
+    import io
+    with Image.open(io.BytesIO(data)) as img:
+        if frame is not None:
+            img.seek(img.n_frames - 1 if frame < 0 else frame)
+        return img.convert('RGB')
+
+def optimised(job, paths):
+    """-> [(путь, картинка), ...] для выбранных путей."""
+    out = []
+    if 'render' in paths or 'cached' in paths:
+        bp._LAYER_CACHE.clear()
+        bp._LAYER_BOXES.clear()
+        first = bp.render(job)
+        if 'render' in paths:
+            out.append(('render', first))
+        if 'cached' in paths:
+            out.append(('cached', bp.render(job)))
+    if 'bytes' in paths:
+        bp.render_bytes(job)
+        data, _ = bp.render_bytes(job)
+        out.append(('bytes', _decode(data)))
+    if 'full' in paths:
+        out.append(('full', bp.render_full(job)))
+    if 'anim' in paths:
+        dl, frac = ANIM_FROM
+        from_lvl = max(job['pageStart'] - 1, job['curLvl'] + dl)
+        data, _ = bp.render_levelup(dict(job, anim='apng', fromLvl=from_lvl, fromFrac=frac, frames=ANIM_FRAMES))
+        out.append(('anim', _decode(data, frame=-1)))
+    return out
+
+def compare(ref, got, tolerance):
+    """-> (число пикселей сверх tolerance, наибольшая разница, bbox) ."""
+    if ref.size != got.size:
+        return ref.size[0] * ref.size[1], 255, (0, 0) + ref.size
+    diff = ImageChops.difference(ref, got)
+    bbox = diff.getbbox()
+    if bbox is None:
+        return 0, 0, None
+    r, g, b = diff.split()
+    worst = ImageChops.lighter(ImageChops.lighter(r, g), b)
+    hist = worst.histogram()
+    peak = max(v for v in range(256) if hist[v])
+    return sum(hist[tolerance + 1:]), peak, bbox
+
+def write_diff(path, ref, got, bbox):
+    """Эталон | результат | разница x8 с рамкой вокруг расхождения."""
+    w, h = ref.size
+    sheet = Image.new('RGB', (w * 3, h), (0, 0, 0))
+    sheet.paste(ref, (0, 0))
+    sheet.paste(got.resize(ref.size) if got.size != ref.size else got, (w, 0))
+    if got.size == ref.size:
+        amp = ImageChops.difference(ref, got).point(lambda v: min(255, v * 8))
+        sheet.paste(amp, (2 * w, 0))
+    if bbox:
+        x0, y0, x1, y1 = bbox
+        ImageDraw.Draw(sheet).rectangle([2 * w + x0 - 2, y0 - 2, 2 * w + x1 + 1, y1 + 1], outline=(255, 0, 0), width=2)
+    sheet.save(path)
+
+# -----------------------------------------------------------------------------
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    opts = {'step': 1, 'paths': ','.join(PATHS), 'tolerance': 0, 'max_pixels': 0, 'ref_rev': None,
+            'golden': None, 'save': None, 'diff_dir': os.path.join(tempfile.gettempdir(), 'bp_golden_diff')}
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        key = a[2:].replace('-', '_')
+        if key in opts and i + 1 < len(argv):
+            i += 1
+            opts[key] = int(argv[i]) if key in ('step', 'tolerance', 'max_pixels') else argv[i]
+        else:
+            print(__doc__)
+            return 2
+        i += 1
+    paths = [p for p in opts['paths'].split(',') if p]
+    unknown = [p for p in paths if p not in PATHS]
+    if unknown:
+        print(f"unknown path: {unknown[0]} (known: {', '.join(PATHS)})")
+        return 2
+
+    if opts['ref_rev']:
+        reference, ref_name = RevReference(opts['ref_rev']), f"rev {opts['ref_rev']}"
+    elif opts['golden']:
+        reference, ref_name = GoldenReference(opts['golden']), f"golden {opts['golden']}"
+    else:
+        reference, ref_name = reference_render, 'in-process reference'
+
+    cases = matrix(max(1, opts['step']))
+    t0 = time.perf_counter()
+    failures = []
+    checked = 0
+    try:
+        if opts['save']:
+            os.makedirs(opts['save'], exist_ok=True)
+            for job in cases:
+                reference(job).save(os.path.join(opts['save'], case_name(job) + '.png'))
+            with open(os.path.join(opts['save'], 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump({'reference': ref_name, 'cases': cases}, f, indent=1)
+            print(f"saved {len(cases)} reference images ({ref_name}) to {opts['save']}")
+            return 0
+        for job in cases:
+            ref = reference(job)
+            for path, got in optimised(job, paths):
+                checked += 1
+                over, peak, bbox = compare(ref, got, opts['tolerance'])
+                if over > opts['max_pixels']:
+                    failures.append((case_name(job), path, over, peak, bbox))
+                    os.makedirs(opts['diff_dir'], exist_ok=True)
+                    write_diff(os.path.join(opts['diff_dir'], f"{case_name(job)}_{path}.png"), ref, got, bbox)
+    finally:
+        if hasattr(reference, 'close'):
+            reference.close()
+
+    print(f"{len(cases)} cases x {len(paths)} paths = {checked} comparisons against {ref_name}, "
+          f"tolerance {opts['tolerance']}, {time.perf_counter() - t0:.1f} s")
+    for name, path, over, peak, bbox in failures:
+        print(f"FAIL {name} [{path}]: {over} px over tolerance, max diff {peak}, bbox {bbox}")
+    if failures:
+        print(f"{len(failures)} failed; diff images in {opts['diff_dir']}")
+        return 1
+    print("all identical within tolerance")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
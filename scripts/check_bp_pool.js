@@ -0,0 +1,56 @@
+#!/usr/bin/env node
+// scripts/check_bp_pool.js
+// Проверка пула utils/bpRenderer.js на процессе-заглушке вместо Python:
+// заглушка говорит на протоколе --serve и отвечает через 50 мс, а на задание
+// с argv[0] === 'hang' не отвечает никогда.
+//
+// Сценарий: один процесс в пуле, задание A зависает, задание B ждёт в
+// очереди.  После таймаута A процесс A должен быть убит, а B — выполнен
+// новым процессом, а не отдан зависшему и убитому вместе с ним.
+//
+//   node scripts/check_bp_pool.js      (npm run check:pool)
+//
+// Код выхода 0 — всё в порядке, 1 — проверка не прошла.
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+
+const STUB = `#!${process.execPath}
+const rl = require('readline').createInterface({ input: process.stdin });
+rl.on('line', (line) => {
+  let job;
+  try { job = JSON.parse(line); } catch { return; }
+  if (job.argv && job.argv[0] === 'hang') return;
+  // Ответ с задержкой, как у настоящего рендера
+  setTimeout(() => process.stdout.write(JSON.stringify({ id: job.id, ok: true, pid: process.pid }) + '\\n'), 50);
+});
+`;
+
+function main() {
+  const dir = fs.mkdtempSync(path.join(os.tmpdir(), 'bp-pool-'));
+  const stub = path.join(dir, 'stub-daemon.js');
+  fs.writeFileSync(stub, STUB, { mode: 0o755 });
+  // Настройки пула читаются при загрузке модуля
+  Object.assign(process.env, {
+    BP_PYTHON: stub, BP_RENDER_DAEMON: '1', BP_RENDER_WORKERS: '1',
+    BP_RENDER_QUEUE_WAIT_MS: '60000', BP_RENDER_TIMEOUT_MS: '300', BP_RENDER_BUDGET_MS: '0',
+  });
+  const bpRenderer = require('../utils/bpRenderer');
+  const fail = (msg) => { console.error(`FAIL: ${msg}`); process.exitCode = 1; };
+
+  const a = bpRenderer.render(['hang']).then(() => null, (err) => err);
+  const b = bpRenderer.render(['ok']).then((res) => res, (err) => err);
+  return Promise.all([a, b]).then(([errA, resB]) => {
+    if (!(errA instanceof Error) || !/timeout/.test(errA.message)) fail(`hung job: expected a timeout, got ${errA}`);
+    if (resB instanceof Error) fail(`queued job died with the hung worker: ${resB.message}`);
+    else if (!resB || !resB.ok) fail(`queued job: unexpected reply ${JSON.stringify(resB)}`);
+    const st = bpRenderer.poolStats();
+    if (st.spawned !== 2 || st.timeouts !== 1) fail(`pool stats: ${JSON.stringify(st)}`);
+    if (!process.exitCode) console.log('ok: hung worker retired before the queue moved on');
+  }).finally(() => {
+    bpRenderer.shutdown();
+    fs.rmSync(dir, { recursive: true, force: true });
+  });
+}
+
+main();
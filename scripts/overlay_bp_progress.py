@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, sys
+import hashlib, io, json, math, mmap, os, struct, sys, threading, time, zlib
+_T_IMPORT = time.perf_counter()
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from PIL import Image, ImageDraw, ImageFont
+from PIL import __version__ as PIL_VERSION
+
+import bp_encode
 
 """
-Настройка визуала полосы прогресса:
-- Цвета можно задавать через ENV:
+Настройка визуала полосы прогресса — в профиле рендера config.bp_render.json
+(см. раздел «Профиль рендера» ниже).  Без файла действуют ENV:
   BP_BAR_R/G/B/ALPHA (общий цвет по умолчанию)
   BP_BAR_TOP_FREE_R/G/B/A,  BP_BAR_TOP_PREM_R/G/B/A
   BP_BAR_BOT_FREE_R/G/B/A,  BP_BAR_BOT_PREM_R/G/B/A
@@ -73,11 +79,12 @@ INV_DY = _get_int_env('BP_INV_DY', 60)
 #
 # In addition to the collective MID_DX/MID_DY adjustments above, the positions
 # of each of the three numeric counters (raffle points, double‑bet tokens and
-# card packs) can now be tweaked individually via environment variables.  Each
+# card packs) can now be tweaked individually via the render profile.  Each
 # value defaults to zero (no shift).  Positive X offsets push the number to
 # the right, negative values to the left.  Positive Y offsets push it down,
 # negative values up.  These are applied on top of MID_DX/MID_DY when
-# rendering the numeric rows.  See draw_info for usage.
+# rendering the numeric rows.  See draw_info for usage.  The values below
+# are the fallback; the render profile (offsets.raffle/dd/pack) overrides them.
 RAFFLE_DX = 60    # Сдвиг по X для raffle
 RAFFLE_DY = -20   # Сдвиг по Y для raffle
 DD_DX     = 60    # Сдвиг по X для double tokens
@@ -85,6 +92,10 @@ DD_DY     = -20   # Сдвиг по Y для double tokens
 PACK_DX   = 60    # Сдвиг по X для packs
 PACK_DY   = 0   # Сдвиг по Y для packs
 
+# Рендер не потокобезопасен из-за общих кэшей; в режиме сокета задания
+# выполняются по одному.
+_RENDER_LOCK = threading.Lock()
+
 def clamp(v, a, b):
     return max(a, min(b, v))
 
@@ -100,36 +111,464 @@ def _get_color(prefix, default):
     a = clamp(a, 0, 255)
     return (r, g, b, a)
 
+# -----------------------------------------------------------------------------
+# Трассировка стадий рендера
+#
+# BP_TRACE=1 (или --trace в CLI, "trace": true в задании демона) — замер
+# времени каждой стадии: decode подложки, fonts, layers (геометрия и раскладка
+# панели), paint, composite, encode, write и т.д.  Стадии могут вкладываться
+# (fonts считается и внутри layers), calls — сколько раз стадия встретилась.  BP_TRACE=mem добавляет
+# tracemalloc: сколько Python-памяти стадия оставила за собой (alloc_kb) и
+# общий пик.  Буферы самих картинок PIL выделяет мимо tracemalloc, поэтому
+# для них в записи есть ru_maxrss процесса.
+#
+# Запись уходит в stderr одной JSON-строкой {"trace": {...}} (CLI) или полем
+# "trace" в ответе демона.  Без трассировки стадии почти ничего не стоят.
+#
+# Короткая сводка — только {стадия: ms}, без tracemalloc и счётчиков вызовов —
+# идёт в каждом ответе демона полем "stages" (CLI: --stages, строка
+# {"stages": {...}} в stderr).  Это пара perf_counter на стадию, так что
+# бот снимает метрики стадий, не включая трассировку.
+
+TRACE_MODE = os.environ.get('BP_TRACE', '')
+_TRACE_LOCAL = threading.local()
+IMPORT_MS = None    # время импорта модуля (PIL, env, шрифты), заполняется в конце файла
+
+class RenderTrace:
+    def __init__(self, mem=False):
+        self.mem = mem
+        self.stages = OrderedDict()     # name -> [ms, calls, alloc_bytes]
+        self.t0 = time.perf_counter()
+        self._own_tracemalloc = False
+        if mem:
+            import tracemalloc
+            self._tm = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._own_tracemalloc = True
+            tracemalloc.reset_peak()
+
+    def add(self, name, ms, alloc=0):
+        st = self.stages.setdefault(name, [0.0, 0, 0])
+        st[0] += ms
+        st[1] += 1
+        st[2] += alloc
+
+    def stage_ms(self):
+        return {name: round(ms, 2) for name, (ms, _, _) in self.stages.items()}
+
+    def result(self):
+        out = {
+            'total_ms': round((time.perf_counter() - self.t0) * 1000.0, 2),
+            'import_ms': IMPORT_MS,
+            'stages': {name: {'ms': round(ms, 3), 'calls': calls} for name, (ms, calls, _) in self.stages.items()},
+        }
+        if self.mem:
+            for name, (_, _, alloc) in self.stages.items():
+                out['stages'][name]['alloc_kb'] = round(alloc / 1024.0, 1)
+            out['py_peak_kb'] = round(self._tm.get_traced_memory()[1] / 1024.0, 1)
+            if self._own_tracemalloc:
+                self._tm.stop()
+            try:
+                import resource
+                out['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            except ImportError:
+                pass
+        return out
+
+@contextmanager
+def tracing(mode=None):
+    """Включает трассировку для рендеров внутри блока; отдаёт RenderTrace или None."""
+    mode = TRACE_MODE if mode is None else mode
+    if not mode or mode == '0':
+        yield None
+        return
+    prev = getattr(_TRACE_LOCAL, 'trace', None)
+    tr = _TRACE_LOCAL.trace = RenderTrace(mem=(mode == 'mem'))
+    try:
+        yield tr
+    finally:
+        _TRACE_LOCAL.trace = prev
+
+@contextmanager
+def trace_stage(name):
+    tr = getattr(_TRACE_LOCAL, 'trace', None)
+    if tr is None:
+        yield
+        return
+    m0 = tr._tm.get_traced_memory()[0] if tr.mem else 0
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000.0
+        tr.add(name, ms, (tr._tm.get_traced_memory()[0] - m0) if tr.mem else 0)
+
+# -----------------------------------------------------------------------------
+# Бюджет времени рендера
+#
+# Задание может прийти с budgetMs (CLI --budget=MS, по умолчанию
+# BP_BUDGET_MS, 0 — без бюджета).  Перед дорогими стадиями рендер сверяет,
+# сколько осталось, с ожидаемой стоимостью стадии и, если не успевает,
+# берёт дешёвый путь — лучше чуть более простая картинка вовремя, чем
+# упавшее взаимодействие в Discord:
+#
+#   fast_encoder  профиль fast вместо выбранного (картинка та же, файл крупнее)
+#   fixed_font    панель стартовыми размерами шрифтов без подбора
+#                 (только если раскладки нет в кэше)
+#   square_bars   полосы прямоугольниками без скруглённой маски
+#
+# Стоимость стадий — скользящее среднее замеров этого процесса, стартовые
+# значения — замеры на странице 1735x986.  Для стадий полос и панели в
+# запасе держится ещё и быстрое кодирование.  Применённые упрощения
+# попадают в info['degraded']; такие картинки не кладутся в кэши.
+
+BUDGET_MS = _get_int_env('BP_BUDGET_MS', 0)
+DEGRADE_ESTIMATES = {'bars': 10.0, 'layout': 25.0, 'encode:balanced': 155.0, 'encode:fast': 80.0,
+                     'encode:small': 95.0, 'encode:webp': 65.0}
+_DEADLINE_LOCAL = threading.local()
+
+class Deadline:
+    def __init__(self, budget_ms, start=None):
+        self.budget_ms = float(budget_ms)
+        self.t0 = time.perf_counter() if start is None else start
+        self.degraded = []
+        self.counts = {}    # упрощение -> сколько раз применено
+
+    def remaining(self):
+        return self.budget_ms - (time.perf_counter() - self.t0) * 1000.0
+
+    def fits(self, *stages):
+        return self.remaining() >= sum(DEGRADE_ESTIMATES.get(s, 0.0) for s in stages)
+
+@contextmanager
+def deadline(budget_ms=None, start=None):
+    """Бюджет на рендеры внутри блока; отдаёт Deadline или None (без бюджета)."""
+    budget_ms = BUDGET_MS if budget_ms is None else budget_ms
+    if not budget_ms or budget_ms <= 0:
+        yield None
+        return
+    prev = getattr(_DEADLINE_LOCAL, 'deadline', None)
+    dl = _DEADLINE_LOCAL.deadline = Deadline(budget_ms, start)
+    try:
+        yield dl
+    finally:
+        _DEADLINE_LOCAL.deadline = prev
+
+def should_degrade(name, *stages):
+    """
+    True, если на stages не хватает оставшегося бюджета; упрощение name
+    тогда записывается в отчёт.  Без бюджета всегда False.
+    """
+    dl = getattr(_DEADLINE_LOCAL, 'deadline', None)
+    if dl is None or dl.fits(*stages):
+        return False
+    if name not in dl.degraded:
+        dl.degraded.append(name)
+    dl.counts[name] = dl.counts.get(name, 0) + 1
+    return True
+
+def degraded():
+    """Упрощения, применённые в текущем бюджете (кортеж)."""
+    dl = getattr(_DEADLINE_LOCAL, 'deadline', None)
+    return tuple(dl.degraded) if dl is not None else ()
+
+def degrade_count(name):
+    dl = getattr(_DEADLINE_LOCAL, 'deadline', None)
+    return dl.counts.get(name, 0) if dl is not None else 0
+
+def learn_cost(stage, ms, weight=0.2):
+    """Обновляет ожидаемую стоимость стадии по свежему замеру."""
+    prev = DEGRADE_ESTIMATES.get(stage)
+    DEGRADE_ESTIMATES[stage] = ms if prev is None else prev + (ms - prev) * weight
+
 TOP_FREE_RGBA  = _get_color('BP_BAR_TOP_FREE', BAR_RGBA)
 TOP_PREM_RGBA  = _get_color('BP_BAR_TOP_PREM', BAR_RGBA)
 BOT_FREE_RGBA  = _get_color('BP_BAR_BOT_FREE', BAR_RGBA)
 BOT_PREM_RGBA  = _get_color('BP_BAR_BOT_PREM', BAR_RGBA)
 
-def load_font(size):
+# -----------------------------------------------------------------------------
+# Профиль рендера (config.bp_render.json)
+#
+# Цвета полос, скругление, цвет текста, все сдвиги панели и геометрия полос
+# лежат в одном JSON-файле рядом с config.js.  Файл проверяется целиком
+# (неизвестный ключ или не тот тип — ошибка с путём до поля) и читается один
+# раз; долгоживущие процессы (--serve, --batch) перед каждым заданием
+# сверяют mtime/размер и подхватывают правку без перезапуска.  Если новая
+# версия файла не прошла проверку, остаётся прежний профиль, а ошибка видна
+# в stderr и в {"cmd": "stats"}.
+#
+# Значения, которых нет в файле, берутся из env (BP_BAR_*, BP_TOP_DX и т.д.,
+# как раньше) или из констант выше.  Путь — BP_PROFILE, пустая строка
+# отключает файл.
+#
+#   {
+#     "geometry": {"xPct": 7.65, "widthPct": 58.68,
+#                  "top": {"yPct": 6.5, "heightPct": 42.7}, "bottom": {...}},
+#     "bars": {"radiusPct": 0.05, "color": {"r": 64, "g": 128, "b": 255, "a": 150},
+#              "top": {"free": {...}, "premium": {...}}, "bottom": {...}},
+#     "text": {"color": {...}},
+#     "offsets": {"top": {"dx": -80, "dy": -20, "padX": 0}, "mid": {"dx": 0, "dy": 15},
+#                 "inv": {"dx": -80, "dy": 60, "padX": 0},
+#                 "raffle": {"dx": 60, "dy": -20}, "dd": {...}, "pack": {...}}
+#   }
+#
+# Геометрия нужна вызывающей стороне (commands/battlepass.js передаёт её
+# аргументами), а здесь подставляется в JSON-задания, где её не указали.
+# Ряды geometry можно писать и как в config.overlay.example.js: {"y", "h"}.
+
+PROFILE_FILE = os.environ.get(
+    'BP_PROFILE', os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config.bp_render.json')))
+
+# Имя поля в файле -> имя константы модуля
+_PROFILE_OFFSETS = {
+    'top': {'dx': 'TOP_DX', 'dy': 'TOP_DY', 'padX': 'TOP_PAD_X'},
+    'mid': {'dx': 'MID_DX', 'dy': 'MID_DY'},
+    'inv': {'dx': 'INV_DX', 'dy': 'INV_DY', 'padX': 'INV_PAD_X'},
+    'raffle': {'dx': 'RAFFLE_DX', 'dy': 'RAFFLE_DY'},
+    'dd': {'dx': 'DD_DX', 'dy': 'DD_DY'},
+    'pack': {'dx': 'PACK_DX', 'dy': 'PACK_DY'},
+}
+_PROFILE_BANDS = {('top', 'free'): 'TOP_FREE_RGBA', ('top', 'premium'): 'TOP_PREM_RGBA',
+                  ('bottom', 'free'): 'BOT_FREE_RGBA', ('bottom', 'premium'): 'BOT_PREM_RGBA'}
+_PROFILE_GEO_ROWS = {'top': ('topY', 'topH'), 'bottom': ('botY', 'botH')}
+
+def _profile_defaults():
+    """Значения до файла профиля: env и константы модуля."""
+    names = [n for group in _PROFILE_OFFSETS.values() for n in group.values()]
+    names += list(_PROFILE_BANDS.values()) + ['BAR_RGBA', 'BAR_RADIUS_PCT', 'TEXTCOL']
+    return {n: globals()[n] for n in names}
+
+def _check_keys(obj, allowed, where):
+    if not isinstance(obj, dict):
+        raise ValueError(f"{where}: expected object")
+    extra = sorted(set(obj) - set(allowed))
+    if extra:
+        raise ValueError(f"{where}: unknown key {extra[0]!r}")
+    return obj
+
+def _profile_num(v, where, kind=float, lo=None, hi=None):
+    if isinstance(v, bool) or not isinstance(v, (int, float)) or (kind is int and v != int(v)):
+        raise ValueError(f"{where}: expected {'integer' if kind is int else 'number'}")
+    v = kind(v)
+    if (lo is not None and v < lo) or (hi is not None and v > hi):
+        raise ValueError(f"{where}: {v} is out of range {lo}..{hi}")
+    return v
+
+def _profile_color(obj, where, default):
+    _check_keys(obj, 'rgba', where)
+    return tuple(_profile_num(obj[c], f"{where}.{c}", int, 0, 255) if c in obj else d
+                 for c, d in zip('rgba', default))
+
+def validate_profile(data, defaults=None):
+    """
+    Содержимое файла профиля -> {константа: значение} и геометрия.
+    -> (values, geometry); ValueError с путём до поля, если что-то не так.
+    """
+    values = dict(defaults or _profile_defaults())
+    _check_keys(data, ('geometry', 'bars', 'text', 'offsets', 'comment'), 'profile')
+
+    bars = _check_keys(data.get('bars', {}), ('radiusPct', 'color', 'top', 'bottom'), 'bars')
+    if 'radiusPct' in bars:
+        values['BAR_RADIUS_PCT'] = _profile_num(bars['radiusPct'], 'bars.radiusPct', float, 0.0, 1.0)
+    if 'color' in bars:
+        values['BAR_RGBA'] = _profile_color(bars['color'], 'bars.color', values['BAR_RGBA'])
+        # Общий цвет — запасной для половинок, которым свой не задан
+        for name in _PROFILE_BANDS.values():
+            values[name] = values['BAR_RGBA']
+    for row in ('top', 'bottom'):
+        pair = _check_keys(bars.get(row, {}), ('free', 'premium'), f"bars.{row}")
+        for half, col in pair.items():
+            name = _PROFILE_BANDS[(row, half)]
+            values[name] = _profile_color(col, f"bars.{row}.{half}", values[name])
+
+    text = _check_keys(data.get('text', {}), ('color',), 'text')
+    if 'color' in text:
+        values['TEXTCOL'] = _profile_color(text['color'], 'text.color', values['TEXTCOL'])
+
+    offsets = _check_keys(data.get('offsets', {}), _PROFILE_OFFSETS, 'offsets')
+    for group, fields in offsets.items():
+        _check_keys(fields, _PROFILE_OFFSETS[group], f"offsets.{group}")
+        for key, v in fields.items():
+            values[_PROFILE_OFFSETS[group][key]] = _profile_num(v, f"offsets.{group}.{key}", int, -10000, 10000)
+
+    geometry = {}
+    geo = _check_keys(data.get('geometry', {}), ('xPct', 'widthPct', 'top', 'bottom'), 'geometry')
+    for key in ('xPct', 'widthPct'):
+        if key in geo:
+            geometry[key] = _profile_num(geo[key], f"geometry.{key}", float, 0.0, 100.0)
+    for row, (ykey, hkey) in _PROFILE_GEO_ROWS.items():
+        r = _check_keys(geo.get(row, {}), ('yPct', 'heightPct', 'y', 'h'), f"geometry.{row}")
+        for keys, dst in ((('yPct', 'y'), ykey), (('heightPct', 'h'), hkey)):
+            for k in keys:
+                if k in r:
+                    geometry[dst] = _profile_num(r[k], f"geometry.{row}.{k}", float, 0.0, 100.0)
+    return values, geometry
+
+_PROFILE_DEFAULTS = _profile_defaults()
+_PROFILE_STATE = {'stamp': None, 'geometry': {}, 'error': None, 'loads': 0}
+
+def load_profile(path=None, force=False):
+    """
+    Применяет файл профиля, если он изменился с прошлого раза (mtime/размер).
+    -> True, если профиль перечитан.  Ошибки чтения и проверки не бросаются:
+    остаётся прежний профиль, текст ошибки — в profile_info().
+    """
+    path = PROFILE_FILE if path is None else path
+    if not path:
+        return False
+    try:
+        st = os.stat(path)
+        stamp = (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = (path, None, None)
+    if stamp == _PROFILE_STATE['stamp'] and not force:
+        return False
+    _PROFILE_STATE['stamp'] = stamp
+    if stamp[1] is None:
+        # Файла нет (или удалили) — возвращаемся к env и константам.  Молча
+        # нельзя: без профиля все полосы рисуются цветом BAR_RGBA.
+        values, geometry, err = _PROFILE_DEFAULTS, {}, f"{path}: not found"
+        sys.stderr.write(f"[bp profile] {err}, using env and built-in defaults\n")
+    else:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                values, geometry = validate_profile(json.load(f), _PROFILE_DEFAULTS)
+            err = None
+        except (OSError, ValueError) as e:
+            _PROFILE_STATE['error'] = f"{path}: {e}"
+            sys.stderr.write(f"[bp profile] {_PROFILE_STATE['error']}, keeping the previous profile\n")
+            return False
+    globals().update(values)
+    _PROFILE_STATE.update(geometry=geometry, error=err, loads=_PROFILE_STATE['loads'] + 1)
+    return True
+
+def profile_geometry():
+    """Геометрия полос из профиля: {xPct, widthPct, topY, topH, botY, botH} (что задано)."""
+    return dict(_PROFILE_STATE['geometry'])
+
+def profile_info():
+    stamp = _PROFILE_STATE['stamp'] or (PROFILE_FILE, None, None)
+    return {'path': stamp[0], 'mtime_ns': stamp[1], 'loads': _PROFILE_STATE['loads'],
+            'error': _PROFILE_STATE['error']}
+
+load_profile()
+
+FONT_CANDIDATES = [
+    "assets/fonts/Montserrat-SemiBold.ttf",
+    "Montserrat-SemiBold.ttf",
+    "assets/fonts/DejaVuSans-Bold.ttf",
+    "assets/fonts/DejaVuSans.ttf",
+    "assets/fonts/Arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+    "Arial.ttf","DejaVuSans.ttf","DejaVuSans-Bold.ttf",
+    r"C:\\Windows\\Fonts\\arial.ttf", r"C:\\Windows\\Fonts\\arialbd.ttf",
+    r"C:\\Windows\\Fonts\\segoeui.ttf", r"C:\\Windows\\Fonts\\tahoma.ttf"
+]
+
+# Каталог служебных файлов рендера (raw-страницы, resolved.json)
+STATE_DIR = os.environ.get('BP_RAW_DIR') or os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'bp_raw'))
+
+# -----------------------------------------------------------------------------
+# resolved.json
+#
+# Перебор FONT_CANDIDATES и разбиение цифр на классы (_digit_classes, ~70 мс:
+# textbbox каждой цифры на двух десятках размеров) дают один и тот же
+# результат, пока не поменялись шрифт, список кандидатов, рабочий каталог или
+# версия PIL.  Одноразовый процесс считал их заново на каждый рендер, поэтому
+# результат сохраняется в BP_RESOLVED_FILE (по умолчанию <BP_RAW_DIR>/resolved.json)
+# и проверяется по этим признакам и mtime/размеру файла шрифта.
+
+RESOLVED_FILE = os.environ.get('BP_RESOLVED_FILE') or os.path.join(STATE_DIR, 'resolved.json')
+_RESOLVED = None      # содержимое файла (dict) после первой загрузки
+
+def _resolved_key():
+    from PIL import __version__ as pil_version
+    cands = hashlib.sha1('\0'.join(FONT_CANDIDATES).encode('utf-8')).hexdigest()[:16]
+    return {'cwd': os.getcwd(), 'candidates': cands, 'pil': pil_version}
+
+def _font_stamp(path):
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None   # системный шрифт по имени — проверить нечем, верим ключу
+    return [st.st_mtime_ns, st.st_size]
+
+def _load_resolved():
+    global _RESOLVED
+    if _RESOLVED is None:
+        _RESOLVED = {}
+        try:
+            with open(RESOLVED_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            font = data.get('font')
+            if (data.get('key') == _resolved_key() and isinstance(font, dict)
+                    and _font_stamp(font.get('path')) == font.get('stamp')):
+                _RESOLVED = data
+        except (OSError, ValueError):
+            pass
+    return _RESOLVED
+
+def _save_resolved(**fields):
+    data = dict(_load_resolved(), key=_resolved_key(), **fields)
+    _RESOLVED.clear()
+    _RESOLVED.update(data)
+    try:
+        import tempfile
+        os.makedirs(os.path.dirname(RESOLVED_FILE) or '.', exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(RESOLVED_FILE) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, RESOLVED_FILE)
+    except OSError:
+        pass
+
+_FONT_PATH_UNSET = object()
+_font_path = _FONT_PATH_UNSET
+_FONT_CACHE = {}      # (path, size) -> FreeTypeFont
+
+def resolve_font_path():
+    """
+    Первый рабочий шрифт из FONT_CANDIDATES (None — встроенный шрифт PIL).
+    Перебор делается один раз за процесс: раньше он шёл на каждый load_font.
+    """
+    global _font_path
+    if _font_path is not _FONT_PATH_UNSET:
+        return _font_path
+    font = _load_resolved().get('font')
+    if font is not None:
+        _font_path = font['path']
+        return _font_path
+    _font_path = None
     # Attempt to load Montserrat first.  If the file exists in the assets
     # folder or is otherwise accessible on the system, it will be used.
-    candidates = [
-        "assets/fonts/Montserrat-SemiBold.ttf",
-        "Montserrat-SemiBold.ttf",
-        "assets/fonts/DejaVuSans-Bold.ttf",
-        "assets/fonts/DejaVuSans.ttf",
-        "assets/fonts/Arial.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
-        "Arial.ttf","DejaVuSans.ttf","DejaVuSans-Bold.ttf",
-        r"C:\\Windows\\Fonts\\arial.ttf", r"C:\\Windows\\Fonts\\arialbd.ttf",
-        r"C:\\Windows\\Fonts\\segoeui.ttf", r"C:\\Windows\\Fonts\\tahoma.ttf"
-    ]
-    for p in candidates:
+    for p in FONT_CANDIDATES:
         try:
-            if os.path.isfile(p):
-                return ImageFont.truetype(p, size)
-            if os.path.sep not in p:
-                return ImageFont.truetype(p, size)
+            if os.path.isfile(p) or os.path.sep not in p:
+                ImageFont.truetype(p, 12)
+                _font_path = p
+                break
         except Exception:
             pass
-    return ImageFont.load_default()
+    _save_resolved(font={'path': _font_path, 'stamp': _font_stamp(_font_path)}, digit_classes=None)
+    return _font_path
+
+def load_font(size):
+    path = resolve_font_path()
+    key = (path, size)
+    font = _FONT_CACHE.get(key)
+    if font is None:
+        with trace_stage('fonts'):
+            try:
+                font = ImageFont.truetype(path, size) if path else ImageFont.load_default()
+            except Exception:
+                font = ImageFont.load_default()
+        _FONT_CACHE[key] = font
+    return font
 
 def text_wh(draw, text, font):
     try:
@@ -141,16 +580,222 @@ def text_wh(draw, text, font):
         except Exception:
             return (len(text)*10, getattr(font,'size',18))
 
-def _rounded_rect(draw, xy, radius, fill):
+# -----------------------------------------------------------------------------
+# Кэш метрик текста
+#
+# Шрифты живут в _FONT_CACHE всё время процесса, поэтому таблицы метрик
+# привязаны прямо к объекту шрифта.  Замеры делаются тем же textbbox, что и
+# раньше (через отдельный draw с тем же fontmode), так что цифры совпадают
+# с прежними до пикселя.
+
+_MEASURE_DRAW = ImageDraw.Draw(Image.new('RGBA', (1, 1)), 'RGBA')
+_GLYPH_TABLES = {}    # font -> {char: (w, h)}
+_TEXT_TABLES  = {}    # font -> {text: (w, h)}
+_TEXT_TABLE_MAX = 2048
+
+def glyph_wh(font, ch):
+    table = _GLYPH_TABLES.get(font)
+    if table is None:
+        table = _GLYPH_TABLES[font] = {}
+    wh = table.get(ch)
+    if wh is None:
+        wh = table[ch] = text_wh(_MEASURE_DRAW, ch, font)
+    return wh
+
+def measure_text(font, text):
+    """text_wh для целой строки с кэшем по шрифту (числа в панели повторяются)."""
+    table = _TEXT_TABLES.get(font)
+    if table is None:
+        table = _TEXT_TABLES[font] = {}
+    wh = table.get(text)
+    if wh is None:
+        if len(table) >= _TEXT_TABLE_MAX:
+            table.clear()
+        wh = table[text] = text_wh(_MEASURE_DRAW, text, font)
+    return wh
+
+def layout_spaced(text, font, letter_spacing):
+    """
+    Раскладка строки с трекингом за один проход по таблице глифов.
+    Возвращает (advances, width): advances[i] — сдвиг пера после i-го символа
+    (после пробелов трекинг не добавляется), width — ширина без трекинга после
+    последнего символа.  Порядок сложений тот же, что и при посимвольном
+    замере через text_wh, чтобы дробные координаты совпадали бит в бит.
+    """
+    advances = []
+    total = 0.0
+    last = len(text) - 1
+    for i, ch in enumerate(text):
+        cw = glyph_wh(font, ch)[0]
+        total += cw
+        if ch.isspace():
+            advances.append(cw)
+        else:
+            advances.append(cw + letter_spacing)
+            if i < last:
+                total += letter_spacing
+    return advances, total
+
+# -----------------------------------------------------------------------------
+# Кэш растров глифов
+#
+# Панель рисует одни и те же символы (цифры, «уровень», «приглашений», «/5»)
+# одними и теми же размерами, но раньше каждый глиф заново растеризовался
+# FreeType на каждый запрос.  Здесь храним готовые альфа-маски глифов и
+# накладываем их тем же draw_bitmap, что использует ImageDraw.text, поэтому
+# результат совпадает с draw.text до пикселя.  PIL сдвигает растр на дробную
+# часть координаты, так что она входит в ключ.  Строки целиком не кэшируются:
+# при отрицательном трекинге глифы перекрываются, и порядок смешивания важен.
+#
+# Кэш опирается на внутренние API Pillow: ImageDraw._getink,
+# ImageDraw.draw.draw_bitmap и FreeTypeFont.getmask2(..., start=) — start
+# появился в Pillow 9.2.  На более старом Pillow кэш выключен сразу, а если
+# сигнатуры поменяются в новом, первый же сбой (AttributeError/TypeError)
+# выключает его до конца процесса: глифы рисуются обычным draw.text — та же
+# картинка, только медленнее.
+
+SPRITES_MIN_PILLOW = (9, 2)
+SPRITE_CACHE_MAX = _get_int_env('BP_SPRITE_CACHE', 4096)
+_SPRITES = OrderedDict()   # (font, ch, fx, fy, fontmode) -> (mask, (dx, dy))
+_SPRITE_STATS = {'hits': 0, 'misses': 0}
+
+def _pil_version():
     try:
-        draw.rounded_rectangle(xy, radius=radius, fill=fill)
-    except Exception:
-        draw.rectangle(xy, fill=fill)
+        return tuple(int(p) for p in PIL_VERSION.split('.')[:2])
+    except ValueError:
+        return (0, 0)
+
+_SPRITES_STATE = {'enabled': _pil_version() >= SPRITES_MIN_PILLOW, 'error': None}
+
+def _sprites_failed(e):
+    """Выключает кэш растров после сбоя внутреннего API Pillow."""
+    if _SPRITES_STATE['enabled']:
+        _SPRITES_STATE.update(enabled=False, error=f"{type(e).__name__}: {e}")
+        sys.stderr.write(f"glyph sprite cache disabled, falling back to draw.text: {_SPRITES_STATE['error']}\n")
+
+def _glyph_sprite(font, ch, fx, fy, fontmode, ink):
+    key = (font, ch, fx, fy, fontmode)
+    sp = _SPRITES.get(key)
+    if sp is not None:
+        _SPRITES.move_to_end(key)
+        _SPRITE_STATS['hits'] += 1
+        return sp
+    _SPRITE_STATS['misses'] += 1
+    sp = font.getmask2(ch, fontmode, anchor='la', ink=ink, start=(fx, fy))
+    if SPRITE_CACHE_MAX > 0:
+        _SPRITES[key] = sp
+        if len(_SPRITES) > SPRITE_CACHE_MAX:
+            _SPRITES.popitem(last=False)
+    return sp
+
+def _text_ink(draw, fill):
+    ink, fill_ink = draw._getink(fill)
+    return fill_ink if ink is None else ink
+
+def draw_glyph(draw, xy, ch, font, ink, origin=(0, 0)):
+    """
+    Один глиф из кэша растров; то же, что draw.text((x, y), ch), но без FreeType.
+    xy — абсолютные координаты на странице, origin — левый верхний угол
+    картинки, в которую рисуем (для слоёв-фрагментов).  Сдвиг целочисленный,
+    поэтому дробная часть и растр глифа те же, что при рисовании на всю страницу.
+    """
+    x, y = xy
+    fx = math.modf(x)[0]
+    fy = math.modf(y)[0]
+    mask, offset = _glyph_sprite(font, ch, fx, fy, draw.fontmode, ink)
+    draw.draw.draw_bitmap((int(x) + offset[0] - origin[0], int(y) + offset[1] - origin[1]), mask, ink)
+
+def glyph_box(xy, ch, font):
+    """Точный прямоугольник «чернил» глифа на странице (x0, y0, x1, y1)."""
+    x, y = xy
+    if _SPRITES_STATE['enabled'] and hasattr(font, 'getmask2'):
+        try:
+            ink = _text_ink(_MEASURE_DRAW, TEXTCOL)
+            mask, offset = _glyph_sprite(font, ch, math.modf(x)[0], math.modf(y)[0], _MEASURE_DRAW.fontmode, ink)
+            gx, gy = int(x) + offset[0], int(y) + offset[1]
+            return (gx, gy, gx + mask.size[0], gy + mask.size[1])
+        except (AttributeError, TypeError) as e:
+            _sprites_failed(e)
+    # Растровый шрифт по умолчанию (или кэш выключен): берём bbox с запасом
+    l, t, r, b = font.getbbox(ch)
+    return (int(math.floor(x + l)) - 2, int(math.floor(y + t)) - 2,
+            int(math.ceil(x + r)) + 2, int(math.ceil(y + b)) + 2)
+
+def warm_sprites(size=None):
+    """
+    Заполняет кэш растров цифрами и постоянными подписями на тех размерах,
+    которые подберёт draw_info: рисует панель для типовых значений на черновике.
+    """
+    if size is None:
+        size = next(iter(_BASE_CACHE.values())).size if _BASE_CACHE else (1735, 986)
+    scratch = Image.new('RGBA', size, (0, 0, 0, 0))
+    sd = ImageDraw.Draw(scratch, 'RGBA')
+    for n in range(10):
+        draw_info(sd, size[0], size[1], n + 1, n, 100, 0, n % 6, n, n, n)
 
-def draw_split_pair_progress(overlay_img, bar_x, bar_w, y, h_pair, band_start, cur_lvl, lvl_frac, color_free, color_prem):
+def sprite_cache_info():
+    return dict(_SPRITE_STATS, entries=len(_SPRITES), max=SPRITE_CACHE_MAX, **_SPRITES_STATE)
+
+def place_text(start_pos, text, font, letter_spacing, advances=None):
     """
-    Рисует пару половинок (free/premium) как ЕДИНУЮ форму с внешними скруглёнными углами.
-    Внутренняя граница между половинками остаётся прямой без скруглений.
+    Абсолютные позиции глифов строки с трекингом: [(x, y, ch, font), ...].
+    Перо двигается так же, как раньше в draw_text_with_spacing (x += advance
+    от стартовой точки), так что координаты совпадают бит в бит.
+    """
+    if advances is None:
+        advances, _ = layout_spaced(text, font, letter_spacing)
+    x, y = start_pos
+    glyphs = []
+    for ch, adv in zip(text, advances):
+        glyphs.append((x, y, ch, font))
+        x += adv
+    return glyphs
+
+def paint_glyphs(draw, glyphs, fill=None, origin=(0, 0)):
+    """Рисует глифы из place_text; origin — угол картинки draw на странице."""
+    if fill is None:
+        fill = TEXTCOL
+    ink = None
+    if _SPRITES_STATE['enabled'] and draw.fontmode in ('L', '1'):
+        try:
+            ink = _text_ink(draw, fill)
+        except Exception:
+            ink = None
+    ox, oy = origin
+    for x, y, ch, font in glyphs:
+        if ink is not None and _SPRITES_STATE['enabled'] and hasattr(font, 'getmask2'):
+            try:
+                draw_glyph(draw, (x, y), ch, font, ink, origin)
+                continue
+            except (AttributeError, TypeError) as e:
+                _sprites_failed(e)
+        draw.text((x - ox, y - oy), ch, font=font, fill=fill)
+
+def glyphs_box(glyphs):
+    """Общий прямоугольник глифов или None."""
+    box = None
+    for x, y, ch, font in glyphs:
+        if ch.isspace():
+            continue
+        gb = glyph_box((x, y), ch, font)
+        box = gb if box is None else union_rect(box, gb)
+    return box
+
+def draw_text_with_spacing(draw, start_pos, text, font, fill, letter_spacing, advances=None):
+    """
+    Draw a string one character at a time applying a constant
+    additional spacing between characters.  A negative value will
+    cause characters to overlap slightly, while a positive value
+    increases the space.  Whitespace characters are not adjusted;
+    their natural width is used and the extra spacing is skipped.  This
+    preserves normal word boundaries when using negative tracking.
+    """
+    paint_glyphs(draw, place_text(start_pos, text, font, letter_spacing, advances), fill)
+
+def bar_geometry(bar_x, bar_w, y, h_pair, band_start, cur_lvl, lvl_frac):
+    """
+    Прямоугольник заполненной части пары полос: (X, Y, W, H, radius) или None,
+    если рисовать нечего.
     """
     pad = max(2, int(h_pair * 0.03))
     x0 = int(bar_x) + pad
@@ -158,7 +803,7 @@ def draw_split_pair_progress(overlay_img, bar_x, bar_w, y, h_pair, band_start, c
     y0 = int(y) + pad
     y1 = int(y + h_pair) - pad
     if x_max <= x0 or y1 <= y0:
-        return
+        return None
 
     seg_w = (x_max - x0) / 5.0
 
@@ -170,100 +815,195 @@ def draw_split_pair_progress(overlay_img, bar_x, bar_w, y, h_pair, band_start, c
         total_units = (cur_lvl - band_start) + clamp(lvl_frac, 0.0, 1.0)
 
     if total_units <= 0:
-        return
+        return None
 
     w_prog = int(seg_w * total_units + 0.5)
     if w_prog <= 0:
-        return
+        return None
 
     X = x0
     Y = y0
     W = min(w_prog, x_max - x0)
     H = y1 - y0
     if W <= 0 or H <= 0:
-        return
+        return None
 
-    radius = max(2, int(H * max(0.0, min(1.0, BAR_RADIUS_PCT))))
-    radius = min(radius, H // 2, W // 2)
+    return (X, Y, W, H, bar_radius(W, H))
 
-    # Картинка «пары» (верх — free, низ — premium)
-    band = Image.new('RGBA', (W, H), (0,0,0,0))
-    bd   = ImageDraw.Draw(band, 'RGBA')
-    Hh = H // 2
-    bd.rectangle([0, 0, W, Hh], fill=color_free)
-    bd.rectangle([0, Hh, W, H], fill=color_prem)
+def bar_radius(W, H):
+    """Радиус скругления пары полос W x H (BAR_RADIUS_PCT от высоты)."""
+    radius = max(2, int(H * max(0.0, min(1.0, BAR_RADIUS_PCT))))
+    return min(radius, H // 2, W // 2)
 
-    # Маска со скруглением только внешних углов (по сути круглится весь внешний прямоугольник пары)
+# -----------------------------------------------------------------------------
+# Кэш масок полос
+#
+# Раньше пара полос собиралась на каждый вызов из RGBA-картинки и L-маски с
+# растеризацией rounded_rectangle — дважды на рендер (эталон этой сборки —
+# bar_band в check_bp_golden.py).  Высота, радиус и цвета постоянны для
+# конфига, а ширин конечное число (5 сегментов x шаги прогресса).  Цвет
+# накладывается сплошной заливкой paste(color, box, mask) — та же формула
+# смешивания, что у paste(band, mask), поэтому в кэше только маски верхней и
+# нижней половинки, и цвета в ключ не входят.
+
+BAR_SPRITE_CACHE_MAX = _get_int_env('BP_BAR_SPRITE_CACHE', 512)
+_BAR_MASKS = OrderedDict()   # (W, H, radius) -> (mask_top, mask_bottom)
+_BAR_STATS = {'hits': 0, 'misses': 0}
+
+def bar_masks(W, H, radius):
+    """Маски половинок пары со скруглёнными внешними углами (из кэша)."""
+    key = (W, H, radius)
+    masks = _BAR_MASKS.get(key)
+    if masks is not None:
+        _BAR_MASKS.move_to_end(key)
+        _BAR_STATS['hits'] += 1
+        return masks
+    _BAR_STATS['misses'] += 1
     mask = Image.new('L', (W, H), 0)
     md   = ImageDraw.Draw(mask)
     try:
         md.rounded_rectangle([0, 0, W, H], radius=radius, fill=255)
     except Exception:
         md.rectangle([0, 0, W, H], fill=255)
+    # Строка Hh уже принадлежит premium (как в эталонной сборке)
+    Hh = H // 2
+    masks = (mask.crop((0, 0, W, Hh)), mask.crop((0, Hh, W, H)))
+    if BAR_SPRITE_CACHE_MAX > 0:
+        _BAR_MASKS[key] = masks
+        if len(_BAR_MASKS) > BAR_SPRITE_CACHE_MAX:
+            _BAR_MASKS.popitem(last=False)
+    return masks
 
-    # Однократное наложение с маской — корректно и без ошибок PIL
-    overlay_img.paste(band, (X, Y), mask)
+def bar_sprite_cache_info():
+    return dict(_BAR_STATS, entries=len(_BAR_MASKS), max=BAR_SPRITE_CACHE_MAX)
 
-def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens, raffle, packs=None):
+def draw_split_pair_progress(overlay_img, bar_x, bar_w, y, h_pair, band_start, cur_lvl, lvl_frac, color_free, color_prem, origin=(0, 0)):
     """
-    Draw the right‑hand information panel.  This custom implementation mimics
-    the layout shown in the provided sample (образец.png).  The panel
-    displays the player's level, current XP progress, counts for raffle
-    points, double‑bet tokens and card packs, and invitation stats.  The
-    design uses three distinct font sizes with specific line and letter
-    spacing to achieve the desired hierarchy:
-
-    * Level and XP lines use a 62 pt font with a slight negative letter
-      spacing (−15 pt) to tighten the characters.
-    * The numeric counters (raffle, double tokens, card packs) use a
-      large 100 pt font with a generous 95 pt line spacing between rows.
-    * The invites section at the bottom consists of two lines (e.g. “0/5”
-      and “приглашений”) rendered at 48 pt with a 48 pt inter‑line gap.
-
-    If any of the XP values are missing, they default to zero.
+    Рисует пару половинок (free/premium) как ЕДИНУЮ форму с внешними скруглёнными углами.
+    Внутренняя граница между половинками остаётся прямой без скруглений.
+    origin — угол overlay_img на странице, если рисуем во фрагмент.
     """
-    # Panel position and size as percentages of the overall image
-    panel_x_pct, panel_w_pct = 76.8, 20.2
-    panel_y_pct, panel_h_pct = 7.5, 85.0
-
-    # Compute pixel dimensions of the panel
-    x0 = int(w * panel_x_pct / 100.0)
-    y0 = int(h * panel_y_pct / 100.0)
-    ww = int(w * panel_w_pct / 100.0)
-    hh = int(h * panel_h_pct / 100.0)
-
-    # Basic padding inside the panel to avoid drawing on the edges
-    pad_x = max(14, int(ww * 0.08))
-    pad_y = max(14, int(hh * 0.08))
-
-    # Ensure numeric values are defined
-    lvl   = level if level is not None else 0
-    xp_c  = xp_cur if xp_cur is not None else 0
-    xp_n  = xp_need if xp_need is not None and xp_need > 0 else 0
-    inv   = invites if invites is not None else 0
-    dd    = dd_tokens if dd_tokens is not None else 0
-    raf   = raffle if raffle is not None else 0
-    pk    = packs if packs is not None else 0
-
-    # Prepare strings for each section
-    # Top lines: level and XP progress.  Always break onto separate lines as
-    # shown in the sample: the level followed by the current and required
-    # experience (e.g. “0/100”).
-    top_line1 = f"{lvl} уровень"
-    top_line2 = f"{xp_c}/{xp_n}"
-
-    # Middle numeric counters: raffle points (R), double‑bet tokens (DD)
-    # and card packs.  These are drawn as large numerals aligned to the
-    # left of their respective icons on the base image.  Only the numbers
-    # are drawn here; the icons reside in the base artwork.
-    mid_lines = [str(raf), str(dd), str(pk)]
+    geo = bar_geometry(bar_x, bar_w, y, h_pair, band_start, cur_lvl, lvl_frac)
+    if geo is None:
+        return
+    paste_pair(overlay_img, geo, color_free, color_prem, origin)
 
-    # Bottom invites: show the number of invites collected out of 5 on
-    # one line and the word “приглашений” beneath it.  We explicitly
-    # separate these two strings so that line spacing can be applied.
-    bottom_line1 = f"{inv}/5"
-    bottom_line2 = "приглашений"
+def paste_pair(overlay_img, geo, color_free, color_prem, origin=(0, 0)):
+    """
+    Пара по готовой геометрии (X, Y, W, H, radius) с масками из кэша.
+    color_prem = None — только верхняя половинка (free).
+    """
+    X, Y, W, H, radius = geo
+    mask_top, mask_bot = bar_masks(W, H, radius)
+    x, y0 = X - origin[0], Y - origin[1]
+    Hh = H // 2
+    # Сплошная заливка по маске — без промежуточной картинки band
+    if Hh > 0:
+        overlay_img.paste(color_free, (x, y0, x + W, y0 + Hh), mask_top)
+    if color_prem is not None:
+        overlay_img.paste(color_prem, (x, y0 + Hh, x + W, y0 + H), mask_bot)
+
+def draw_square_pair(overlay_img, geo, color_free, color_prem, origin=(0, 0)):
+    """Пара половинок без скругления — упрощение square_bars (см. «Бюджет времени»)."""
+    X, Y, W, H, _ = geo
+    x, y0 = X - origin[0], Y - origin[1]
+    Hh = H // 2
+    if Hh > 0:
+        overlay_img.paste(color_free, (x, y0, x + W, y0 + Hh))
+    overlay_img.paste(color_prem, (x, y0 + Hh, x + W, y0 + H))
 
+# -----------------------------------------------------------------------------
+# Подбор размеров шрифтов панели
+#
+# Цикл «уменьшай на 10 %, пока не влезет» зависит только от высоты панели и
+# высот строк, а высота строки — от вертикальных габаритов её символов.  Цифры
+# с одинаковыми габаритами на всех размерах, которые может перебрать цикл,
+# взаимозаменяемы, поэтому ключ кэша — «форма» строк, где каждая цифра
+# заменена представителем своего класса (у Montserrat классов шесть:
+# 0 | 1 4 7 | 2 | 3 5 | 6 | 8 9).  Так «12 уровень» и «17 уровень» дают одну
+# запись, а результат остаётся точно таким же, как при честном переборе.
+
+PanelLayout = namedtuple('PanelLayout', 'top_size mid_size bottom_size top_spacing bottom_spacing h1 b1 bottom_total')
+
+PANEL_TOP_SIZES    = (62, 28)    # (начальный, минимальный)
+PANEL_MID_SIZES    = (100, 40)
+PANEL_BOTTOM_SIZES = (48, 24)
+LAYOUT_CACHE_MAX = _get_int_env('BP_LAYOUT_CACHE', 4096)
+
+_LAYOUT_CACHE = {}
+_LAYOUT_STATS = {'hits': 0, 'misses': 0}
+_DIGIT_CLASSES = {}   # font path -> {digit: representative}
+
+def _size_chain(start, floor, shrink=0.90):
+    sizes = [start]
+    while start > floor:
+        start = max(floor, int(start * shrink))
+        sizes.append(start)
+    return sizes
+
+def _digit_classes():
+    path = resolve_font_path()
+    classes = _DIGIT_CLASSES.get(path)
+    if classes is None:
+        sizes = sorted(set(_size_chain(*PANEL_TOP_SIZES) + _size_chain(*PANEL_MID_SIZES)
+                           + _size_chain(*PANEL_BOTTOM_SIZES)))
+        saved = _load_resolved().get('digit_classes')
+        if saved and saved.get('sizes') == sizes and (_RESOLVED.get('font') or {}).get('path') == path:
+            classes = saved['classes']
+        else:
+            reps = {}
+            classes = {}
+            for d in '0123456789':
+                sig = tuple(_MEASURE_DRAW.textbbox((0, 0), d, font=load_font(sz))[1::2] for sz in sizes)
+                classes[d] = reps.setdefault(sig, d)
+            if (_RESOLVED.get('font') or {}).get('path') == path:
+                _save_resolved(digit_classes={'sizes': sizes, 'classes': classes})
+        _DIGIT_CLASSES[path] = classes
+    return classes
+
+def layout_shape(lines):
+    classes = _digit_classes()
+    return tuple(''.join(classes.get(c, c) for c in line) for line in lines)
+
+def panel_layout(hh, pad_y, top_line1, top_line2, mid_lines, bottom_line1, bottom_line2):
+    """solve_panel_layout с кэшем по форме строк (см. выше)."""
+    lines = (top_line1, top_line2) + tuple(mid_lines) + (bottom_line1, bottom_line2)
+    key = (resolve_font_path(), hh, pad_y, layout_shape(lines))
+    lay = _LAYOUT_CACHE.get(key)
+    if lay is not None:
+        _LAYOUT_STATS['hits'] += 1
+        return lay
+    _LAYOUT_STATS['misses'] += 1
+    if should_degrade('fixed_font', 'layout', 'encode:fast'):
+        return fixed_panel_layout(top_line1, top_line2, bottom_line1, bottom_line2)
+    t0 = time.perf_counter()
+    lay = solve_panel_layout(hh, pad_y, top_line1, top_line2, mid_lines, bottom_line1, bottom_line2)
+    learn_cost('layout', (time.perf_counter() - t0) * 1000.0)
+    if len(_LAYOUT_CACHE) >= LAYOUT_CACHE_MAX:
+        _LAYOUT_CACHE.clear()
+    _LAYOUT_CACHE[key] = lay
+    return lay
+
+def layout_cache_info():
+    return dict(_LAYOUT_STATS, entries=len(_LAYOUT_CACHE))
+
+def fixed_panel_layout(top_line1, top_line2, bottom_line1, bottom_line2):
+    """
+    Раскладка стартовыми размерами без подбора (упрощение fixed_font).  Когда
+    текст влезает с первой попытки, она совпадает с solve_panel_layout;
+    длинные значения могут выйти за панель по высоте.
+    """
+    font_top = load_font(PANEL_TOP_SIZES[0])
+    font_bottom = load_font(PANEL_BOTTOM_SIZES[0])
+    _, h1 = measure_text(font_top, top_line1)
+    _, b1 = measure_text(font_bottom, bottom_line1)
+    _, b2 = measure_text(font_bottom, bottom_line2)
+    bottom_spacing = 15
+    return PanelLayout(PANEL_TOP_SIZES[0], PANEL_MID_SIZES[0], PANEL_BOTTOM_SIZES[0], int(font_top.size * 0.6),
+                       bottom_spacing, h1, b1, b1 + bottom_spacing + b2)
+
+def solve_panel_layout(hh, pad_y, top_line1, top_line2, mid_lines, bottom_line1, bottom_line2):
+    """Честный перебор размеров без кэша; возвращает PanelLayout."""
     # Load fonts at the requested sizes.  We attempt to load Montserrat
     # (semibold) if available; otherwise load_font falls back to a sane default.
     # Select fonts at the sizes specified in the task description.  The
@@ -272,33 +1012,11 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
     # returned by load_font.
     #
     # Top section: 62 pt
-    font_top    = load_font(62)
+    font_top    = load_font(PANEL_TOP_SIZES[0])
     # Middle section: 100 pt
-    font_mid    = load_font(100)
+    font_mid    = load_font(PANEL_MID_SIZES[0])
     # Invites section: 48 pt
-    font_bottom = load_font(48)
-
-    # Helper to draw text with custom letter spacing.  Negative spacing
-    # tightens the characters by shifting the starting position of each
-    # subsequent glyph to the left.
-    def draw_text_with_spacing(start_pos, text, font, fill, letter_spacing):
-        """
-        Draw a string one character at a time applying a constant
-        additional spacing between characters.  A negative value will
-        cause characters to overlap slightly, while a positive value
-        increases the space.  Whitespace characters are not adjusted;
-        their natural width is used and the extra spacing is skipped.  This
-        preserves normal word boundaries when using negative tracking.
-        """
-        x, y = start_pos
-        for ch in text:
-            draw.text((x, y), ch, font=font, fill=fill)
-            cw, _ = text_wh(draw, ch, font)
-            # Do not tighten/expand after whitespace characters
-            if ch.isspace():
-                x += cw
-            else:
-                x += cw + letter_spacing
+    font_bottom = load_font(PANEL_BOTTOM_SIZES[0])
 
     # Initialise sizes for dynamic layout.  These sizes correspond to the
     # specification and will be scaled down uniformly if the overall
@@ -319,25 +1037,25 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
     gap_top_mid    = gap_top_mid_init
 
     # Minimum allowable sizes to avoid text becoming unreadable
-    min_top_size    = 28
-    min_mid_size    = 40
-    min_bottom_size = 24
+    min_top_size    = PANEL_TOP_SIZES[1]
+    min_mid_size    = PANEL_MID_SIZES[1]
+    min_bottom_size = PANEL_BOTTOM_SIZES[1]
     min_spacing     = 5
     shrink_factor   = 0.90
 
     # Dynamic scaling loop: shrink fonts and spacings until the overall
     # content height fits within the panel’s available vertical space.
     while True:
-        # Load fonts at the current sizes
+        # Load fonts at the current sizes (cached per size)
         font_top    = load_font(int(top_size))
         font_mid    = load_font(int(mid_size))
         font_bottom = load_font(int(bottom_size))
         # Measure individual line heights
-        _, h1 = text_wh(draw, top_line1, font_top)
-        _, h2 = text_wh(draw, top_line2, font_top)
-        mid_heights = [text_wh(draw, s, font_mid)[1] for s in mid_lines]
-        _, b1 = text_wh(draw, bottom_line1, font_bottom)
-        _, b2 = text_wh(draw, bottom_line2, font_bottom)
+        _, h1 = measure_text(font_top, top_line1)
+        _, h2 = measure_text(font_top, top_line2)
+        mid_heights = [measure_text(font_mid, s)[1] for s in mid_lines]
+        _, b1 = measure_text(font_bottom, bottom_line1)
+        _, b2 = measure_text(font_bottom, bottom_line2)
         # Compute internal spacings
         top_spacing = int(font_top.size * 0.6)
         # Compute total heights
@@ -358,6 +1076,88 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
         bottom_spacing = max(min_spacing, int(bottom_spacing * shrink_factor))
         gap_top_mid    = max(min_spacing, int(gap_top_mid * shrink_factor))
 
+    return PanelLayout(int(top_size), int(mid_size), int(bottom_size), top_spacing,
+                       bottom_spacing, h1, b1, bottom_total)
+
+def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens, raffle, packs=None):
+    """Рисует правую инфо-панель целиком (см. layout_info)."""
+    paint_glyphs(draw, layout_info(w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens, raffle, packs))
+
+def layout_info(w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens, raffle, packs=None):
+    """
+    Draw the right‑hand information panel.  This custom implementation mimics
+    the layout shown in the provided sample (образец.png).  The panel
+    displays the player's level, current XP progress, counts for raffle
+    points, double‑bet tokens and card packs, and invitation stats.  The
+    design uses three distinct font sizes with specific line and letter
+    spacing to achieve the desired hierarchy:
+
+    * Level and XP lines use a 62 pt font with a slight negative letter
+      spacing (−15 pt) to tighten the characters.
+    * The numeric counters (raffle, double tokens, card packs) use a
+      large 100 pt font with a generous 95 pt line spacing between rows.
+    * The invites section at the bottom consists of two lines (e.g. “0/5”
+      and “приглашений”) rendered at 48 pt with a 48 pt inter‑line gap.
+
+    If any of the XP values are missing, they default to zero.
+
+    Nothing is drawn here: the function returns the absolute glyph
+    positions ``[(x, y, ch, font), ...]`` for paint_glyphs, so the caller
+    knows the exact dirty rectangle before allocating anything.
+    """
+    # Panel position and size as percentages of the overall image
+    panel_x_pct, panel_w_pct = 76.8, 20.2
+    panel_y_pct, panel_h_pct = 7.5, 85.0
+
+    # Compute pixel dimensions of the panel
+    x0 = int(w * panel_x_pct / 100.0)
+    y0 = int(h * panel_y_pct / 100.0)
+    ww = int(w * panel_w_pct / 100.0)
+    hh = int(h * panel_h_pct / 100.0)
+
+    # Basic padding inside the panel to avoid drawing on the edges
+    pad_x = max(14, int(ww * 0.08))
+    pad_y = max(14, int(hh * 0.08))
+
+    # Ensure numeric values are defined
+    lvl   = level if level is not None else 0
+    xp_c  = xp_cur if xp_cur is not None else 0
+    xp_n  = xp_need if xp_need is not None and xp_need > 0 else 0
+    inv   = invites if invites is not None else 0
+    dd    = dd_tokens if dd_tokens is not None else 0
+    raf   = raffle if raffle is not None else 0
+    pk    = packs if packs is not None else 0
+
+    # Prepare strings for each section
+    # Top lines: level and XP progress.  Always break onto separate lines as
+    # shown in the sample: the level followed by the current and required
+    # experience (e.g. “0/100”).
+    top_line1 = f"{lvl} уровень"
+    top_line2 = f"{xp_c}/{xp_n}"
+
+    # Middle numeric counters: raffle points (R), double‑bet tokens (DD)
+    # and card packs.  These are drawn as large numerals aligned to the
+    # left of their respective icons on the base image.  Only the numbers
+    # are drawn here; the icons reside in the base artwork.
+    mid_lines = [str(raf), str(dd), str(pk)]
+
+    # Bottom invites: show the number of invites collected out of 5 on
+    # one line and the word “приглашений” beneath it.  We explicitly
+    # separate these two strings so that line spacing can be applied.
+    bottom_line1 = f"{inv}/5"
+    bottom_line2 = "приглашений"
+
+    # Font sizes that make all seven lines fit the panel height.  The
+    # shrink-to-fit search lives in solve_panel_layout and is memoised by
+    # the shape of the strings, so repeated renders skip it entirely.
+    lay = panel_layout(hh, pad_y, top_line1, top_line2, mid_lines, bottom_line1, bottom_line2)
+    font_top    = load_font(lay.top_size)
+    font_mid    = load_font(lay.mid_size)
+    font_bottom = load_font(lay.bottom_size)
+    h1, b1 = lay.h1, lay.b1
+    top_spacing    = lay.top_spacing
+    bottom_spacing = lay.bottom_spacing
+    bottom_total   = lay.bottom_total
 
     # Жёстко задаём координаты для чисел (raffle, dd, packs)
     # top_y — для верхней секции, bottom_y — для приглашений, mid_y — для чисел
@@ -369,12 +1169,8 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
     mid_y2 = y0 + int(hh * 0.48)
     mid_y3 = y0 + int(hh * 0.65)
 
-    # X positions: use a fixed left padding inside the panel
-    x_text = x0 + pad_x
-    xp_dx = 0   # + вправо, - влево
-    xp_dy = 0     # + вниз,  - вверх
     # Apply position offsets for each group of text.  These are read from
-    # global constants (possibly set via environment variables) and allow
+    # global constants (set by the render profile or environment variables) and allow
     # the caller to nudge the text blocks horizontally or vertically.  See
     # the definitions of TOP_DX, TOP_DY, MID_DX, MID_DY, INV_DX and INV_DY
     # at the top of the module for details.
@@ -397,19 +1193,6 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
     # available space the calculated offset will be negative, in which case
     # the text will naturally extend to the panel edges.
 
-    # Helper to compute the width of a string when drawn with a given font
-    # and letter spacing.  This mirrors the draw_text_with_spacing logic by
-    # summing the widths of individual glyphs and inserting the specified
-    # letter spacing after non‑whitespace characters.
-    def compute_text_width(text: str, font: ImageFont.ImageFont, letter_spacing: float) -> float:
-        total = 0.0
-        for i, ch in enumerate(text):
-            cw, _ = text_wh(draw, ch, font)
-            total += cw
-            if not ch.isspace() and i < len(text) - 1:
-                total += letter_spacing
-        return total
-
     # Determine the width available for centring text.  This is the width of
     # the panel minus the left and right padding.
     avail_w = ww - 2 * pad_x
@@ -420,11 +1203,12 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
     letter_spacing_top = -0.15
     letter_spacing_bottom = -0.15
 
-    # Compute widths of the top and bottom lines
-    top_w1 = compute_text_width(top_line1, font_top, letter_spacing_top)
-    top_w2 = compute_text_width(top_line2, font_top, letter_spacing_top)
-    bot_w1 = compute_text_width(bottom_line1, font_bottom, letter_spacing_bottom)
-    bot_w2 = compute_text_width(bottom_line2, font_bottom, letter_spacing_bottom)
+    # Lay out the top and bottom lines (per-glyph advances and total widths)
+    # from the cached glyph tables in a single pass.
+    top_adv1, top_w1 = layout_spaced(top_line1, font_top, letter_spacing_top)
+    top_adv2, top_w2 = layout_spaced(top_line2, font_top, letter_spacing_top)
+    bot_adv1, bot_w1 = layout_spaced(bottom_line1, font_bottom, letter_spacing_bottom)
+    bot_adv2, bot_w2 = layout_spaced(bottom_line2, font_bottom, letter_spacing_bottom)
 
     # Compute X positions to centre each line within the available width
     # Apply per‑group horizontal padding adjustments (TOP_PAD_X and INV_PAD_X).
@@ -439,11 +1223,12 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
 
     # Draw the top (level/XP) lines at their centred positions.  Use
     # letter_spacing_top for both lines to tighten the glyphs slightly.
-    draw_text_with_spacing((x_top1, top_y + off_top_y), top_line1, font_top, TEXTCOL, letter_spacing_top)
-    draw_text_with_spacing((x_top2, top_y + h1 + top_spacing + off_top_y), top_line2, font_top, TEXTCOL, letter_spacing_top)
+    glyphs = []
+    glyphs += place_text((x_top1, top_y + off_top_y), top_line1, font_top, letter_spacing_top, top_adv1)
+    glyphs += place_text((x_top2, top_y + h1 + top_spacing + off_top_y), top_line2, font_top, letter_spacing_top, top_adv2)
 
     # Draw the large numeric counters.  Each numeric row can be offset
-    # individually via environment variables (RAFFLE_DX/DY, DD_DX/DY,
+    # individually via the render profile (RAFFLE_DX/DY, DD_DX/DY,
     # PACK_DX/DY).  These per‑row offsets are applied on top of the
     # MID_DX/MID_DY adjustments.  The X coordinate does not incorporate
     # centring because the numbers align with their icons on the base
@@ -453,61 +1238,386 @@ def draw_info(draw, w, h, level, xp_cur, xp_need, is_premium, invites, dd_tokens
     row_offsets_x = [RAFFLE_DX, DD_DX, PACK_DX]
     row_offsets_y = [RAFFLE_DY, DD_DY, PACK_DY]
     for idx, s in enumerate(mid_lines):
-        w_s, _ = text_wh(draw, s, font_mid)
+        w_s, _ = measure_text(font_mid, s)
         x_anchor = x0 + pad_x + off_mid_x + row_offsets_x[idx]
         x_line = x_anchor - w_s
         y_line = mid_ys[idx] + row_offsets_y[idx]
-        draw_text_with_spacing((x_line, y_line), s, font_mid, TEXTCOL, 0)
+        glyphs += place_text((x_line, y_line), s, font_mid, 0)
 
     # Draw the bottom invites section at its centred positions.  Use
     # letter_spacing_bottom to tighten the text horizontally.  Both lines
     # share the same vertical offsets (off_inv_y) so that they move
     # together when INV_DX/DY are modified.
-    draw_text_with_spacing((x_bot1, bottom_y + off_inv_y), bottom_line1, font_bottom, TEXTCOL, letter_spacing_bottom)
-    draw_text_with_spacing((x_bot2, bottom_y + b1 + bottom_spacing + off_inv_y), bottom_line2, font_bottom, TEXTCOL, letter_spacing_bottom)
+    glyphs += place_text((x_bot1, bottom_y + off_inv_y), bottom_line1, font_bottom, letter_spacing_bottom, bot_adv1)
+    glyphs += place_text((x_bot2, bottom_y + b1 + bottom_spacing + off_inv_y), bottom_line2, font_bottom, letter_spacing_bottom, bot_adv2)
+    return glyphs
 
-def main():
-    if len(sys.argv) < 12:
-        print("usage: in out pageStart curLvl lvlFrac xPct widthPct topY topH botY botH "
-              "[level xpCur xpNeed premium invites ddTokens raffle]")
-        sys.exit(1)
+# -----------------------------------------------------------------------------
+# Кэш декодированных страниц
+#
+# Страниц всего десять, и они не меняются, а декодирование PNG 1735x986 и
+# перевод в RGBA (~6.8 МБ) — одна из самых дорогих частей рендера.  В долгоживущем
+# процессе (--serve) держим уже сконвертированные RGBA-картинки, ключ — путь +
+# mtime/размер файла, так что подмена ассета подхватывается без перезапуска.
+# Объём ограничен BP_BASE_CACHE_MB (0 — кэш выключен), вытеснение LRU.
+# Картинки из кэша общие: их нельзя менять на месте, только копировать.
+
+BASE_CACHE_MB = _get_int_env('BP_BASE_CACHE_MB', 160)
+BASE_DIR_DEFAULT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'bp')
+
+_BASE_CACHE = OrderedDict()   # (abs path, mtime_ns, size, mode) -> Image
+_BASE_CACHE_STATS = {'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+def _image_bytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
 
-    in_path, out_path = sys.argv[1], sys.argv[2]
-    page_start = int(sys.argv[3])
-    cur_lvl    = int(sys.argv[4])
-    lvl_frac   = float(sys.argv[5])
-    xPct       = float(sys.argv[6])
-    widthPct   = float(sys.argv[7])
-    top_yPct   = float(sys.argv[8])
-    top_hPct   = float(sys.argv[9])
-    bot_yPct   = float(sys.argv[10])
-    bot_hPct   = float(sys.argv[11])
-
-    level = xp_cur = xp_need = premium = invites = dd = raffle = packs = None
+def _base_cache_drop(key):
+    img = _BASE_CACHE.pop(key)
+    _BASE_CACHE_STATS['bytes'] -= _image_bytes(img)
+
+# -----------------------------------------------------------------------------
+# Предекодированные страницы (raw + mmap)
+#
+# Даже с кэшем каждый новый процесс (холодный старт, перезапуск воркера пула)
+# заново декодирует PNG.  Поэтому RGBA-пиксели страницы лежат рядом готовым
+# файлом: заголовок + сырые байты.  Файл отображается в память (mmap) и
+# оборачивается Image.frombuffer без копирования — несколько процессов делят
+# одни и те же физические страницы через кэш ОС.  Такая картинка только для
+# чтения; PIL сам скопирует её при попытке изменить.
+#
+# Заголовок хранит mtime/размер исходного PNG: если PNG поменялся, raw-файл
+# считается устаревшим и пересобирается при следующей загрузке (запись
+# атомарная).  Заранее собрать всё: --build-raw [PNG ...] или
+# node scripts/build_bp_raw.js (страницы из config.battlePass.imagePaths).
+#
+#   BP_RAW_PAGES   1 | 0 — использовать raw-файлы (по умолчанию 1)
+#   BP_RAW_DIR     каталог raw-файлов (по умолчанию data/bp_raw)
+
+RAW_PAGES = os.environ.get('BP_RAW_PAGES', '1') != '0'
+RAW_DIR = STATE_DIR
+RAW_MAGIC = b'BPRAW\x01\x00\x00'
+# magic, width, height, mode, src mtime_ns, src size, смещение пикселей
+RAW_HEADER = struct.Struct('<8sII8sqqI')
+RAW_DATA_OFFSET = 64
+
+def raw_page_path(path):
+    apath = os.path.abspath(path)
+    tag = hashlib.sha1(apath.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(apath))[0]
+    return os.path.join(RAW_DIR, f"{name}.{tag}.rgba")
+
+def load_raw_page(path, st=None):
+    """RGBA-страница из актуального raw-файла (через mmap) или None."""
+    st = st or os.stat(path)
+    try:
+        f = open(raw_page_path(path), 'rb')
+    except OSError:
+        return None
+    with f:
+        try:
+            magic, w, h, mode, mtime_ns, size, off = RAW_HEADER.unpack(f.read(RAW_HEADER.size))
+        except struct.error:
+            return None
+        if (magic != RAW_MAGIC or mode.rstrip(b'\0') != b'RGBA' or mtime_ns != st.st_mtime_ns
+                or size != st.st_size or os.fstat(f.fileno()).st_size != off + w * h * 4):
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Image.frombuffer('RGBA', (w, h), memoryview(mm)[off:], 'raw', 'RGBA', 0, 1)
+
+def write_raw_page(path, img, st=None):
+    """Сохраняет RGBA-страницу raw-файлом (атомарно). -> путь"""
+    st = st or os.stat(path)
+    out = raw_page_path(path)
+    os.makedirs(RAW_DIR, exist_ok=True)
+    header = RAW_HEADER.pack(RAW_MAGIC, img.size[0], img.size[1], b'RGBA', st.st_mtime_ns, st.st_size, RAW_DATA_OFFSET)
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=RAW_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.ljust(RAW_DATA_OFFSET, b'\0'))
+            f.write(img.tobytes())
+        os.replace(tmp, out)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return out
+
+def _decode_page(path, st):
+    if RAW_PAGES:
+        img = load_raw_page(path, st)
+        if img is not None:
+            return img
+    with trace_stage('decode'), Image.open(path) as src:
+        img = src.convert('RGBA')
+    if RAW_PAGES:
+        # Пересборка устаревшего/отсутствующего raw-файла; без прав на запись
+        # (или на Windows, пока файл отображён другим процессом) просто
+        # продолжаем с декодированной картинкой
+        try:
+            with trace_stage('raw_write'):
+                write_raw_page(path, img, st)
+        except OSError:
+            pass
+    return img
+
+def build_raw_pages(paths):
+    """Собирает raw-файлы для страниц; актуальные не трогает. -> [{'in', 'raw', 'built'}]"""
+    report = []
+    for path in paths:
+        st = os.stat(path)
+        built = load_raw_page(path, st) is None
+        if built:
+            with Image.open(path) as src:
+                write_raw_page(path, src.convert('RGBA'), st)
+        report.append({'in': path, 'raw': raw_page_path(path), 'built': built})
+    return report
+
+def load_base(path, mode='RGBA'):
+    """
+    Страница в RGBA (или RGB — готовый фон для сборки по грязным областям):
+    из кэша, если файл не менялся, иначе из raw-файла или PNG.
+    """
+    st = os.stat(path)
+    apath = os.path.abspath(path)
+    key = (apath, st.st_mtime_ns, st.st_size, mode)
+    img = _BASE_CACHE.get(key)
+    if img is not None:
+        _BASE_CACHE.move_to_end(key)
+        _BASE_CACHE_STATS['hits'] += 1
+        return img
+    _BASE_CACHE_STATS['misses'] += 1
+    if mode == 'RGBA':
+        img = _decode_page(path, st)
+    else:
+        base = load_base(path)
+        with trace_stage('decode_rgb'):
+            img = base.convert(mode)
+    cap = BASE_CACHE_MB * 1024 * 1024
+    if cap <= 0:
+        return img
+    # Старые версии того же файла больше не нужны
+    for old in [k for k in _BASE_CACHE if k[0] == apath and k[3] == mode and k != key]:
+        _base_cache_drop(old)
+    _BASE_CACHE[key] = img
+    _BASE_CACHE_STATS['bytes'] += _image_bytes(img)
+    while _BASE_CACHE_STATS['bytes'] > cap and len(_BASE_CACHE) > 1:
+        _base_cache_drop(next(iter(_BASE_CACHE)))
+        _BASE_CACHE_STATS['evictions'] += 1
+    return img
+
+def _page_paths():
+    d = os.environ.get('BP_BASE_DIR', BASE_DIR_DEFAULT)
+    try:
+        return sorted(os.path.join(d, n) for n in os.listdir(d) if n.lower().endswith('.png'))
+    except OSError:
+        return []
+
+def warm_bases(paths=None):
+    """Заранее декодирует страницы (по умолчанию все assets/bp/*.png)."""
+    if paths is None:
+        paths = _page_paths()
+    for p in paths:
+        try:
+            load_base(p)
+            if DIRTY_RECTS:
+                load_base(p, 'RGB')
+        except Exception:
+            pass
+
+def base_cache_info():
+    return dict(_BASE_CACHE_STATS, entries=len(_BASE_CACHE), cap_mb=BASE_CACHE_MB)
+
+USAGE = ("usage: in out|- pageStart curLvl lvlFrac xPct widthPct topY topH botY botH "
+         "[level xpCur xpNeed premium invites ddTokens raffle packs]\n"
+         "       [--encoder=fast|balanced|small|webp] [--report] [--trace|--trace=mem] [--stages]\n"
+         "       [--timing] [--budget=MS] [--anim=apng|webp --from=LVL:FRAC [--frames=N]]\n"
+         "       --serve [--socket PATH] [--warm]\n"
+         "       --batch FILE|- [--encoder=...]\n"
+         "       --leaderboard FILE|- [--encoder=...] [--report] [--budget=MS] [--stages]\n"
+         "       --build-raw [PNG ...]")
+
+# Порядок позиционных аргументов CLI.  Те же имена используются как ключи
+# JSON-задания в режиме --serve.
+JOB_FIELDS = [
+    ('in', str), ('out', str), ('pageStart', int), ('curLvl', int), ('lvlFrac', float),
+    ('xPct', float), ('widthPct', float), ('topY', float), ('topH', float),
+    ('botY', float), ('botH', float),
+]
+INFO_FIELDS = [
+    ('level', int), ('xpCur', int), ('xpNeed', int), ('premium', int),
+    ('invites', int), ('ddTokens', int), ('raffle', int), ('packs', int),
+]
+
+def parse_args(argv):
+    """Позиционные аргументы CLI -> словарь задания (см. JOB_FIELDS/INFO_FIELDS)."""
+    if len(argv) < len(JOB_FIELDS):
+        raise ValueError(USAGE)
+    job = {}
+    for (name, conv), raw in zip(JOB_FIELDS, argv):
+        job[name] = conv(raw)
     # Если переданы дополнительные аргументы (level, xp_cur, xp_need, premium, invites, dd, raffle, packs)
-    if len(sys.argv) >= 20:
-        level   = int(sys.argv[12])
-        xp_cur  = int(sys.argv[13])
-        xp_need = int(sys.argv[14])
-        premium = int(sys.argv[15])
-        invites = int(sys.argv[16])
-        dd      = int(sys.argv[17])
-        raffle  = int(sys.argv[18])
-        packs   = int(sys.argv[19])
-
-    base = Image.open(in_path).convert('RGBA')
-    w, h = base.size
+    if len(argv) >= len(JOB_FIELDS) + len(INFO_FIELDS):
+        for (name, conv), raw in zip(INFO_FIELDS, argv[len(JOB_FIELDS):]):
+            job[name] = conv(raw)
+    return job
+
+def normalize_job(job):
+    """
+    Приводит JSON-задание к тем же типам, что и parse_args.  Допускается
+    форма {"argv": [...]} с позиционными аргументами как в CLI.
+    """
+    if 'argv' in job:
+        out = parse_args([str(a) for a in job['argv']])
+        if job.get('encoder'):
+            out['encoder'] = str(job['encoder'])
+        _extra_fields(job, out)
+        return out
+    out = {}
+    geometry = profile_geometry()
+    for name, conv in JOB_FIELDS:
+        if name not in job and name in geometry:
+            out[name] = geometry[name]
+            continue
+        if name not in job:
+            raise ValueError(f"missing field: {name}")
+        out[name] = conv(job[name])
+    if job.get('level') is not None:
+        for name, conv in INFO_FIELDS:
+            out[name] = conv(job.get(name) or 0)
+    if job.get('encoder'):
+        out['encoder'] = str(job['encoder'])
+    _extra_fields(job, out)
+    return out
+
+def _extra_fields(job, out):
+    if job.get('budgetMs') is not None:
+        out['budgetMs'] = float(job['budgetMs'])
+    if job.get('anim'):
+        out['anim'] = str(job['anim'])
+        out['fromLvl'] = int(job.get('fromLvl', out['curLvl']))
+        out['fromFrac'] = float(job.get('fromFrac', 0.0))
+        if job.get('frames'):
+            out['frames'] = int(job['frames'])
+
+# -----------------------------------------------------------------------------
+# Сборка кадра по грязным областям
+#
+# Меняются только две полосы и правая панель, а раньше на каждый рендер
+# выделялся прозрачный оверлей на всю страницу, весь кадр проходил через
+# alpha_composite и потом целиком через convert('RGB').  Теперь каждый слой
+# сообщает свой прямоугольник, пересекающиеся прямоугольники сливаются, и
+# оверлей выделяется, смешивается и конвертируется только в этих областях
+# поверх копии RGB-фона.  Прозрачные пиксели оверлея alpha_composite
+# оставляет как есть, поэтому результат совпадает с полной сборкой.
+# BP_DIRTY_RECTS=0 возвращает полную сборку (render_full).
+
+DIRTY_RECTS = os.environ.get('BP_DIRTY_RECTS', '1') != '0'
+
+def union_rect(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _rects_touch(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
 
-    overlay = Image.new('RGBA', (w, h), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay, 'RGBA')
+def merge_layers(layers, w, h):
+    """
+    [(rect, painter), ...] -> [(rect, [painters]), ...]: пересекающиеся
+    прямоугольники объединяются (внутри области слои рисуются в одном оверлее
+    в исходном порядке), всё обрезается по границам страницы.
+    """
+    groups = []
+    for rect, painter in layers:
+        x0, y0, x1, y1 = rect
+        rect = (max(0, x0), max(0, y0), min(w, x1), min(h, y1))
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            continue
+        groups.append([rect, [(len(groups), painter)]])
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                if _rects_touch(groups[i][0], groups[j][0]):
+                    groups[i][0] = union_rect(groups[i][0], groups[j][0])
+                    groups[i][1] = sorted(groups[i][1] + groups[j][1])
+                    del groups[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(rect, [p for _, p in painters]) for rect, painters in groups]
+
+def _page_geometry(job, w, h):
+    bar_x = int(w * job['xPct'] / 100.0)
+    bar_w = int(w * job['widthPct'] / 100.0)
+    top_y = int(h * job['topY'] / 100.0)
+    top_h = max(2, int(h * job['topH'] / 100.0))
+    bot_y = int(h * job['botY'] / 100.0)
+    bot_h = max(2, int(h * job['botH'] / 100.0))
+    return bar_x, bar_w, top_y, top_h, bot_y, bot_h
 
-    bar_x = int(w * xPct / 100.0)
-    bar_w = int(w * widthPct / 100.0)
+# -----------------------------------------------------------------------------
+# Кэш слоёв
+#
+# Картинка складывается из независимых слоёв: две полосы и инфо-панель.
+# Ставка меняет счётчики, но не опыт; начисление опыта — наоборот, поэтому
+# каждая собранная область (RGB-фрагмент страницы с наложенными слоями)
+# кэшируется по ключам своих слоёв:
+#
+#   полоса  — страница, прямоугольник заливки (из уровня и доли) и цвета;
+#   панель  — размер страницы, значения счётчиков, цвет текста, сдвиги и шрифт.
+#
+# Новая картинка — копия фона и вставка фрагментов; перерисовывается только
+# слой, у которого изменились входы.  Для панели запоминается и её
+# прямоугольник, так что на попадании раскладка текста не считается вовсе.
+# Полностью пройденные страницы дают одну и ту же полосу при любом уровне.
+#
+#   BP_LAYER_CACHE_MB  предел объёма фрагментов, МБ (32, 0 — выключен)
+
+LAYER_CACHE_MB = _get_int_env('BP_LAYER_CACHE_MB', 32)
+_LAYER_CACHE = OrderedDict()   # (страница, прямоугольник, ключи слоёв) -> RGB-фрагмент
+_LAYER_BOXES = {}              # ключ панели -> прямоугольник или None
+_LAYER_STATS = {'hits': 0, 'misses': 0, 'bytes': 0, 'evictions': 0}
+
+def _panel_key(job, w, h):
+    return ('info', w, h) + tuple(job[name] for name, _ in INFO_FIELDS) + (
+        TEXTCOL, TOP_DX, TOP_DY, TOP_PAD_X, INV_PAD_X, MID_DX, MID_DY, INV_DX, INV_DY,
+        RAFFLE_DX, RAFFLE_DY, DD_DX, DD_DY, PACK_DX, PACK_DY, resolve_font_path())
+
+def _layer_cache_get(key):
+    patch = _LAYER_CACHE.get(key)
+    if patch is not None:
+        _LAYER_CACHE.move_to_end(key)
+        _LAYER_STATS['hits'] += 1
+    else:
+        _LAYER_STATS['misses'] += 1
+    return patch
 
-    top_y = int(h * top_yPct / 100.0)
-    top_h = max(2, int(h * top_hPct / 100.0))
-    bot_y = int(h * bot_yPct / 100.0)
-    bot_h = max(2, int(h * bot_hPct / 100.0))
+def _layer_cache_put(key, patch):
+    cap = LAYER_CACHE_MB * 1024 * 1024
+    size = _image_bytes(patch)
+    if size > cap:
+        return
+    _LAYER_CACHE[key] = patch
+    _LAYER_STATS['bytes'] += size
+    while _LAYER_STATS['bytes'] > cap:
+        _, old = _LAYER_CACHE.popitem(last=False)
+        _LAYER_STATS['bytes'] -= _image_bytes(old)
+        _LAYER_STATS['evictions'] += 1
+
+def layer_cache_info():
+    return dict(_LAYER_STATS, entries=len(_LAYER_CACHE), cap_mb=LAYER_CACHE_MB)
+
+def overlay_layers(job, w, h):
+    """Слои оверлея для задания: [(rect, painter(img, origin), key), ...]."""
+    bar_x, bar_w, top_y, top_h, bot_y, bot_h = _page_geometry(job, w, h)
+    page_start = job['pageStart']
+    cur_lvl    = job['curLvl']
+    lvl_frac   = job['lvlFrac']
+    layers = []
 
     # Always render the progress bars for pages that have been reached or
     # completed.  Originally bars were drawn only when the current level
@@ -516,24 +1626,977 @@ def main():
     # fully filled bars, and the current page displays the appropriate
     # fractional progress.  Future pages (cur_lvl < page_start) remain
     # empty.
-    page_end = page_start + 9
     if cur_lvl >= page_start:
-        draw_split_pair_progress(
-            overlay, bar_x, bar_w, top_y, top_h,
-            band_start=page_start, cur_lvl=cur_lvl, lvl_frac=lvl_frac,
-            color_free=TOP_FREE_RGBA, color_prem=TOP_PREM_RGBA
-        )
-        draw_split_pair_progress(
-            overlay, bar_x, bar_w, bot_y, bot_h,
-            band_start=page_start + 5, cur_lvl=cur_lvl, lvl_frac=lvl_frac,
-            color_free=BOT_FREE_RGBA, color_prem=BOT_PREM_RGBA
-        )
-
-    if level is not None:
-        draw_info(draw, w, h, level, xp_cur, xp_need, premium, invites, dd, raffle, packs)
-
-    composed = Image.alpha_composite(base, overlay).convert('RGB')
-    composed.save(out_path)
+        for y, hp, start, cf, cp in ((top_y, top_h, page_start, TOP_FREE_RGBA, TOP_PREM_RGBA),
+                                     (bot_y, bot_h, page_start + 5, BOT_FREE_RGBA, BOT_PREM_RGBA)):
+            geo = bar_geometry(bar_x, bar_w, y, hp, start, cur_lvl, lvl_frac)
+            if geo is None:
+                continue
+            X, Y, W, H, _ = geo
+
+            def paint_bar(img, origin, fast=False, y=y, hp=hp, start=start, cf=cf, cp=cp, geo=geo):
+                if fast:
+                    draw_square_pair(img, geo, cf, cp, origin)
+                else:
+                    draw_split_pair_progress(img, bar_x, bar_w, y, hp, start, cur_lvl, lvl_frac, cf, cp, origin)
+            layers.append(((X, Y, X + W, Y + H), paint_bar, ('bar', geo, cf, cp)))
+
+    if job.get('level') is not None:
+        key = _panel_key(job, w, h)
+        box = _LAYER_BOXES.get(key, False)
+        glyphs = None
+        if box is False:
+            fixed = degrade_count('fixed_font')
+            glyphs = layout_info(w, h, job['level'], job['xpCur'], job['xpNeed'], job['premium'],
+                                 job['invites'], job['ddTokens'], job['raffle'], job['packs'])
+            box = glyphs_box(glyphs)
+            if degrade_count('fixed_font') > fixed:
+                # Раскладка упрощённая — не запоминаем, а слой получает свой ключ
+                key += ('fixed_font',)
+            elif LAYER_CACHE_MB > 0:
+                if len(_LAYER_BOXES) >= LAYOUT_CACHE_MAX:
+                    _LAYER_BOXES.clear()
+                _LAYER_BOXES[key] = box
+        if box is not None:
+            def paint_info(img, origin, fast=False, glyphs=glyphs):
+                if glyphs is None:
+                    glyphs = layout_info(w, h, job['level'], job['xpCur'], job['xpNeed'], job['premium'],
+                                         job['invites'], job['ddTokens'], job['raffle'], job['packs'])
+                paint_glyphs(ImageDraw.Draw(img, 'RGBA'), glyphs, TEXTCOL, origin)
+            layers.append((box, paint_info, key))
+    return layers
+
+def render_full(job):
+    """Эталонная сборка: оверлей на всю страницу и полный alpha_composite."""
+    base = load_base(job['in'])
+    w, h = base.size
+    with trace_stage('layers'):
+        layers = overlay_layers(job, w, h)
+    with trace_stage('paint'):
+        overlay = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+        for _, painter, _ in layers:
+            painter(overlay, (0, 0))
+    with trace_stage('composite'):
+        return Image.alpha_composite(base, overlay).convert('RGB')
+
+def render(job):
+    """Рисует полосы и инфо-панель поверх страницы; возвращает RGB-картинку."""
+    if not DIRTY_RECTS:
+        return render_full(job)
+    base = load_base(job['in'])
+    w, h = base.size
+    rgb = load_base(job['in'], 'RGB')
+    with trace_stage('copy'):
+        out = rgb.copy()
+    with trace_stage('layers'):
+        layers = overlay_layers(job, w, h)
+        regions = merge_layers([(rect, (painter, key)) for rect, painter, key in layers], w, h)
+    page = None
+    for rect, items in regions:
+        x0, y0, x1, y1 = rect
+        patch = None
+        if LAYER_CACHE_MB > 0:
+            if page is None:
+                st = os.stat(job['in'])
+                page = (os.path.abspath(job['in']), st.st_mtime_ns, st.st_size)
+            ckey = (page, rect, tuple(key for _, key in items))
+            with trace_stage('layer_cache'):
+                patch = _layer_cache_get(ckey)
+        if patch is None:
+            bars = any(key[0] == 'bar' for _, key in items)
+            fast = bars and should_degrade('square_bars', 'bars', 'encode:fast')
+            t0 = time.perf_counter()
+            with trace_stage('paint'):
+                overlay = Image.new('RGBA', (x1 - x0, y1 - y0), (0, 0, 0, 0))
+                for painter, _ in items:
+                    painter(overlay, (x0, y0), fast)
+            with trace_stage('composite'):
+                patch = Image.alpha_composite(base.crop(rect), overlay).convert('RGB')
+            if bars and not fast and len(items) == 1:
+                learn_cost('bars', (time.perf_counter() - t0) * 1000.0)
+            if LAYER_CACHE_MB > 0 and not fast and not any('fixed_font' in key for _, key in items):
+                _layer_cache_put(ckey, patch)
+        out.paste(patch, (x0, y0))
+    return out
+
+# -----------------------------------------------------------------------------
+# Кэш готовых картинок
+#
+# Чаще всего пользователь листает одни и те же страницы без нового опыта, и мы
+# раз за разом рисуем одинаковые картинки.  Ключ кэша — хэш нормализованных
+# входов рендера: страница (путь + mtime/размер файла), геометрия, счётчики,
+# цвета и смещения, формат вывода.  Нормализация отбрасывает то, что не влияет
+# на картинку: lvlFrac и точный уровень для чужих страниц.
+#
+#   BP_RESULT_CACHE      memory | disk | off  (по умолчанию memory, а если
+#                        задан BP_RESULT_CACHE_DIR — disk)
+#   BP_RESULT_CACHE_DIR  каталог для disk; запись атомарная (tmp + rename),
+#                        поэтому один каталог могут делить несколько процессов
+#   BP_RESULT_CACHE_MB   предел объёма (64), BP_RESULT_CACHE_TTL — срок жизни, с (600)
+#   BP_FRAC_STEPS        N > 0 — квантовать lvlFrac вниз до N шагов, чтобы
+#                        соседние значения опыта давали одну и ту же картинку
+
+# Меняется, когда меняется то, как рисуется картинка, чтобы старые записи
+# на диске не выдавались за новые.
+RENDER_VERSION = 1
+
+FRAC_STEPS = _get_int_env('BP_FRAC_STEPS', 0)
+RESULT_CACHE_DIR = os.environ.get('BP_RESULT_CACHE_DIR', '')
+RESULT_CACHE_KIND = os.environ.get('BP_RESULT_CACHE', 'disk' if RESULT_CACHE_DIR else 'memory')
+RESULT_CACHE_MB = _get_int_env('BP_RESULT_CACHE_MB', 64)
+RESULT_CACHE_TTL = _get_int_env('BP_RESULT_CACHE_TTL', 600)
+
+def quantize_job(job):
+    """Применяет BP_FRAC_STEPS к заданию (до рендера, чтобы картинка совпала с ключом)."""
+    if FRAC_STEPS > 0:
+        job = dict(job, lvlFrac=math.floor(clamp(job['lvlFrac'], 0.0, 1.0) * FRAC_STEPS) / FRAC_STEPS)
+    return job
+
+def render_key(job, encoder):
+    """Хэш всего, от чего зависят байты картинки."""
+    st = os.stat(job['in'])
+    ps = job['pageStart']
+    cur = job['curLvl']
+    frac = job['lvlFrac']
+    # Полосы зависят от lvlFrac только на странице текущего уровня, а от
+    # уровня — только в пределах [ps-1, ps+10] (до — пусто, после — полностью).
+    if not (ps <= cur <= ps + 9):
+        frac = 0.0
+    cur = max(ps - 1, min(ps + 10, cur))
+    parts = {
+        'v': RENDER_VERSION,
+        'base': [os.path.abspath(job['in']), st.st_mtime_ns, st.st_size],
+        'geo': [job[k] for k in ('xPct', 'widthPct', 'topY', 'topH', 'botY', 'botH')],
+        'bar': [ps, cur, frac],
+        'info': [job.get(name) for name, _ in INFO_FIELDS],
+        'style': [TOP_FREE_RGBA, TOP_PREM_RGBA, BOT_FREE_RGBA, BOT_PREM_RGBA, BAR_RADIUS_PCT, TEXTCOL,
+                  TOP_DX, TOP_DY, TOP_PAD_X, INV_PAD_X, MID_DX, MID_DY, INV_DX, INV_DY,
+                  RAFFLE_DX, RAFFLE_DY, DD_DX, DD_DY, PACK_DX, PACK_DY, resolve_font_path()],
+        'enc': [encoder, bp_encode.ENCODER_PROFILES[encoder]],
+    }
+    raw = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class MemoryResultCache:
+    """LRU в памяти процесса с пределом по байтам и TTL."""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.items = OrderedDict()   # key -> (stored_at, bytes)
+        self.bytes = 0
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if self.ttl > 0 and time.time() - item[0] > self.ttl:
+            self._drop(key)
+            return None
+        self.items.move_to_end(key)
+        return item[1]
+
+    def put(self, key, data):
+        if key in self.items:
+            self._drop(key)
+        if len(data) > self.max_bytes:
+            return
+        self.items[key] = (time.time(), data)
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self.items)))
+
+    def _drop(self, key):
+        _, data = self.items.pop(key)
+        self.bytes -= len(data)
+
+    def info(self):
+        return {'entries': len(self.items), 'bytes': self.bytes}
+
+class DiskResultCache:
+    """
+    Каталог с файлами <ключ>.bin.  Запись через временный файл и os.replace,
+    так что читатель в другом процессе видит либо старый файл, либо новый
+    целиком.  Возраст считается по mtime (попадание его обновляет), лишнее
+    сверх предела удаляется от самых старых.
+    """
+
+    SWEEP_EVERY = 32
+
+    def __init__(self, directory, max_bytes, ttl):
+        self.dir = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.dir, key + '.bin')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self.ttl > 0 and time.time() - st.st_mtime > self.ttl:
+                os.unlink(path)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir=self.dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self.puts += 1
+        if self.puts % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def _entries(self):
+        out = []
+        for name in os.listdir(self.dir):
+            if not name.endswith('.bin'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dir, name))
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, name))
+        return out
+
+    def sweep(self):
+        """Удаляет просроченные записи и самые старые сверх предела объёма."""
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        for mtime, size, name in entries:
+            if not (self.ttl > 0 and now - mtime > self.ttl) and total <= self.max_bytes:
+                continue
+            try:
+                os.unlink(os.path.join(self.dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    def info(self):
+        entries = self._entries()
+        return {'entries': len(entries), 'bytes': sum(e[1] for e in entries), 'dir': self.dir}
+
+def _make_result_cache():
+    max_bytes = RESULT_CACHE_MB * 1024 * 1024
+    if RESULT_CACHE_KIND == 'off' or max_bytes <= 0:
+        return None
+    if RESULT_CACHE_KIND == 'disk':
+        import tempfile
+        directory = RESULT_CACHE_DIR or os.path.join(tempfile.gettempdir(), 'bp-render-cache')
+        try:
+            return DiskResultCache(directory, max_bytes, RESULT_CACHE_TTL)
+        except OSError:
+            return None
+    return MemoryResultCache(max_bytes, RESULT_CACHE_TTL)
+
+RESULT_CACHE = _make_result_cache()
+_RESULT_STATS = {'hits': 0, 'misses': 0}
+
+def result_cache_info():
+    info = dict(_RESULT_STATS, kind=RESULT_CACHE_KIND if RESULT_CACHE else 'off')
+    if RESULT_CACHE is not None:
+        info.update(RESULT_CACHE.info())
+    return info
+
+def render_bytes(job):
+    """
+    Готовые байты картинки для задания: из кэша или свежий рендер.
+    -> (bytes, info), где info — профиль, формат, размер, время кодирования
+    и попадание в кэш.
+    """
+    job = quantize_job(job)
+    encoder, prof = bp_encode.get_profile(job.get('encoder'))
+    with trace_stage('cache'):
+        key = render_key(job, encoder) if RESULT_CACHE is not None else None
+        data = RESULT_CACHE.get(key) if key is not None else None
+    if key is not None:
+        if data is not None:
+            _RESULT_STATS['hits'] += 1
+            return data, {'encoder': encoder, 'format': prof['format'].lower(), 'bytes': len(data),
+                          'encode_ms': 0.0, 'cache': 'hit'}
+        _RESULT_STATS['misses'] += 1
+    img = render(job)
+    if encoder != 'fast' and should_degrade('fast_encoder', 'encode:' + encoder):
+        encoder = 'fast'
+    with trace_stage('encode'):
+        data, info = bp_encode.encode(img, encoder)
+    learn_cost('encode:' + encoder, info['encode_ms'])
+    if key is not None and not degraded():
+        with trace_stage('cache'):
+            RESULT_CACHE.put(key, data)
+    info['cache'] = 'miss' if key is not None else 'off'
+    return data, info
+
+def cache_stats():
+    return {'base': base_cache_info(), 'sprites': sprite_cache_info(), 'bars': bar_sprite_cache_info(),
+            'layouts': layout_cache_info(), 'layers': layer_cache_info(), 'results': result_cache_info(),
+            'profile': profile_info()}
+
+def render_to_file(job):
+    data, info = render_bytes(job)
+    with trace_stage('write'), open(job['out'], 'wb') as f:
+        f.write(data)
+    info['out'] = job['out']
+    return info
+
+# -----------------------------------------------------------------------------
+# Анимация повышения уровня (APNG / WebP)
+#
+# Полоса «доезжает» от прежнего прогресса (fromLvl + fromFrac) до текущего
+# (curLvl + lvlFrac), переходя через границу уровня.  Всё, кроме полос,
+# одинаково во всех кадрах: страница с панелью собирается один раз, а каждый
+# следующий кадр — это только полоска между прежним и новым краем заливки
+# (плюс скруглённый торец), собранная тем же draw_split_pair_progress и
+# alpha_composite поверх неподвижной страницы.
+#
+# APNG пишется вручную: первый кадр (он же обычная картинка для программ
+# без анимации) — исходное состояние целиком, остальные — fcTL/fdAT только
+# с изменившимся прямоугольником.  Полные кадры не собираются вовсе, и файл
+# и время лишь немного больше, чем у одной картинки.  WebP собирается из
+# полных кадров (копия страницы + вставка полоски), а подкадры считает
+# libwebp.  Анимация проигрывается один раз и останавливается на итоге.
+#
+#   job['anim']      apng | webp
+#   job['fromLvl'], job['fromFrac']  — откуда начинается анимация
+#   job['frames']    число кадров движения (по умолчанию 12, не больше 48)
+#
+# CLI: --anim=apng|webp --from=LVL:FRAC [--frames=N]
+
+ANIM_FORMATS = {'apng': 'PNG', 'webp': 'WEBP'}
+ANIM_START_MS = 300     # пауза на исходном состоянии
+ANIM_FRAME_MS = 40
+ANIM_HOLD_MS = 1500     # итоговый кадр
+ANIM_MAX_FRAMES = 48
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def _ease_out(t):
+    return 1.0 - (1.0 - t) ** 3
+
+def anim_timeline(from_units, to_units, frames):
+    """Прогресс (уровень, доля) для каждого кадра движения, последний — ровно конечный."""
+    steps = []
+    for i in range(1, frames + 1):
+        u = from_units + (to_units - from_units) * _ease_out(i / frames)
+        if i == frames:
+            u = to_units
+        lvl = int(math.floor(u))
+        steps.append((lvl, u - lvl))
+    return steps
+
+def _band_change(prev, cur):
+    """Изменившийся прямоугольник одной пары полос между двумя геометриями."""
+    if prev is None and cur is None:
+        return None
+    if prev is None or cur is None:
+        X, Y, W, H, _ = cur or prev
+        return (X, Y, X + W, Y + H)
+    X, Y, Wp, H, rp = prev
+    _, _, W, _, r = cur
+    if W == Wp and r == rp:
+        return None
+    # Левый торец общий, только пока обе полосы шире двух скруглений: у
+    # узкой bar_radius ужимает радиус (не больше W // 2), а rounded_rectangle
+    # при 2 * radius >= W - 1 рисует торцы одной фигурой.  Тогда меняется и
+    # левый торец — перерисовываем пару с начала, иначе — от начала правого
+    # скругления.
+    if r != rp or min(Wp, W) <= 2 * r + 1:
+        x0 = X
+    else:
+        x0 = X + min(Wp, W) - r - 1
+    return (x0, Y, X + max(Wp, W), Y + H)
+
+def _png_chunks(data):
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        n, tag = struct.unpack('>I4s', data[pos:pos + 8])
+        yield tag, data[pos + 8:pos + 8 + n]
+        pos += 12 + n
+
+def _png_chunk(tag, body):
+    return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body) & 0xffffffff)
+
+def _png_parts(img, level):
+    """(IHDR, сжатые данные IDAT) картинки, закодированной PIL."""
+    buf = io.BytesIO()
+    img.save(buf, format='PNG', compress_level=level)
+    ihdr, idat = None, []
+    for tag, body in _png_chunks(buf.getvalue()):
+        if tag == b'IHDR':
+            ihdr = body
+        elif tag == b'IDAT':
+            idat.append(body)
+    return ihdr, b''.join(idat)
+
+def write_apng(first, patches, durations, level=6):
+    """
+    APNG из полного первого кадра и дельт [(x, y, RGB-картинка), ...].
+    durations — задержка каждого кадра в мс (первый + дельты).
+    """
+    ihdr, idat = _png_parts(first, level)
+    w, h = first.size
+    seq = 0
+    out = [PNG_SIGNATURE, _png_chunk(b'IHDR', ihdr),
+           _png_chunk(b'acTL', struct.pack('>II', 1 + len(patches), 1))]
+
+    def fctl(fw, fh, x, y, ms):
+        # dispose_op = none, blend_op = source: дельта просто замещает прямоугольник
+        return _png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', seq, fw, fh, x, y, int(ms), 1000, 0, 0))
+
+    out.append(fctl(w, h, 0, 0, durations[0]))
+    seq += 1
+    out.append(_png_chunk(b'IDAT', idat))
+    for (x, y, patch), ms in zip(patches, durations[1:]):
+        out.append(fctl(patch.size[0], patch.size[1], x, y, ms))
+        seq += 1
+        _, data = _png_parts(patch, level)
+        out.append(_png_chunk(b'fdAT', struct.pack('>I', seq) + data))
+        seq += 1
+    out.append(_png_chunk(b'IEND', b''))
+    return b''.join(out)
+
+def render_levelup(job):
+    """
+    Анимированная картинка повышения уровня.
+    -> (bytes, info) как у render_bytes, плюс frames.
+    """
+    anim = job.get('anim', 'apng')
+    if anim not in ANIM_FORMATS:
+        raise ValueError(f"unknown animation format: {anim} (known: {', '.join(ANIM_FORMATS)})")
+    frames = max(1, min(ANIM_MAX_FRAMES, int(job.get('frames') or 12)))
+    from_lvl = int(job.get('fromLvl', job['curLvl']))
+    from_frac = clamp(float(job.get('fromFrac', 0.0)), 0.0, 1.0)
+    to_units = job['curLvl'] + clamp(job['lvlFrac'], 0.0, 1.0)
+
+    base = load_base(job['in'])
+    w, h = base.size
+    # Неподвижная часть: страница и панель без полос (уровень «до страницы»)
+    still = render(dict(job, curLvl=job['pageStart'] - 1))
+    first = render(dict(job, curLvl=from_lvl, lvlFrac=from_frac))
+    bar_x, bar_w, top_y, top_h, bot_y, bot_h = _page_geometry(job, w, h)
+    ps = job['pageStart']
+    bands = ((top_y, top_h, ps, TOP_FREE_RGBA, TOP_PREM_RGBA),
+             (bot_y, bot_h, ps + 5, BOT_FREE_RGBA, BOT_PREM_RGBA))
+
+    def geometry(lvl, frac):
+        if lvl < ps:
+            return [None, None]
+        return [bar_geometry(bar_x, bar_w, y, hp, start, lvl, frac) for y, hp, start, _, _ in bands]
+
+    def patch(rect, lvl, frac):
+        x0, y0, x1, y1 = rect
+        with trace_stage('paint'):
+            overlay = Image.new('RGBA', (x1 - x0, y1 - y0), (0, 0, 0, 0))
+            if lvl >= ps:
+                for y, hp, start, cf, cp in bands:
+                    draw_split_pair_progress(overlay, bar_x, bar_w, y, hp, start, lvl, frac, cf, cp, (x0, y0))
+        with trace_stage('composite'):
+            return Image.alpha_composite(still.crop(rect).convert('RGBA'), overlay).convert('RGB')
+
+    patches = []
+    prev = geometry(from_lvl, from_frac)
+    for lvl, frac in anim_timeline(from_lvl + from_frac, to_units, frames):
+        cur = geometry(lvl, frac)
+        rect = None
+        for r in (_band_change(a, b) for a, b in zip(prev, cur)):
+            if r is not None:
+                rect = r if rect is None else union_rect(rect, r)
+        prev = cur
+        if rect is None:
+            # Ничего не сдвинулось — продлеваем предыдущий кадр
+            if patches:
+                patches[-1][3] += ANIM_FRAME_MS
+            continue
+        rect = (max(0, rect[0]), max(0, rect[1]), min(w, rect[2]), min(h, rect[3]))
+        patches.append([rect[0], rect[1], patch(rect, lvl, frac), ANIM_FRAME_MS])
+    if patches:
+        patches[-1][3] = ANIM_HOLD_MS
+    durations = [ANIM_START_MS] + [p[3] for p in patches]
+
+    fmt = ANIM_FORMATS[anim]
+    # Уровень сжатия APNG берём из PNG-профиля (fast — 1), иначе 6
+    _, prof = bp_encode.get_profile(job.get('encoder'))
+    level = prof.get('compress_level', 6) if prof['format'] == 'PNG' else 6
+    t0 = time.perf_counter()
+    with trace_stage('encode'):
+        if fmt == 'PNG':
+            data = write_apng(first, [(x, y, p) for x, y, p, _ in patches], durations, level)
+        else:
+            seq = [first]
+            for x, y, p, _ in patches:
+                img = seq[-1].copy()
+                img.paste(p, (x, y))
+                seq.append(img)
+            buf = io.BytesIO()
+            first.save(buf, format='WEBP', save_all=True, append_images=seq[1:], duration=durations,
+                       loop=1, lossless=True, method=0)
+            data = buf.getvalue()
+    info = {'encoder': anim if fmt != 'PNG' else f"apng/{level}", 'format': 'png' if fmt == 'PNG' else 'webp',
+            'bytes': len(data), 'encode_ms': round((time.perf_counter() - t0) * 1000.0, 2),
+            'cache': 'off', 'frames': 1 + len(patches)}
+    return data, info
+
+# -----------------------------------------------------------------------------
+# Таблица лидеров (--leaderboard, {"cmd": "leaderboard"})
+#
+# Топ игроков одной картинкой вместо N рендеров страниц: по компактной строке
+# на игрока — место, имя, уровень, полоса прогресса всего пропуска и опыт
+# внутри уровня.  Полоса — та же пара free/premium, что на странице
+# (bar_radius, bar_masks, paste_pair, цвета TOP_*), у игрока без премиума
+# нижняя половинка остаётся пустой дорожкой.  Текст — load_font и кэш растров
+# глифов.  Координаты строк целые, поэтому каждая цифра и буква
+# растеризуется один раз на всю таблицу, а одинаковые полосы (все, кто
+# прошёл пропуск) делят одну маску.  Все строки рисуются в один оверлей, и
+# фон смешивается с ним одним alpha_composite.
+#
+#   {"title": "Топ БП", "rows": [{"name": "...", "level": 57, "xpCur": 40,
+#     "xpNeed": 100, "premium": 1}, ...], "out": "-", "encoder": "fast"}
+#
+# Строки рисуются в переданном порядке (сортирует вызывающая сторона), не
+# больше LB_MAX_ROWS.
+
+LB_MAX_ROWS = 100
+LB_MAX_LEVEL = 100
+LB_WIDTH = 1200
+LB_PAD = 24
+LB_HEADER_H = 72
+LB_ROW_H = 36
+LB_BAR_H = 20
+LB_FONT = 20
+LB_TITLE_FONT = 34
+LB_NAME_W = 380
+LB_BG = (22, 24, 33)
+LB_STRIPE = (255, 255, 255, 10)   # подложка чётных строк
+LB_TRACK = (255, 255, 255, 28)    # пустая дорожка полосы
+LB_DIM = (255, 255, 255, 150)     # вторичный текст (место, опыт)
+LB_ELLIPSIS = '\u2026'
+
+def _lb_int(v, where, lo=0):
+    try:
+        return max(lo, int(v or 0))
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: expected an integer, got {v!r}")
+
+def normalize_leaderboard(req):
+    """JSON-задание таблицы лидеров -> словарь задания для render_job."""
+    rows = req.get('rows')
+    if not isinstance(rows, list):
+        raise ValueError("leaderboard: rows must be a list")
+    out = []
+    for i, row in enumerate(rows[:LB_MAX_ROWS]):
+        if not isinstance(row, dict):
+            raise ValueError(f"leaderboard: rows[{i}] must be an object")
+        # Переводы строк и управляющие символы в именах ломают раскладку
+        name = ''.join(ch for ch in str(row.get('name') or '?') if ch.isprintable()).strip() or '?'
+        out.append({
+            'name': name,
+            'level': clamp(_lb_int(row.get('level'), f"rows[{i}].level", 1), 1, LB_MAX_LEVEL),
+            'xpCur': _lb_int(row.get('xpCur'), f"rows[{i}].xpCur"),
+            'xpNeed': _lb_int(row.get('xpNeed'), f"rows[{i}].xpNeed"),
+            'premium': bool(row.get('premium')),
+        })
+    job = {'rows': out, 'title': str(req.get('title') or ''), 'out': str(req.get('out') or STDOUT_OUT)}
+    if req.get('encoder'):
+        job['encoder'] = str(req['encoder'])
+    if req.get('budgetMs') is not None:
+        job['budgetMs'] = float(req['budgetMs'])
+    return job
+
+def fit_text(font, text, max_w):
+    """Строка, обрезанная с многоточием до ширины max_w."""
+    if layout_spaced(text, font, 0)[1] <= max_w:
+        return text
+    while text and layout_spaced(text + LB_ELLIPSIS, font, 0)[1] > max_w:
+        text = text[:-1]
+    return text.rstrip() + LB_ELLIPSIS
+
+def _lb_text(x, y, text, font, align='left'):
+    advances, width = layout_spaced(text, font, 0)
+    if align == 'right':
+        x -= int(width)
+    return place_text((x, y), text, font, 0, advances)
+
+def render_leaderboard(job):
+    """Таблица лидеров одной RGB-картинкой."""
+    rows = job['rows']
+    w = LB_WIDTH
+    h = LB_HEADER_H + LB_ROW_H * max(1, len(rows)) + LB_PAD
+    font = load_font(LB_FONT)
+    title_font = load_font(LB_TITLE_FONT)
+    # Колонки: место | имя | уровень | полоса | опыт
+    rank_x = LB_PAD + 56
+    name_x = rank_x + 16
+    level_x = name_x + LB_NAME_W + 70
+    bar_x = level_x + 20
+    xp_x = w - LB_PAD
+    bar_w = xp_x - 150 - bar_x
+    text_dy = (LB_ROW_H - LB_FONT) // 2 - 2
+    bar_dy = (LB_ROW_H - LB_BAR_H) // 2
+    track_r = bar_radius(bar_w, LB_BAR_H)
+
+    bright, dim = [], []
+    with trace_stage('layers'):
+        if job.get('title'):
+            bright += _lb_text(LB_PAD, (LB_HEADER_H - LB_TITLE_FONT) // 2 - 4,
+                               fit_text(title_font, job['title'], w - 2 * LB_PAD), title_font)
+        bars = []
+        for i, row in enumerate(rows):
+            y = LB_HEADER_H + i * LB_ROW_H
+            dim += _lb_text(rank_x, y + text_dy, str(i + 1), font, 'right')
+            bright += _lb_text(name_x, y + text_dy, fit_text(font, row['name'], LB_NAME_W), font)
+            bright += _lb_text(level_x, y + text_dy, str(row['level']), font, 'right')
+            dim += _lb_text(xp_x, y + text_dy, f"{row['xpCur']}/{row['xpNeed']}", font, 'right')
+            frac = clamp(row['xpCur'] / row['xpNeed'], 0.0, 1.0) if row['xpNeed'] else 0.0
+            units = clamp((row['level'] - 1 + frac) / (LB_MAX_LEVEL - 1), 0.0, 1.0)
+            bw = int(bar_w * units + 0.5)
+            geo = (bar_x, y + bar_dy, bw, LB_BAR_H, bar_radius(bw, LB_BAR_H)) if bw > 0 else None
+            bars.append((y, geo, row['premium']))
+
+    with trace_stage('paint'):
+        overlay = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+        for i, (y, geo, premium) in enumerate(bars):
+            if i % 2 == 0:
+                overlay.paste(LB_STRIPE, (0, y, w, y + LB_ROW_H))
+            paste_pair(overlay, (bar_x, y + bar_dy, bar_w, LB_BAR_H, track_r), LB_TRACK, LB_TRACK)
+            if geo is not None:
+                paste_pair(overlay, geo, TOP_FREE_RGBA, TOP_PREM_RGBA if premium else None)
+        draw = ImageDraw.Draw(overlay, 'RGBA')
+        paint_glyphs(draw, bright)
+        paint_glyphs(draw, dim, LB_DIM)
+    with trace_stage('composite'):
+        return Image.alpha_composite(Image.new('RGBA', (w, h), LB_BG + (255,)), overlay).convert('RGB')
+
+def leaderboard_bytes(job):
+    """-> (bytes, info) как у render_bytes, плюс rows."""
+    img = render_leaderboard(job)
+    encoder, _ = bp_encode.get_profile(job.get('encoder'))
+    if encoder != 'fast' and should_degrade('fast_encoder', 'encode:' + encoder):
+        encoder = 'fast'
+    with trace_stage('encode'):
+        data, info = bp_encode.encode(img, encoder)
+    info.update({'cache': 'off', 'rows': len(job['rows']), 'width': img.size[0], 'height': img.size[1]})
+    return data, info
+
+# -----------------------------------------------------------------------------
+# Вывод байтами вместо файла
+#
+# out = "-" — картинка не пишется на диск, а уходит вызывающему кадром с
+# длиной: в одноразовом режиме это 4 байта длины (big-endian) и сами байты в
+# stdout, в режиме демона — JSON-строка ответа с полем "size" и сразу за ней
+# ровно size байт.  Так бот получает Buffer без временных каталогов и без
+# двух походов на диск.  Для общего буфера в памяти можно передать путь в
+# /dev/shm — это обычный файл на tmpfs.
+
+STDOUT_OUT = '-'
+
+def pack_frame(data):
+    return struct.pack('>I', len(data)) + data
+
+def render_job(job, trace=None, start=None, stages=False):
+    """
+    Рендер задания в файл или в память (out = "-"). -> (info, payload | None)
+    trace — режим трассировки ('1' | 'mem'), по умолчанию BP_TRACE; запись
+    стадий попадает в info['trace'].  stages — сводка {стадия: ms} в
+    info['stages'] и без трассировки.  Бюджет — job['budgetMs'] (или
+    BP_BUDGET_MS), отсчёт от start (perf_counter); упрощения — в
+    info['degraded'].
+    """
+    mode = TRACE_MODE if trace is None else trace
+    if mode == '0':
+        mode = ''
+    with tracing(mode or ('1' if stages else '')) as tr, deadline(job.get('budgetMs'), start) as dl:
+        if job.get('anim') or 'rows' in job:
+            data, info = render_levelup(job) if job.get('anim') else leaderboard_bytes(job)
+            payload = data
+            if job['out'] != STDOUT_OUT:
+                with trace_stage('write'), open(job['out'], 'wb') as f:
+                    f.write(data)
+                info['out'], payload = job['out'], None
+            else:
+                info['size'] = len(data)
+        elif job['out'] == STDOUT_OUT:
+            data, info = render_bytes(job)
+            info['size'] = len(data)
+            payload = data
+        else:
+            info, payload = render_to_file(job), None
+        if tr is not None and stages:
+            info['stages'] = tr.stage_ms()
+        if tr is not None and mode:
+            info['trace'] = tr.result()
+        if dl is not None and dl.degraded:
+            info['degraded'] = list(dl.degraded)
+    return info, payload
+
+# -----------------------------------------------------------------------------
+# Режим демона (--serve)
+#
+# Процесс живёт долго и принимает задания построчно в виде JSON (одна строка —
+# одно задание), отвечая одной JSON-строкой на каждое.  Так платим за импорт
+# PIL, чтение env и загрузку шрифтов один раз, а не на каждый клик по кнопке.
+#
+#   -> {"id": 1, "argv": ["assets/bp/1-10.png", "/tmp/o.png", "1", ...]}
+#   -> {"id": 2, "in": "...", "out": "...", "pageStart": 1, "curLvl": 3, ...}
+#   <- {"id": 1, "ok": true, "out": "/tmp/o.png", "ms": 41.7, "encoder": "balanced",
+#       "format": "png", "bytes": 238566, "encode_ms": 30.2, "cache": "miss"}
+#   <- {"id": 2, "ok": false, "error": "..."}
+#
+# Задание с "out": "-" получает ответ {"size": N, ...} и следом N байт картинки.
+#
+# {"cmd": "ping"} отвечает {"ok": true, "pong": true}, {"cmd": "stats"} —
+# состоянием кэшей, {"cmd": "leaderboard", "rows": [...]} рисует таблицу
+# лидеров (см. выше).  Транспорт — stdin/stdout либо Unix-сокет (--socket PATH),
+# протокол одинаковый.  --warm заранее декодирует все страницы и растеризует
+# цифры/подписи панели.
+
+def handle_request(req):
+    """
+    Обрабатывает одно JSON-задание демона.  -> (ответ, payload), payload —
+    байты картинки для out = "-" или None.
+    """
+    rid = req.get('id') if isinstance(req, dict) else None
+    t0 = time.perf_counter()
+    try:
+        if not isinstance(req, dict):
+            raise ValueError("request must be a JSON object")
+        if req.get('cmd') == 'ping':
+            return {'id': rid, 'ok': True, 'pong': True}, None
+        if req.get('cmd') == 'stats':
+            return {'id': rid, 'ok': True, 'stats': cache_stats()}, None
+        job = normalize_leaderboard(req) if req.get('cmd') == 'leaderboard' else normalize_job(req)
+        trace = req.get('trace')
+        if trace is not None:
+            trace = 'mem' if trace == 'mem' else ('1' if trace else '')
+        with _RENDER_LOCK:
+            load_profile()
+            res, payload = render_job(job, trace, t0, stages=True)
+        res.update({'id': rid, 'ok': True, 'ms': round((time.perf_counter() - t0) * 1000.0, 2)})
+        return res, payload
+    except Exception as e:
+        return {'id': rid, 'ok': False, 'error': f"{type(e).__name__}: {e}"}, None
+
+def _handle_line(line):
+    line = line.strip()
+    if not line:
+        return None, None
+    try:
+        req = json.loads(line)
+    except ValueError as e:
+        return {'id': None, 'ok': False, 'error': f"bad json: {e}"}, None
+    return handle_request(req)
+
+def serve_stream(fin, fout):
+    """Цикл демона поверх пары двоичных потоков; завершается на EOF."""
+    for line in fin:
+        resp, payload = _handle_line(line.decode('utf-8', 'replace'))
+        if resp is None:
+            continue
+        fout.write(json.dumps(resp).encode('ascii') + b"\n")
+        if payload is not None:
+            fout.write(payload)
+        fout.flush()
+
+def serve_socket(path):
+    """Тот же протокол поверх Unix-сокета; каждое соединение — свой поток."""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(self.rfile, self.wfile)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as srv:
+        srv.daemon_threads = True
+        try:
+            srv.serve_forever()
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def serve(argv):
+    if '--warm' in argv or os.environ.get('BP_WARM_BASES') == '1':
+        warm_bases()
+        warm_sprites()
+    sock = None
+    if '--socket' in argv:
+        i = argv.index('--socket')
+        if i + 1 >= len(argv):
+            raise ValueError(USAGE)
+        sock = argv[i + 1]
+    if sock:
+        serve_socket(sock)
+    else:
+        serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+
+# -----------------------------------------------------------------------------
+# Пакетный рендер (--batch)
+#
+# Один процесс на много картинок: все десять страниц пользователя при
+# открытии /bp или пачка пользователей после начисления XP.  Подложки,
+# шрифты, спрайты и раскладки панели переиспользуются между заданиями.
+#
+# Вход (файл или "-" для stdin) — JSON-массив заданий, JSON-lines, либо
+# объект {"defaults": {...}, "jobs": [...]}; defaults подмешиваются в каждое
+# задание (общая геометрия, encoder и т.п.).  Задания — в формате демона.
+# Выход в stdout — те же ответы, что у --serve, по одному на задание и в
+# том же порядке; для out = "-" за строкой ответа идут size байт картинки.
+
+def read_batch(text):
+    """Текст пакета -> список заданий-словарей."""
+    text = text.strip()
+    if not text:
+        return []
+    if text[0] in '[{':
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None     # не один документ — значит JSON-lines
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            if 'jobs' not in data:
+                return [data]
+            defaults = data.get('defaults') or {}
+            return [dict(defaults, **job) for job in data['jobs']]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def run_batch(jobs, fout, encoder=None):
+    """Рендерит задания по порядку и пишет ответы в двоичный поток fout. -> число ошибок"""
+    failed = 0
+    for i, job in enumerate(jobs):
+        if isinstance(job, dict):
+            job = dict(job)
+            job.setdefault('id', i)
+            if encoder:
+                job.setdefault('encoder', encoder)
+        resp, payload = handle_request(job)
+        failed += not resp['ok']
+        fout.write(json.dumps(resp).encode('ascii') + b"\n")
+        if payload is not None:
+            fout.write(payload)
+        fout.flush()
+    return failed
+
+def batch(argv):
+    src = [a for a in argv if not a.startswith('--')]
+    if len(src) != 1:
+        raise ValueError(USAGE)
+    encoder = None
+    for f in argv:
+        if f.startswith('--encoder='):
+            encoder = f.split('=', 1)[1]
+    if src[0] == '-':
+        text = sys.stdin.buffer.read().decode('utf-8')
+    else:
+        with open(src[0], 'r', encoding='utf-8') as f:
+            text = f.read()
+    return run_batch(read_batch(text), sys.stdout.buffer, encoder)
+
+def read_leaderboard(argv):
+    """--leaderboard FILE|-: JSON-объект таблицы лидеров или просто массив строк."""
+    if len(argv) != 1:
+        raise ValueError(USAGE)
+    if argv[0] == '-':
+        text = sys.stdin.buffer.read().decode('utf-8')
+    else:
+        with open(argv[0], 'r', encoding='utf-8') as f:
+            text = f.read()
+    data = json.loads(text)
+    return normalize_leaderboard({'rows': data} if isinstance(data, list) else data)
+
+def main(argv=None):
+    cpu_before_main = time.process_time()
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == '--serve':
+        serve(argv[1:])
+        return
+    if argv and argv[0] == '--build-raw':
+        paths = argv[1:] or _page_paths()
+        for row in build_raw_pages(paths):
+            print(json.dumps(row))
+        return
+    if argv and argv[0] == '--batch':
+        try:
+            failed = batch(argv[1:])
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        if failed:
+            sys.exit(2)
+        return
+    flags = [a for a in argv if a.startswith('--')]
+    argv = [a for a in argv if not a.startswith('--')]
+    try:
+        job = read_leaderboard(argv) if '--leaderboard' in flags else parse_args(argv)
+    except ValueError as e:
+        print(e if '--leaderboard' in flags else USAGE)
+        sys.exit(1)
+    for f in flags:
+        if f.startswith('--encoder='):
+            job['encoder'] = f.split('=', 1)[1]
+        elif f.startswith('--anim='):
+            job['anim'] = f.split('=', 1)[1]
+        elif f.startswith('--from='):
+            lvl, _, frac = f.split('=', 1)[1].partition(':')
+            job['fromLvl'], job['fromFrac'] = int(lvl), float(frac or 0)
+        elif f.startswith('--frames='):
+            job['frames'] = int(f.split('=', 1)[1])
+        elif f.startswith('--budget='):
+            job['budgetMs'] = float(f.split('=', 1)[1])
+    if 'fromLvl' in job and not job.get('anim'):
+        job['anim'] = 'apng'
+    t_main = time.perf_counter()
+    trace = None
+    if '--trace' in flags:
+        trace = '1'
+    elif '--trace=mem' in flags:
+        trace = 'mem'
+    # Бюджет одноразового процесса считается с начала импорта
+    info, payload = render_job(job, trace, _T_IMPORT, stages='--stages' in flags)
+    if payload is not None:
+        sys.stdout.buffer.write(pack_frame(payload))
+        sys.stdout.buffer.flush()
+    if '--report' in flags:
+        # Размер и время кодирования — в stderr, stdout занят картинкой
+        sys.stderr.write(json.dumps(info) + "\n")
+    else:
+        if 'trace' in info:
+            sys.stderr.write(json.dumps({'trace': info['trace']}) + "\n")
+        if 'stages' in info:
+            sys.stderr.write(json.dumps({'stages': info['stages']}) + "\n")
+        if 'degraded' in info:
+            sys.stderr.write(json.dumps({'degraded': info['degraded']}) + "\n")
+    if '--timing' in flags:
+        # Сколько стоит холодный старт: CPU интерпретатора до main (включая
+        # импорт), сам импорт модуля и рендер
+        sys.stderr.write(json.dumps({'startup': {
+            'cpu_before_main_ms': round(cpu_before_main * 1000.0, 2),
+            'import_ms': IMPORT_MS,
+            'main_ms': round((time.perf_counter() - t_main) * 1000.0, 2),
+            'modules': len(sys.modules),
+        }}) + "\n")
+
+IMPORT_MS = round((time.perf_counter() - _T_IMPORT) * 1000.0, 2)
 
 if __name__ == "__main__":
     main()
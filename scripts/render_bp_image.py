@@ -20,7 +20,23 @@ Arguments (positional):
                       the current level (0 means just started, 1 means
                       completed the level)
     4. premium     – 1 if the user has premium, 0 otherwise
-    5. outpath     – output file path for the PNG image
+    5. outpath     – output file path for the image; a ``.png`` or
+                      ``.webp`` extension is switched to match the
+                      encoder's format (``out.png`` with ``--encoder=webp``
+                      is written to ``out.webp``)
+
+Options:
+    --encoder=NAME – encoder profile from bp_encode.py (fast, balanced,
+                      small, webp); defaults to BP_ENCODER or "balanced"
+    --report       – print the encoded size and encode time as JSON to
+                      stderr
+    --scale=F      – output scale relative to the 1000x400 layout
+                      (e.g. 0.5 for thumbnails, 0.36 for mobile); the grid
+                      is laid out and drawn directly at the target size
+    --all          – render all ten pages in one call; ``page`` is
+                      ignored and ``outpath`` may contain ``{page}``
+                      (otherwise ``_p<page>`` is added before the
+                      extension)
 
 Example:
     python render_bp_image.py 1 7 0.5 1 ./out.png
@@ -28,15 +44,50 @@ Example:
 The above will render the first page (levels 1‑10) for a player at
 level 7 with 50 % progress into level 7 on a premium account and save
 the resulting PNG to ``./out.png``.
+
+The grid is built from rectangle fills on a single buffer: a per-scale
+template with the row labels and empty cells is drawn once, and each page
+only fills the progress rectangles and draws its ten level numbers on a
+copy of it.
 """
 
+import json
+import os
 import sys
+from collections import namedtuple
 from PIL import Image, ImageDraw, ImageFont
 
+import bp_encode
+
+
+# Layout at scale 1.0
+IMG_W, IMG_H = 1000, 400
+MARGIN = 20
+GAP = 4              # between rows and between cells
+LABEL_PAD = 8        # between the label column and the first cell
+FONT_SIZE = 20
+
+# Colours
+WHITE = (255, 255, 255)
+BG_COLOUR = (250, 250, 250)
+BORDER_COLOUR = (0, 0, 0)
+FREE_FILL = (119, 221, 119)     # light green
+PREMIUM_FILL = (255, 215, 0)    # gold/yellow
+TEXT_COLOUR = (0, 0, 0)
+LABEL_BG = (230, 230, 230)
+
+# For two sets of (free, prem) rows we need four rows: free/prem for
+# the first half of the page (levels page_start..page_start+4) and
+# free/prem for the second half (levels page_start+5..page_start+9).
+ROW_LABELS = ['FREE', 'PREM', 'FREE', 'PREM']
+
+GridLayout = namedtuple('GridLayout', 'size x0 y0 cw ch label_w gx0 gap border text_pad font_size')
 
-def parse_args():
+
+def parse_args(argv=None):
     """Parse positional command line arguments with sensible defaults."""
-    args = sys.argv[1:]
+    argv = sys.argv[1:] if argv is None else argv
+    args = [a for a in argv if not a.startswith('--')]
     page = int(args[0]) if len(args) > 0 else 1
     level = int(args[1]) if len(args) > 1 else 1
     try:
@@ -51,145 +102,210 @@ def parse_args():
     return page, level, progress, premium, outpath
 
 
-def draw_grid(draw: ImageDraw.Draw, origin, cell_size, page_start, current_level, progress, premium, font):
+def grid_layout(scale=1.0):
+    """
+    Geometry of the grid for an output scale.
+
+    Every length of the 1000x400 layout is scaled before the integer
+    rounding, so smaller outputs are laid out natively instead of being
+    resized from a full-size render. At scale 1.0 the numbers match the
+    original layout exactly.
+    """
+    img_w = max(1, int(round(IMG_W * scale)))
+    img_h = max(1, int(round(IMG_H * scale)))
+    margin = int(round(MARGIN * scale))
+    gap = max(1, int(round(GAP * scale)))
+    pad = max(1, int(round(LABEL_PAD * scale)))
+    grid_w = img_w - 2 * margin
+    grid_h = img_h - 2 * margin
+    # Dedicate left label area (approx 15 % of width) and the rest for 5 cells
+    label_width = int(grid_w * 0.15)
+    cell_area_w = grid_w - label_width - pad
+    cw = max(1, int((cell_area_w - 4 * gap) / 5))    # 4 gaps between 5 cells
+    ch = max(1, int((grid_h - 3 * gap) / 4))         # 3 gaps between 4 rows
+    label_w = int(cw * 0.8)                          # width reserved for labels
+    return GridLayout(
+        size=(img_w, img_h), x0=margin, y0=margin, cw=cw, ch=ch, label_w=label_w,
+        gx0=margin + label_w + pad, gap=gap, border=max(1, int(round(scale))),
+        text_pad=max(1, int(round(2 * scale))), font_size=max(6, int(round(FONT_SIZE * scale))),
+    )
+
+
+_FONTS = {}
+
+
+def load_font(size):
+    """Bold DejaVu at ``size`` (cached); falls back to PIL's default font."""
+    font = _FONTS.get(size)
+    if font is None:
+        try:
+            font = ImageFont.truetype("DejaVuSans-Bold.ttf", size)
+        except Exception:
+            font = ImageFont.load_default()
+        _FONTS[size] = font
+    return font
+
+
+def text_size(draw, text, font):
+    """
+    Width and height of ``text`` as the removed ``ImageDraw.textsize``
+    reported them: the bottom-right corner of the text box drawn at (0, 0).
+    """
+    if hasattr(draw, 'textbbox'):
+        _, _, right, bottom = draw.textbbox((0, 0), text, font=font)
+        return right, bottom
+    return draw.textsize(text, font=font)
+
+
+def fill_box(img, rect, fill, outline=None, width=1):
+    """
+    ``draw.rectangle(rect, fill, outline)`` as two region fills. ``rect``
+    is inclusive like ImageDraw's: (x0, y0, x1, y1).
+    """
+    x0, y0, x1, y1 = rect
+    if outline is None:
+        img.paste(fill, (x0, y0, x1 + 1, y1 + 1))
+        return
+    img.paste(outline, (x0, y0, x1 + 1, y1 + 1))
+    if x1 - x0 + 1 > 2 * width and y1 - y0 + 1 > 2 * width:
+        img.paste(fill, (x0 + width, y0 + width, x1 + 1 - width, y1 + 1 - width))
+
+
+def cell_rect(g, row, col):
+    cx = g.gx0 + col * (g.cw + g.gap)
+    cy = g.y0 + row * (g.ch + g.gap)
+    return cx, cy
+
+
+_TEMPLATES = {}
+
+
+def grid_template(scale=1.0):
+    """
+    Page-independent part of the grid for a scale (cached): the white
+    canvas, the row labels and the empty cells with their borders.
+    Treat the result as read-only and copy it before drawing.
+    """
+    img = _TEMPLATES.get(scale)
+    if img is not None:
+        return img
+    g = grid_layout(scale)
+    img = Image.new('RGB', g.size, color=WHITE)
+    draw = ImageDraw.Draw(img)
+    font = load_font(g.font_size)
+    for row, label in enumerate(ROW_LABELS):
+        ly = g.y0 + row * (g.ch + g.gap)
+        fill_box(img, (g.x0, ly, g.x0 + g.label_w, ly + g.ch), LABEL_BG, BORDER_COLOUR, g.border)
+        # label text centered
+        w, h = text_size(draw, label, font)
+        draw.text((g.x0 + (g.label_w - w) / 2, ly + (g.ch - h) / 2), label, fill=TEXT_COLOUR, font=font)
+    for row in range(4):
+        for col in range(5):
+            cx, cy = cell_rect(g, row, col)
+            fill_box(img, (cx, cy, cx + g.cw, cy + g.ch), BG_COLOUR, BORDER_COLOUR, g.border)
+    _TEMPLATES[scale] = img
+    return img
+
+
+def render_page(page, current_level, progress, premium, scale=1.0):
     """
-    Draw the two‑row grid for the battle pass.
+    Render one page of the grid and return it as an RGB image.
 
     Parameters
     ----------
-    draw : ImageDraw.Draw
-        The drawing context.
-    origin : tuple[int, int]
-        Top‑left corner (x, y) of the grid.
-    cell_size : tuple[int, int]
-        Width and height of each cell (w, h).
-    page_start : int
-        Level number of the first cell on this page.
+    page : int
+        Page number (1-10); the page shows levels ``(page-1)*10+1`` onwards.
     current_level : int
         Player's current level.
     progress : float
         Fraction of current XP within the current level (0..1).
     premium : bool
         Indicates if the user has premium subscription.
-    font : ImageFont.FreeTypeFont
-        Font for rendering the level numbers and labels.
+    scale : float
+        Output scale relative to the 1000x400 layout.
     """
-    x0, y0 = origin
-    cw, ch = cell_size
-
-    # Colours
-    bg_colour = (250, 250, 250)
-    border_colour = (0, 0, 0)
-    free_fill = (119, 221, 119)   # light green
-    premium_fill = (255, 215, 0)  # gold/yellow
-    text_colour = (0, 0, 0)
-
-    # Draw row labels
-    # For two sets of (free, prem) rows we need four rows: free/prem for
-    # the first half of the page (levels page_start..page_start+4) and
-    # free/prem for the second half (levels page_start+5..page_start+9).
-    row_labels = ['FREE', 'PREM', 'FREE', 'PREM']
-    label_bg = (230, 230, 230)
-    label_w = int(cw * 0.8)  # width reserved for labels
-    # Vertical gap between rows
-    row_gap = 4
-    for row, label in enumerate(row_labels):
-        # compute vertical offset
-        ly = y0 + row * (ch + row_gap)
-        # label background box
-        label_rect = [x0, ly, x0 + label_w, ly + ch]
-        draw.rectangle(label_rect, fill=label_bg, outline=border_colour)
-        # label text centered
-        w, h = draw.textsize(label, font=font)
-        tx = x0 + (label_w - w) / 2
-        ty = ly + (ch - h) / 2
-        draw.text((tx, ty), label, fill=text_colour, font=font)
-
-    # Draw the cells for each of the four rows
-    gx0 = x0 + label_w + 8  # horizontal offset for first column
+    g = grid_layout(scale)
+    img = grid_template(scale).copy()
+    draw = ImageDraw.Draw(img)
+    font = load_font(g.font_size)
+    page_start = (page - 1) * 10 + 1
     for row in range(4):
         # Determine which half of the page this row belongs to
         half = row // 2  # 0 for first half (levels start..start+4), 1 for second half (start+5..start+9)
         # row within the half: 0 => free, 1 => premium
         row_in_half = row % 2
-        gy = y0 + row * (ch + row_gap)
         for col in range(5):
             level_num = page_start + half * 5 + col
-            # Determine fill amount
             if level_num < current_level:
                 fill_amount = 1.0
             elif level_num == current_level:
                 fill_amount = progress
             else:
                 fill_amount = 0.0
-            # Determine cell fill colour
-            cell_fill = None
-            if row_in_half == 0:
-                # free row
-                if fill_amount > 0:
-                    cell_fill = free_fill
-            else:
-                # premium row
-                if premium and fill_amount > 0:
-                    cell_fill = premium_fill
-            # Calculate coordinates of cell
-            cx = gx0 + col * (cw + 4)
-            cy = gy
-            rect = [cx, cy, cx + cw, cy + ch]
-            # Background
-            draw.rectangle(rect, fill=bg_colour, outline=border_colour)
+            cell_fill = FREE_FILL if row_in_half == 0 else (PREMIUM_FILL if premium else None)
+            cx, cy = cell_rect(g, row, col)
             # Fill portion horizontally
             if cell_fill and fill_amount > 0:
-                fill_w = int(cw * fill_amount)
-                fill_rect = [cx, cy, cx + fill_w, cy + ch]
-                draw.rectangle(fill_rect, fill=cell_fill)
+                fill_box(img, (cx, cy, cx + int(g.cw * fill_amount), cy + g.ch), cell_fill)
             # Draw level number text at the bottom of the cell only for free rows.
             if row_in_half == 0:
                 lvl_txt = str(level_num)
-                tw, th = draw.textsize(lvl_txt, font=font)
-                tx = cx + (cw - tw) / 2
-                ty = cy + ch - th - 2  # bottom padding
-                draw.text((tx, ty), lvl_txt, fill=text_colour, font=font)
+                tw, th = text_size(draw, lvl_txt, font)
+                tx = cx + (g.cw - tw) / 2
+                ty = cy + g.ch - th - g.text_pad  # bottom padding
+                draw.text((tx, ty), lvl_txt, fill=TEXT_COLOUR, font=font)
+    return img
 
 
-def main():
-    page, level, progress, premium, outpath = parse_args()
-    # Determine start of page (1‑based)
-    page_start = (page - 1) * 10 + 1
+def render_pages(current_level, progress, premium, scale=1.0, pages=range(1, 11)):
+    """Render several pages in one pass (shared template and fonts): [(page, image)]."""
+    return [(page, render_page(page, current_level, progress, premium, scale)) for page in pages]
 
-    # Image dimensions – chosen to be large enough for readability
-    img_w = 1000
-    img_h = 400
-    img = Image.new('RGB', (img_w, img_h), color=(255, 255, 255))
-    draw = ImageDraw.Draw(img)
 
-    # Try to load a nicer font; fall back to default
-    try:
-        font = ImageFont.truetype("DejaVuSans-Bold.ttf", 20)
-    except Exception:
-        font = ImageFont.load_default()
+def page_outpath(outpath, page):
+    """Output path for one page of ``--all``."""
+    if '{page}' in outpath:
+        return outpath.replace('{page}', str(page))
+    root, ext = os.path.splitext(outpath)
+    return f"{root}_p{page}{ext}"
 
-    # Grid cell size – compute based on available space
-    # Reserve margins around grid
-    margin_x = 20
-    margin_y = 20
-    grid_w = img_w - 2 * margin_x
-    grid_h = img_h - 2 * margin_y
 
-    # Dedicate left label area (approx 15 % of width) and the rest for 5 cells
-    label_fraction = 0.15
-    label_width = int(grid_w * label_fraction)
-    cell_area_w = grid_w - label_width - 8  # subtract small horizontal padding
-    cell_w = int((cell_area_w - 4 * 4) / 5)  # 4 gaps between 5 cells
-    # Four rows (free/prem for two halves) with 3 gaps between them
-    cell_h = int((grid_h - 3 * 4) / 4)
+def output_path(outpath, encoder=None):
+    """``outpath`` with the image extension of the encoder's format."""
+    root, ext = os.path.splitext(outpath)
+    want = bp_encode.extension(encoder)
+    if ext.lower() in bp_encode.EXTENSIONS.values() and ext.lower() != want:
+        return root + want
+    return outpath
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    page, level, progress, premium, outpath = parse_args(argv)
+    flags = [a for a in argv if a.startswith('--')]
+    encoder = None
+    scale = 1.0
+    for f in flags:
+        if f.startswith('--encoder='):
+            encoder = f.split('=', 1)[1]
+        elif f.startswith('--scale='):
+            scale = max(0.05, float(f.split('=', 1)[1]))
+    outpath = output_path(outpath, encoder)
 
-    # Draw grid with progress
-    draw_grid(draw, (margin_x, margin_y), (cell_w, cell_h), page_start, level, progress, premium, font)
+    if '--all' in flags:
+        jobs = [(page_outpath(outpath, p), img) for p, img in render_pages(level, progress, premium, scale)]
+    else:
+        jobs = [(outpath, render_page(page, level, progress, premium, scale))]
 
-    # Save
-    img.save(outpath)
+    # Encode with the selected profile and save
+    for path, img in jobs:
+        data, info = bp_encode.encode(img, encoder)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if '--report' in flags:
+            info['out'] = path
+            sys.stderr.write(json.dumps(info) + "\n")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
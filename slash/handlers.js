@@ -573,6 +573,39 @@ const handlers = {
     }
   },
 
+  bptop: {
+    adminOnly: false,
+    async run(interaction) {
+      const battlepass = require('../commands/battlepass'); // ленивый импорт
+      const limit = interaction.options.getInteger('count', false) || 25;
+      // Картинку видно всему каналу — рендер одной таблицей, а не N страницами
+      await interaction.deferReply();
+      // Имена участников сервера одним запросом; кого нет на сервере — по тегу из кэша
+      const resolveNames = async (ids) => {
+        const names = {};
+        if (interaction.guild) {
+          const members = await interaction.guild.members.fetch({ user: ids }).catch(() => null);
+          for (const [id, m] of members || []) names[id] = m.displayName;
+        }
+        for (const id of ids) {
+          if (!names[id]) names[id] = interaction.client.users.cache.get(id)?.username || id;
+        }
+        return names;
+      };
+      let att = null;
+      try {
+        att = await battlepass.generateLeaderboardAttachment(limit, resolveNames);
+      } catch (e) {
+        console.error('[BP leaderboard error]', e?.message || e);
+      }
+      if (!att) {
+        await interaction.editReply({ content: '❌ Не удалось построить таблицу лидеров.' });
+        return;
+      }
+      await interaction.editReply({ content: `🏆 Топ-${att.count} боевого пропуска`, files: [{ attachment: att.attachment, name: att.name }] });
+    }
+  },
+
   // ---------- ADMIN ----------
   bpstat: {
     adminOnly: true,
@@ -1804,6 +1837,7 @@ module.exports = {
   usedd: { run: handlers.usedd.run },
   predict: { run: handlers.predict.run },
   bp: { run: handlers.bp.run, adminOnly: false },
+  bptop: { run: handlers.bptop.run, adminOnly: false },
   infop: { run: handlers.infop.run, adminOnly: false },
 
   bpstat: { run: handlers.bpstat.run, adminOnly: true },
@@ -20,6 +20,13 @@ if (!TOKEN || !APP_ID || !GUILD_ID) {
 // Публичные команды (видны и доступны всем)
 const publicCommands = [
   { name: 'bp', description: 'Открыть боевой пропуск' },
+  {
+    name: 'bptop',
+    description: 'Таблица лидеров боевого пропуска (картинка)',
+    options: [
+      { name: 'count', description: 'Сколько мест показать (25–100)', type: 4, required: false, min_value: 25, max_value: 100 }
+    ]
+  },
   {
     name: 'code',
     description: 'Активировать промокод',
@@ -0,0 +1,175 @@
+// utils/bpMetrics.js
+// Метрики рендера БП в текстовом формате Prometheus (exposition 0.0.4).
+// Счётчики и гистограммы копятся в памяти процесса бота всегда (это дёшево);
+// наружу они уходят, только если задан хотя бы один из способов:
+//
+//   BP_METRICS_PORT=9464        HTTP GET /metrics на BP_METRICS_HOST
+//                               (по умолчанию 127.0.0.1 — только локально)
+//   BP_METRICS_FILE=path.prom   файл, перезаписываемый раз в
+//                               BP_METRICS_INTERVAL_MS (15000) — например,
+//                               для textfile-коллектора node_exporter
+//
+// Что пишется (имена с префиксом bp_render_):
+//   requests_total{kind,mode}          запросы рендера (rate() — частота)
+//   results_total{kind,outcome}        ok | error | timeout | shed
+//   duration_seconds{kind}             время ответа на стороне бота
+//   queue_wait_seconds                 ожидание свободного процесса пула
+//   stage_duration_seconds{stage}      стадии Python-рендера (decode, layers,
+//                                      paint, composite, encode, ...)
+//   output_bytes{kind}                 размер готовой картинки
+//   cache_total{result}                кэш готовых картинок: hit | miss | off
+//   degraded_total{step}               упрощения по бюджету времени
+//   fallbacks_total{reason}            ответ без картинки (статичный URL)
+// и состояние пула на момент снятия: queue_depth, inflight, workers, ...
+// (см. registerCollector в utils/bpRenderer.js).
+//
+// Модуль без зависимостей; подписи и гистограммы — минимум, нужный формату.
+
+const fs = require('fs');
+const http = require('http');
+const path = require('path');
+
+function intEnv(name, def) {
+  const v = parseInt(process.env[name], 10);
+  return Number.isFinite(v) && v >= 0 ? v : def;
+}
+
+const METRICS_PORT = intEnv('BP_METRICS_PORT', 0);
+const METRICS_HOST = process.env.BP_METRICS_HOST || '127.0.0.1';
+const METRICS_FILE = process.env.BP_METRICS_FILE || '';
+const METRICS_INTERVAL_MS = Math.max(1000, intEnv('BP_METRICS_INTERVAL_MS', 15000));
+
+// Границы гистограмм: секунды (до таймаута задания в 15 с) и байты
+const SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15];
+const BYTES_BUCKETS = [16384, 65536, 131072, 262144, 524288, 1048576, 2097152, 4194304];
+
+const metrics = new Map();     // имя -> {type, help, series: Map<labels, value>, buckets?}
+const collectors = [];         // () => [{name, type, help, value, labels?}]
+let server = null;
+let fileTimer = null;
+
+function enabled() {
+  return METRICS_PORT > 0 || !!METRICS_FILE;
+}
+
+function metric(name, type, help, buckets) {
+  let m = metrics.get(name);
+  if (!m) {
+    m = { type, help, series: new Map(), buckets };
+    metrics.set(name, m);
+  }
+  return m;
+}
+
+// {a: 'x', b: 'y'} -> 'a="x",b="y"' (ключ серии и готовая подпись)
+function labelText(labels) {
+  if (!labels) return '';
+  return Object.keys(labels).sort()
+    .map((k) => `${k}="${String(labels[k]).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n')}"`)
+    .join(',');
+}
+
+function inc(name, help, labels, by = 1) {
+  const series = metric(name, 'counter', help).series;
+  const key = labelText(labels);
+  series.set(key, (series.get(key) || 0) + by);
+}
+
+function observe(name, help, labels, value, buckets = SECONDS_BUCKETS) {
+  const m = metric(name, 'histogram', help, buckets);
+  const key = labelText(labels);
+  let h = m.series.get(key);
+  if (!h) {
+    h = { counts: new Array(m.buckets.length).fill(0), sum: 0, count: 0 };
+    m.series.set(key, h);
+  }
+  for (let i = 0; i < m.buckets.length; i++) {
+    if (value <= m.buckets[i]) h.counts[i]++;
+  }
+  h.sum += value;
+  h.count++;
+}
+
+// Значения, которые снимаются в момент запроса (состояние пула)
+function registerCollector(fn) {
+  collectors.push(fn);
+}
+
+function seriesName(name, labels, extra) {
+  const parts = [labels, extra].filter(Boolean).join(',');
+  return parts ? `${name}{${parts}}` : name;
+}
+
+function metricsText() {
+  const lines = [];
+  for (const [name, m] of metrics) {
+    lines.push(`# HELP ${name} ${m.help}`, `# TYPE ${name} ${m.type}`);
+    for (const [labels, v] of m.series) {
+      if (m.type !== 'histogram') {
+        lines.push(`${seriesName(name, labels)} ${v}`);
+        continue;
+      }
+      m.buckets.forEach((le, i) => lines.push(`${seriesName(`${name}_bucket`, labels, `le="${le}"`)} ${v.counts[i]}`));
+      lines.push(`${seriesName(`${name}_bucket`, labels, 'le="+Inf"')} ${v.count}`);
+      lines.push(`${seriesName(`${name}_sum`, labels)} ${v.sum}`);
+      lines.push(`${seriesName(`${name}_count`, labels)} ${v.count}`);
+    }
+  }
+  for (const collect of collectors) {
+    let rows = [];
+    try { rows = collect() || []; } catch (e) { console.error('[BP metrics]', e?.message || e); }
+    let last = null;
+    for (const r of rows) {
+      if (r.name !== last) {
+        lines.push(`# HELP ${r.name} ${r.help}`, `# TYPE ${r.name} ${r.type || 'gauge'}`);
+        last = r.name;
+      }
+      lines.push(`${seriesName(r.name, labelText(r.labels))} ${r.value}`);
+    }
+  }
+  return lines.join('\n') + '\n';
+}
+
+// Запись через временный файл и rename — читатель не увидит половину файла
+function writeMetricsFile(file = METRICS_FILE) {
+  const tmp = `${file}.${process.pid}.tmp`;
+  fs.mkdirSync(path.dirname(path.resolve(file)), { recursive: true });
+  fs.writeFileSync(tmp, metricsText());
+  fs.renameSync(tmp, file);
+}
+
+/**
+ * Запускает выдачу метрик (HTTP и/или файл) по настройкам из env.
+ * Повторный вызов ничего не делает.
+ */
+function startMetrics() {
+  if (METRICS_PORT > 0 && !server) {
+    server = http.createServer((req, res) => {
+      if (req.method !== 'GET' || req.url.split('?')[0] !== '/metrics') {
+        res.writeHead(404).end();
+        return;
+      }
+      res.writeHead(200, { 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8' });
+      res.end(metricsText());
+    });
+    server.on('error', (e) => console.error('[BP metrics] http:', e?.message || e));
+    server.listen(METRICS_PORT, METRICS_HOST);
+    server.unref();
+  }
+  if (METRICS_FILE && !fileTimer) {
+    fileTimer = setInterval(() => {
+      try { writeMetricsFile(); } catch (e) { console.error('[BP metrics] file:', e?.message || e); }
+    }, METRICS_INTERVAL_MS);
+    fileTimer.unref();
+  }
+}
+
+function stopMetrics() {
+  if (server) { server.close(); server = null; }
+  if (fileTimer) { clearInterval(fileTimer); fileTimer = null; }
+}
+
+module.exports = {
+  enabled, inc, observe, registerCollector, metricsText, writeMetricsFile, startMetrics, stopMetrics,
+  SECONDS_BUCKETS, BYTES_BUCKETS,
+};
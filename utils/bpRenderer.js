@@ -0,0 +1,590 @@
+// utils/bpRenderer.js
+// Клиент долгоживущего рендера БП: держит пул процессов
+// `scripts/overlay_bp_progress.py --serve` и шлёт им задания построчно (JSON).
+// Так интерпретатор, PIL и шрифты грузятся один раз, а не на каждый клик.
+// BP_RENDER_DAEMON=0 возвращает старое поведение (новый процесс на рендер).
+//
+// Пул: не больше BP_RENDER_WORKERS процессов (по умолчанию ядра минус одно —
+// оно остаётся боту), каждый рендерит одно задание за раз. Остальные ждут в
+// очереди длиной BP_RENDER_QUEUE; если она полна или задание прождало дольше
+// BP_RENDER_QUEUE_WAIT_MS, оно сразу отклоняется с err.code = 'EBPBUSY' —
+// пользователь получит embed без картинки вместо таймаута через 15 с.
+// Процесс после BP_RENDER_RECYCLE заданий завершается и при следующем
+// запросе запускается новый (утечки памяти PIL/фрагментация не копятся).
+// Задание, не получившее ответа за BP_RENDER_TIMEOUT_MS (15 с), отклоняется,
+// а его процесс убивается; очередь продолжает уже на новом процессе.
+// Кэш готовых картинок у каждого процесса свой; общий — BP_RESULT_CACHE_DIR.
+//
+// Одинаковые задания, пришедшие, пока такое же ещё рендерится (двойной клик,
+// несколько человек на одной странице), не запускают второй рендер: все
+// ждущие получают тот же ответ (и тот же Buffer — его нельзя менять).
+//
+// Бюджет времени: каждое задание уходит с budgetMs (BP_RENDER_BUDGET_MS,
+// по умолчанию 2500, 0 — без бюджета) за вычетом ожидания в очереди. Если
+// не успевает, Python-рендер упрощает картинку (быстрое кодирование,
+// шрифты без подбора, полосы без скругления) и перечисляет упрощения в
+// ответе полем degraded — картинка приходит вовремя вместо таймаута.
+//
+// Цвета полос, сдвиги панели и геометрия — в профиле рендера
+// config.bp_render.json (BP_PROFILE). Python-процессы сами перечитывают его
+// при изменении, renderProfile() / profileGeometry() отдают его на стороне
+// бота (геометрию полос для аргументов) — тоже с проверкой mtime и той же
+// проверкой содержимого: отвергнутая версия не применяется ни там, ни тут.
+//
+// renderLeaderboard() рисует таблицу лидеров (одна картинка на 25–100
+// игроков) тем же пулом: задание {"cmd": "leaderboard", "rows": [...]}.
+//
+// Метрики (utils/bpMetrics.js): каждый запрос рендера, ожидание в очереди,
+// стадии Python-рендера, размер картинки, попадания в кэш, упрощения,
+// таймауты и отказы, плюс состояние пула на момент снятия. Время стадий
+// демон отдаёт в каждом ответе полем stages ({стадия: ms}, без трассировки);
+// одноразовому процессу ради него передаётся --stages, только если метрики
+// выдаются наружу.
+//
+// Если out === '-', картинка не пишется на диск: демон отвечает строкой
+// {"size": N, ...} и следом N байт, одноразовый процесс — 4 байтами длины и
+// байтами в stdout. Байты приходят в ответе полем data (Buffer).
+const { spawn, execFile } = require('child_process');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const metrics = require('./bpMetrics');
+
+const SCRIPT_PATH = path.join(__dirname, '..', 'scripts', 'overlay_bp_progress.py');
+const PROFILE_PATH = process.env.BP_PROFILE || path.join(__dirname, '..', 'config.bp_render.json');
+const PYTHON = process.env.BP_PYTHON || 'python';
+const MAX_FRAME_BYTES = 64 * 1024 * 1024;
+
+function intEnv(name, def) {
+  const v = parseInt(process.env[name], 10);
+  return Number.isFinite(v) && v >= 0 ? v : def;
+}
+
+const JOB_TIMEOUT_MS = Math.max(1, intEnv('BP_RENDER_TIMEOUT_MS', 15000));
+
+const CORES = typeof os.availableParallelism === 'function' ? os.availableParallelism() : os.cpus().length;
+const POOL_SIZE = Math.max(1, intEnv('BP_RENDER_WORKERS', Math.max(1, CORES - 1)));
+const QUEUE_MAX = intEnv('BP_RENDER_QUEUE', 32);
+const QUEUE_WAIT_MS = intEnv('BP_RENDER_QUEUE_WAIT_MS', 8000);
+const RECYCLE_AFTER = intEnv('BP_RENDER_RECYCLE', 500);
+const BUDGET_MS = intEnv('BP_RENDER_BUDGET_MS', 2500);
+
+const workers = [];    // [{ proc, pending: Map<id, {resolve, reject, timer}>, busy, jobs, retired }]
+const queue = [];      // [{ job, env, resolve, reject, queuedAt }]
+const stats = { completed: 0, failed: 0, shed: 0, timeouts: 0, recycled: 0, spawned: 0, coalesced: 0, degraded: 0 };
+const inflight = new Map();   // ключ задания -> Promise ответа
+let nextId = 1;
+let oneShotRunning = 0;   // одноразовые процессы, которые сейчас рендерят
+
+function daemonEnabled() {
+  return process.env.BP_RENDER_DAEMON !== '0';
+}
+
+function failAll(d, err) {
+  for (const { reject, timer } of d.pending.values()) {
+    clearTimeout(timer);
+    reject(err);
+  }
+  d.pending.clear();
+}
+
+function settle(d, msg) {
+  const p = d.pending.get(msg.id);
+  if (!p) return;
+  d.pending.delete(msg.id);
+  clearTimeout(p.timer);
+  if (msg.ok) p.resolve(msg);
+  else p.reject(new Error(msg.error || 'render failed'));
+}
+
+// Разбор потока ответов: строка JSON, затем (если есть size) size сырых байт
+function frameReader(onMessage) {
+  let buf = Buffer.alloc(0);
+  let head = null;
+  return (chunk) => {
+    buf = buf.length ? Buffer.concat([buf, chunk]) : chunk;
+    for (;;) {
+      if (!head) {
+        const nl = buf.indexOf(10);
+        if (nl < 0) return;
+        const line = buf.subarray(0, nl).toString('utf8');
+        buf = buf.subarray(nl + 1);
+        try { head = JSON.parse(line); } catch { continue; }
+        if (!(head.size >= 0)) { onMessage(head); head = null; }
+        continue;
+      }
+      if (buf.length < head.size) return;
+      head.data = Buffer.from(buf.subarray(0, head.size));
+      buf = buf.subarray(head.size);
+      onMessage(head);
+      head = null;
+    }
+  };
+}
+
+function startDaemon(env) {
+  const proc = spawn(PYTHON, [SCRIPT_PATH, '--serve', '--warm'], { env, stdio: ['pipe', 'pipe', 'pipe'] });
+  const d = { proc, pending: new Map(), stderr: '', busy: false, jobs: 0, retired: false };
+  stats.spawned++;
+
+  proc.stdout.on('data', frameReader((msg) => settle(d, msg)));
+  proc.stderr.on('data', (chunk) => { d.stderr = (d.stderr + chunk).slice(-4000); });
+
+  const onExit = (err) => {
+    retire(d);
+    failAll(d, err instanceof Error ? err : new Error(d.stderr || `render daemon exited (${err})`));
+    drain();
+  };
+  proc.on('error', onExit);
+  proc.on('exit', (code) => onExit(code));
+  proc.stdin.on('error', () => {});
+  return d;
+}
+
+// Убирает процесс из пула; текущее задание (если есть) он ещё доделает
+function retire(d) {
+  const i = workers.indexOf(d);
+  if (i >= 0) workers.splice(i, 1);
+  if (d.retired) return;
+  d.retired = true;
+  try { d.proc.stdin.end(); } catch {}
+}
+
+function busyError(message) {
+  const err = new Error(message);
+  err.code = 'EBPBUSY';
+  return err;
+}
+
+// Раздаёт задания из очереди свободным процессам, при нужде запускает новые
+function drain() {
+  const now = Date.now();
+  while (queue.length) {
+    const item = queue[0];
+    if (now - item.queuedAt > QUEUE_WAIT_MS) {
+      queue.shift();
+      stats.shed++;
+      item.reject(busyError('render queue wait exceeded'));
+      continue;
+    }
+    let d = workers.find((w) => !w.busy);
+    if (!d) {
+      if (workers.length >= POOL_SIZE) return;
+      d = startDaemon(item.env);
+      workers.push(d);
+    }
+    queue.shift();
+    dispatch(d, item);
+  }
+}
+
+function dispatch(d, { job, resolve, reject, queuedAt }) {
+  const id = nextId++;
+  metrics.observe('bp_render_queue_wait_seconds', 'Time a job waited for a free render process', null,
+    (Date.now() - queuedAt) / 1000);
+  if (job.budgetMs > 0) job = { ...job, budgetMs: Math.max(1, job.budgetMs - (Date.now() - queuedAt)) };
+  d.busy = true;
+  const done = (fn) => (value) => {
+    d.busy = false;
+    d.jobs++;
+    if (RECYCLE_AFTER > 0 && d.jobs >= RECYCLE_AFTER) {
+      retire(d);
+      stats.recycled++;
+    }
+    fn(value);
+    drain();
+  };
+  const timer = setTimeout(() => {
+    d.pending.delete(id);
+    stats.timeouts++;
+    // Завис — убираем из пула и убиваем до drain() внутри done, иначе
+    // следующее задание из очереди уйдёт этому же процессу и умрёт с ним
+    retire(d);
+    try { d.proc.kill(); } catch {}
+    done(reject)(new Error('render timeout'));
+  }, JOB_TIMEOUT_MS);
+  d.pending.set(id, {
+    resolve: done((msg) => { stats.completed++; if (msg.degraded) stats.degraded++; resolve(msg); }),
+    reject: done((err) => { stats.failed++; reject(err); }),
+    timer,
+  });
+  d.proc.stdin.write(JSON.stringify({ ...job, id }) + '\n');
+}
+
+// Служебная запись ({"trace": {...}}, {"stages": {...}}, {"degraded": [...]}) из stderr одноразового процесса
+function fromStderr(se, key) {
+  const prefix = `{"${key}"`;
+  for (const line of String(se || '').split('\n')) {
+    if (!line.startsWith(prefix)) continue;
+    try { return JSON.parse(line)[key]; } catch {}
+  }
+  return undefined;
+}
+
+let profileCache = { stamp: null, data: null, geometry: null };
+
+// Проверка профиля — те же ключи и диапазоны, что validate_profile в
+// overlay_bp_progress.py: файл, который Python отверг, не принимается и здесь,
+// иначе бот слал бы в задания геометрию, которую рендер не применил.
+// -> геометрия {xPct, widthPct, topY, topH, botY, botH} (что задано);
+// Error с путём до поля, если что-то не так.
+const PROFILE_OFFSETS = {
+  top: ['dx', 'dy', 'padX'], mid: ['dx', 'dy'], inv: ['dx', 'dy', 'padX'],
+  raffle: ['dx', 'dy'], dd: ['dx', 'dy'], pack: ['dx', 'dy'],
+};
+const PROFILE_GEO_ROWS = { top: ['topY', 'topH'], bottom: ['botY', 'botH'] };
+
+function validateProfile(data) {
+  const keys = (obj, allowed, where) => {
+    if (obj === null || typeof obj !== 'object' || Array.isArray(obj)) throw new Error(`${where}: expected object`);
+    const extra = Object.keys(obj).filter((k) => !allowed.includes(k)).sort();
+    if (extra.length) throw new Error(`${where}: unknown key '${extra[0]}'`);
+    return obj;
+  };
+  const num = (v, where, int, lo, hi) => {
+    if (typeof v !== 'number' || !Number.isFinite(v) || (int && !Number.isInteger(v))) {
+      throw new Error(`${where}: expected ${int ? 'integer' : 'number'}`);
+    }
+    if (v < lo || v > hi) throw new Error(`${where}: ${v} is out of range ${lo}..${hi}`);
+    return v;
+  };
+  const color = (obj, where) => {
+    keys(obj, ['r', 'g', 'b', 'a'], where);
+    for (const [c, v] of Object.entries(obj)) num(v, `${where}.${c}`, true, 0, 255);
+  };
+
+  keys(data, ['geometry', 'bars', 'text', 'offsets', 'comment'], 'profile');
+  const bars = keys(data.bars ?? {}, ['radiusPct', 'color', 'top', 'bottom'], 'bars');
+  if ('radiusPct' in bars) num(bars.radiusPct, 'bars.radiusPct', false, 0, 1);
+  if ('color' in bars) color(bars.color, 'bars.color');
+  for (const row of ['top', 'bottom']) {
+    const pair = keys(bars[row] ?? {}, ['free', 'premium'], `bars.${row}`);
+    for (const [half, col] of Object.entries(pair)) color(col, `bars.${row}.${half}`);
+  }
+  const text = keys(data.text ?? {}, ['color'], 'text');
+  if ('color' in text) color(text.color, 'text.color');
+  const offsets = keys(data.offsets ?? {}, Object.keys(PROFILE_OFFSETS), 'offsets');
+  for (const [group, fields] of Object.entries(offsets)) {
+    keys(fields, PROFILE_OFFSETS[group], `offsets.${group}`);
+    for (const [k, v] of Object.entries(fields)) num(v, `offsets.${group}.${k}`, true, -10000, 10000);
+  }
+
+  const geometry = {};
+  const geo = keys(data.geometry ?? {}, ['xPct', 'widthPct', 'top', 'bottom'], 'geometry');
+  for (const k of ['xPct', 'widthPct']) {
+    if (k in geo) geometry[k] = num(geo[k], `geometry.${k}`, false, 0, 100);
+  }
+  for (const [row, [ykey, hkey]] of Object.entries(PROFILE_GEO_ROWS)) {
+    const r = keys(geo[row] ?? {}, ['yPct', 'heightPct', 'y', 'h'], `geometry.${row}`);
+    for (const [names, dst] of [[['yPct', 'y'], ykey], [['heightPct', 'h'], hkey]]) {
+      for (const k of names) {
+        if (k in r) geometry[dst] = num(r[k], `geometry.${row}.${k}`, false, 0, 100);
+      }
+    }
+  }
+  return geometry;
+}
+
+function loadProfile() {
+  let stamp = null;
+  try {
+    const st = fs.statSync(PROFILE_PATH);
+    stamp = `${st.mtimeMs}:${st.size}`;
+  } catch {
+    // Файла нет — как и Python, возвращаемся к значениям по умолчанию
+    // (предупреждаем один раз, пока файл не появится)
+    if (profileCache.stamp !== 'missing') {
+      console.warn('[BP profile]', `${PROFILE_PATH}: not found, using config.battlePass defaults`);
+    }
+    profileCache = { stamp: 'missing', data: null, geometry: null };
+    return profileCache;
+  }
+  if (stamp !== profileCache.stamp) {
+    try {
+      const data = JSON.parse(fs.readFileSync(PROFILE_PATH, 'utf8'));
+      profileCache = { stamp, data, geometry: validateProfile(data) };
+    } catch (e) {
+      // Битый или не прошедший проверку файл — остаёмся на прежней версии,
+      // как и Python-сторона
+      console.error('[BP profile]', `${PROFILE_PATH}: ${e?.message || e}, keeping the previous profile`);
+      profileCache = { ...profileCache, stamp };
+    }
+  }
+  return profileCache;
+}
+
+/**
+ * Содержимое принятого профиля рендера (объект) или null, если файла нет
+ * или ни одна его версия не прошла проверку. Файл перечитывается только
+ * при смене mtime/размера.
+ */
+function renderProfile() {
+  return loadProfile().data;
+}
+
+/**
+ * Геометрия полос из принятого профиля: {xPct, widthPct, topY, topH, botY, botH}
+ * (только заданные ключи) или null.
+ */
+function profileGeometry() {
+  const { geometry } = loadProfile();
+  return geometry ? { ...geometry } : null;
+}
+
+// Формат картинки по сигнатуре: одноразовый процесс отдаёт только байты,
+// без JSON-ответа с полем format
+function sniffFormat(data) {
+  return data.length >= 12 && data.toString('latin1', 0, 4) === 'RIFF' && data.toString('latin1', 8, 12) === 'WEBP'
+    ? 'webp' : 'png';
+}
+
+function renderOneShot(args, env, budgetMs) {
+  return new Promise((resolve, reject) => {
+    const opts = { timeout: JOB_TIMEOUT_MS, env, encoding: 'buffer', maxBuffer: MAX_FRAME_BYTES };
+    const argv = [...args, ...(budgetMs > 0 ? [`--budget=${budgetMs}`] : []), ...(metrics.enabled() ? ['--stages'] : [])];
+    execFile(PYTHON, [SCRIPT_PATH, ...argv], opts, (err, so, se) => {
+      if (err && err.killed) {
+        stats.timeouts++;
+        return reject(new Error('render timeout'));
+      }
+      if (err) return reject(new Error(String(se || '') || err.message));
+      const trace = fromStderr(se, 'trace');
+      const stages = fromStderr(se, 'stages');
+      const degraded = fromStderr(se, 'degraded');
+      if (degraded) stats.degraded++;
+      if (args[1] !== '-') return resolve({ ok: true, out: args[1], trace, stages, degraded });
+      if (so.length < 4 || so.readUInt32BE(0) !== so.length - 4) {
+        return reject(new Error('render: bad output frame'));
+      }
+      const data = so.subarray(4);
+      resolve({ ok: true, out: '-', size: data.length, data, format: sniffFormat(data), trace, stages, degraded });
+    });
+  });
+}
+
+/**
+ * Рендер одной картинки. args — позиционные аргументы overlay_bp_progress.py
+ * (in, out, pageStart, ...), env — окружение (BP_ENCODER, BP_TRACE и т.п.).
+ * Окружение применяется при старте демона; пока он жив, оно не меняется.
+ * out = '-' — картинка возвращается в data, без файла.
+ * stages в ответе — время стадий рендера в Python ({стадия: ms}); при
+ * BP_TRACE=1|mem есть и полная трассировка trace.
+ * budgetMs — бюджет времени (см. выше); degraded в ответе — применённые упрощения.
+ * @returns {Promise<{ok: boolean, out: string, ms?: number, data?: Buffer, format?: string, stages?: object, trace?: object, degraded?: string[]}>}
+ */
+function render(args, env = process.env, budgetMs = BUDGET_MS) {
+  return singleFlight(flightKey({ argv: args }, env), () => tracked('page', env, () => (
+    daemonEnabled()
+      ? renderJob({ argv: args, budgetMs }, env)
+      : renderOneShot(args, env, budgetMs)
+  )));
+}
+
+// Исход неудачного запроса для метрик
+function outcomeOf(err) {
+  if (err?.code === 'EBPBUSY') return 'shed';
+  return /timeout/i.test(err?.message || '') ? 'timeout' : 'error';
+}
+
+// Ответ (или массив ответов пакета) -> размеры, кэш, упрощения и стадии
+function recordResults(kind, res) {
+  for (const r of Array.isArray(res) ? res : [res]) {
+    if (!r || !r.ok) continue;
+    const bytes = r.size ?? r.bytes;
+    if (bytes >= 0) metrics.observe('bp_render_output_bytes', 'Encoded image size', { kind }, bytes, metrics.BYTES_BUCKETS);
+    if (r.cache) metrics.inc('bp_render_cache_total', 'Finished-image cache lookups by result', { result: r.cache });
+    for (const step of r.degraded || []) metrics.inc('bp_render_degraded_total', 'Budget degradations applied', { step });
+    for (const [stage, ms] of Object.entries(r.stages || {})) {
+      metrics.observe('bp_render_stage_duration_seconds', 'Python render time by stage', { stage }, ms / 1000);
+    }
+  }
+}
+
+/**
+ * Запрос рендера с метриками. run() запускает сам рендер.
+ */
+function tracked(kind, env, run) {
+  const mode = daemonEnabled() ? 'daemon' : 'oneshot';
+  const t0 = Date.now();
+  metrics.inc('bp_render_requests_total', 'Render requests sent to Python', { kind, mode });
+  if (mode === 'oneshot') oneShotRunning++;
+  const finish = (outcome) => {
+    if (mode === 'oneshot') oneShotRunning--;
+    metrics.inc('bp_render_results_total', 'Render requests by outcome', { kind, outcome });
+    metrics.observe('bp_render_duration_seconds', 'Render time seen by the bot, queue included', { kind }, (Date.now() - t0) / 1000);
+  };
+  return run().then((res) => {
+    finish('ok');
+    recordResults(kind, res);
+    return res;
+  }, (err) => {
+    finish(outcomeOf(err));
+    throw err;
+  });
+}
+
+// Ключ задания: сами аргументы плюс переменные BP_*, от которых зависит картинка
+function flightKey(job, env) {
+  const vars = Object.keys(env).filter((k) => k.startsWith('BP_')).sort().map((k) => `${k}=${env[k]}`);
+  return JSON.stringify(job) + '\0' + vars.join('\0');
+}
+
+function singleFlight(key, run) {
+  const running = inflight.get(key);
+  if (running) {
+    stats.coalesced++;
+    return running;
+  }
+  const p = run();
+  inflight.set(key, p);
+  const clear = () => { if (inflight.get(key) === p) inflight.delete(key); };
+  p.then(clear, clear);
+  return p;
+}
+
+// Задание пулу в JSON-формате демона
+function renderJob(job, env) {
+  return new Promise((resolve, reject) => {
+    const idle = workers.some((w) => !w.busy) || workers.length < POOL_SIZE;
+    if (!idle && queue.length >= QUEUE_MAX) {
+      stats.shed++;
+      return reject(busyError('render queue is full'));
+    }
+    queue.push({ job, env, resolve, reject, queuedAt: Date.now() });
+    drain();
+  });
+}
+
+// Пакет одним процессом: `overlay_bp_progress.py --batch -`, задания в stdin
+function renderBatchOneShot(jobs, env) {
+  return new Promise((resolve, reject) => {
+    const proc = spawn(PYTHON, [SCRIPT_PATH, '--batch', '-'], { env, stdio: ['pipe', 'pipe', 'pipe'] });
+    const results = new Array(jobs.length).fill(null);
+    let stderr = '';
+    let timedOut = false;
+    const timer = setTimeout(() => {
+      timedOut = true;
+      stats.timeouts++;
+      try { proc.kill(); } catch {}
+    }, JOB_TIMEOUT_MS * Math.max(1, Math.ceil(jobs.length / 4)));
+    proc.stdout.on('data', frameReader((msg) => {
+      if (msg.id in results) results[msg.id] = msg;
+    }));
+    proc.stderr.on('data', (chunk) => { stderr = (stderr + chunk).slice(-4000); });
+    proc.on('error', (err) => { clearTimeout(timer); reject(err); });
+    proc.on('close', (code) => {
+      clearTimeout(timer);
+      if (timedOut) return reject(new Error('render batch timeout'));
+      if (code !== 0 && code !== 2) return reject(new Error(stderr || `render batch exited (${code})`));
+      resolve(results.map((r) => r || { ok: false, error: 'no result' }));
+    });
+    proc.stdin.on('error', () => {});
+    proc.stdin.end(jobs.map((job, id) => JSON.stringify({ ...job, id })).join('\n') + '\n');
+  });
+}
+
+/**
+ * Рендер пачки картинок (все страницы пользователя, список пользователей).
+ * jobs — задания в формате демона ({argv: [...]} или {in, out, pageStart, ...}).
+ * Результаты в том же порядке; ошибка одного задания не роняет остальные.
+ * @returns {Promise<Array<{ok: boolean, data?: Buffer, error?: string}>>}
+ */
+function renderBatch(jobs, env = process.env) {
+  if (!daemonEnabled()) {
+    return tracked('batch', env, () => renderBatchOneShot(jobs, env));
+  }
+  return Promise.all(jobs.map((job) => {
+    return singleFlight(flightKey(job, env), () => tracked('page', env, () => renderJob(job, env)))
+      .catch((err) => ({ ok: false, error: err.message }));
+  }));
+}
+
+// Таблица лидеров одноразовым процессом: `--leaderboard -`, строки в stdin
+function renderLeaderboardOneShot(job, env, budgetMs) {
+  return new Promise((resolve, reject) => {
+    const argv = ['--leaderboard', '-', ...(budgetMs > 0 ? [`--budget=${budgetMs}`] : []), ...(metrics.enabled() ? ['--stages'] : [])];
+    const proc = spawn(PYTHON, [SCRIPT_PATH, ...argv], { env, stdio: ['pipe', 'pipe', 'pipe'] });
+    const chunks = [];
+    let stderr = '';
+    let timedOut = false;
+    const timer = setTimeout(() => {
+      timedOut = true;
+      stats.timeouts++;
+      try { proc.kill(); } catch {}
+    }, JOB_TIMEOUT_MS);
+    proc.stdout.on('data', (chunk) => chunks.push(chunk));
+    proc.stderr.on('data', (chunk) => { stderr = (stderr + chunk).slice(-4000); });
+    proc.on('error', (err) => { clearTimeout(timer); reject(err); });
+    proc.on('close', (code) => {
+      clearTimeout(timer);
+      if (timedOut) return reject(new Error('render timeout'));
+      if (code !== 0) return reject(new Error(stderr || `render leaderboard exited (${code})`));
+      const so = Buffer.concat(chunks);
+      if (so.length < 4 || so.readUInt32BE(0) !== so.length - 4) {
+        return reject(new Error('render: bad output frame'));
+      }
+      const trace = fromStderr(stderr, 'trace');
+      const stages = fromStderr(stderr, 'stages');
+      const degraded = fromStderr(stderr, 'degraded');
+      if (degraded) stats.degraded++;
+      const data = so.subarray(4);
+      resolve({ ok: true, out: '-', size: data.length, data, format: sniffFormat(data), trace, stages, degraded });
+    });
+    proc.stdin.on('error', () => {});
+    proc.stdin.end(JSON.stringify({ ...job, out: '-' }));
+  });
+}
+
+/**
+ * Таблица лидеров одной картинкой. rows — [{name, level, xpCur, xpNeed, premium}]
+ * в порядке мест (не больше 100), opts — {title, encoder}.
+ * @returns {Promise<{ok: boolean, data: Buffer, format?: string, rows?: number, degraded?: string[]}>}
+ */
+function renderLeaderboard(rows, opts = {}, env = process.env, budgetMs = BUDGET_MS) {
+  const job = { cmd: 'leaderboard', rows, title: opts.title || '', out: '-' };
+  if (opts.encoder) job.encoder = String(opts.encoder);
+  return singleFlight(flightKey(job, env), () => tracked('leaderboard', env, () => (
+    daemonEnabled()
+      ? renderJob({ ...job, budgetMs }, env)
+      : renderLeaderboardOneShot(job, env, budgetMs)
+  )));
+}
+
+// Состояние пула (для логов и метрик)
+function poolStats() {
+  return {
+    ...stats,
+    workers: workers.length,
+    busy: workers.filter((w) => w.busy).length,
+    queued: queue.length,
+    inflight: inflight.size,
+    poolSize: POOL_SIZE,
+    queueMax: QUEUE_MAX,
+  };
+}
+
+// Состояние пула для метрик — снимается в момент запроса /metrics
+metrics.registerCollector(() => {
+  const s = poolStats();
+  const gauge = (name, help, value) => ({ name, help, value, type: 'gauge' });
+  const counter = (name, help, value) => ({ name, help, value, type: 'counter' });
+  return [
+    gauge('bp_render_queue_depth', 'Jobs waiting for a free render process', s.queued),
+    gauge('bp_render_inflight', 'Renders running right now', daemonEnabled() ? s.busy : oneShotRunning),
+    gauge('bp_render_pending', 'Distinct render requests awaiting an answer', s.inflight),
+    gauge('bp_render_workers', 'Live render daemon processes', s.workers),
+    gauge('bp_render_pool_size', 'Maximum render daemon processes (BP_RENDER_WORKERS)', s.poolSize),
+    gauge('bp_render_queue_max', 'Render queue length limit (BP_RENDER_QUEUE)', s.queueMax),
+    counter('bp_render_coalesced_total', 'Requests answered by an identical render already running', s.coalesced),
+    counter('bp_render_timeouts_total', 'Renders killed after the job timeout', s.timeouts),
+    counter('bp_render_workers_spawned_total', 'Render daemon processes started', s.spawned),
+    counter('bp_render_workers_recycled_total', 'Render daemon processes retired after BP_RENDER_RECYCLE jobs', s.recycled),
+  ];
+});
+
+function shutdown() {
+  for (const d of workers.slice()) retire(d);
+  while (queue.length) queue.shift().reject(new Error('render pool shut down'));
+}
+
+module.exports = { render, renderBatch, renderLeaderboard, renderProfile, profileGeometry, poolStats, shutdown, SCRIPT_PATH, PROFILE_PATH };